@@ -0,0 +1,189 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+import numpy as np
+from geneticAlgParams import GAParams
+from makeRandomExpressions import generate_random_expr
+from fitnessAndValidityFunctions import make_env, compute_fitness, is_viable_expr
+from crossOverOperators import random_subtree_crossover, random_expression_mutation
+from exprCompiler import clear_compiled_cache
+from geneticSearchAlgorithms import GASolver
+
+# Benchmarks for the evaluation and evolution hot paths
+#
+#   python benchmarks.py --output before.json
+#   ... change something ...
+#   python benchmarks.py --output after.json
+#   python benchmarks.py --compare before.json after.json
+#
+# Every benchmark reseeds the random number generator, so two runs time exactly the same
+# expressions and data. Each measurement is repeated --repeats times; the JSON output
+# holds all the timings (seconds per call) together with their minimum and median.
+# The fitness cache is disabled so that the evaluations are really performed. The
+# evaluation benchmarks run with and without interval analysis (params.interval_analysis,
+# recorded in their config), and both with an empty cache of compiled expressions at the
+# start of every repeat ('compiled': 'cold', compilation included) and with all the
+# expressions already compiled ('compiled': 'warm').
+
+def target_function(x):
+    return 0.2 * math.exp(x/4.0) - math.sin(2*x)
+
+
+# Parameters with n_data training points and n_test+1 test points on [-10, 10]
+def make_params(n_data, n_test=100, interval_analysis=False):
+    params = GAParams()
+    params.fitness_cache_size = 0
+    params.interval_analysis = interval_analysis
+    data = []
+    for i in range(n_data):
+        x_value = -10.0 + 20.0 * random.random()
+        data.append(([x_value], target_function(x_value)))
+    params.regression_training_data = data
+    params.test_points = [[-10.0 + 20.0 * j / n_test] for j in range(n_test + 1)]
+    return params
+
+
+# Seconds per call of fn (called n_calls times per repeat), one value per repeat.
+# setup (if given) is called before every repeat, outside of the timing.
+def time_calls(fn, n_calls, repeats, setup=None):
+    timings = []
+    for r in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for j in range(n_calls):
+            fn(j)
+        timings.append((time.perf_counter() - start) / n_calls)
+    return timings
+
+
+def record(results, name, config, timings):
+    results.append({'name': name, 'config': config, 'seconds_per_call': timings,
+                    'min': min(timings), 'median': statistics.median(timings)})
+    print(f'{name:28s} {json.dumps(config):48s} min {min(timings)*1E6:12.2f} us  median {statistics.median(timings)*1E6:12.2f} us')
+
+
+# Random expressions of the given depth, the same ones for a given seed
+def sample_exprs(depth, n, params, seed):
+    random.seed(seed)
+    return [generate_random_expr(depth, ['x'], params) for j in range(n)]
+
+
+def bench_expressions(results, depths, data_sizes, n_exprs, repeats, seed, interval_settings=(False, True)):
+    base_params = make_params(100)
+    for depth in depths:
+        config = {'depth': depth}
+        random.seed(seed)
+        record(results, 'generate_random_expr', config,
+               time_calls(lambda j: generate_random_expr(depth, ['x'], base_params), n_exprs, repeats))
+        exprs = sample_exprs(depth, n_exprs, base_params, seed)
+        env = make_env(['x'], [0.5])
+
+        def eval_once(j):
+            try:
+                exprs[j].eval(env)
+            except Exception:
+                pass
+        record(results, 'Expr.eval', config, time_calls(eval_once, n_exprs, repeats))
+
+        def simplify_once(j):
+            try:
+                exprs[j].simplify()
+            except Exception:
+                pass
+        record(results, 'simplify', config, time_calls(simplify_once, n_exprs, repeats))
+        random.seed(seed)
+        record(results, 'random_subtree_crossover', config,
+               time_calls(lambda j: random_subtree_crossover(exprs[j], exprs[-1-j], copy=True), n_exprs, repeats))
+        random.seed(seed)
+        record(results, 'random_expression_mutation', config,
+               time_calls(lambda j: random_expression_mutation(exprs[j], ['x'], base_params, copy=True), n_exprs, repeats))
+        for n_data in data_sizes:
+            for interval_analysis in interval_settings:
+                random.seed(seed)
+                params = make_params(n_data, interval_analysis=interval_analysis)
+                for (name, fn) in [('is_viable_expr', lambda j: is_viable_expr(exprs[j], ['x'], params)),
+                                   ('compute_fitness', lambda j: compute_fitness(exprs[j], ['x'], params))]:
+                    data_config = {'depth': depth, 'n_data': n_data, 'interval_analysis': interval_analysis}
+                    record(results, name, dict(data_config, compiled='cold'),
+                           time_calls(fn, n_exprs, repeats, setup=clear_compiled_cache))
+                    time_calls(fn, n_exprs, 1)
+                    record(results, name, dict(data_config, compiled='warm'), time_calls(fn, n_exprs, repeats))
+
+
+def bench_generations(results, pop_sizes, data_sizes, repeats, seed, interval_settings=(False, True)):
+    for n_data in data_sizes:
+        for (pop_size, interval_analysis) in [(p, i) for p in pop_sizes for i in interval_settings]:
+            random.seed(seed)
+            params = make_params(n_data, interval_analysis=interval_analysis)
+            config = {'pop_size': pop_size, 'n_data': n_data, 'interval_analysis': interval_analysis}
+            timings = []
+            for r in range(repeats):
+                random.seed(seed + r)
+                # Every repeat compiles its expressions, like a fresh run
+                clear_compiled_cache()
+                solver = GASolver(params, ['x'], pop_size)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    solver.initialize()
+                    start = time.perf_counter()
+                    solver.run_generation()
+                    timings.append(time.perf_counter() - start)
+            record(results, 'GASolver generation', config, timings)
+
+
+## Function: run_benchmarks
+# Run all benchmarks and return the JSON document (see the top of this file)
+def run_benchmarks(depths=(2, 3, 4), pop_sizes=(100, 500), data_sizes=(100, 1000, 10000),
+                   n_exprs=200, repeats=5, seed=2023, interval_settings=(False, True)):
+    results = []
+    bench_expressions(results, depths, data_sizes, n_exprs, repeats, seed, interval_settings)
+    bench_generations(results, pop_sizes, data_sizes, repeats, seed, interval_settings)
+    return {'meta': {'python': sys.version.split()[0], 'numpy': np.__version__,
+                     'platform': platform.platform(), 'seed': seed, 'repeats': repeats,
+                     'n_exprs': n_exprs, 'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+            'results': results}
+
+
+# Print the ratio (new/old) of the minimum times of the benchmarks present in both runs
+def compare(old_doc, new_doc):
+    old = {(r['name'], json.dumps(r['config'], sort_keys=True)): r['min'] for r in old_doc['results']}
+    for r in new_doc['results']:
+        key = (r['name'], json.dumps(r['config'], sort_keys=True))
+        if key in old and old[key] > 0:
+            print(f'{key[0]:28s} {key[1]:48s} {r["min"]/old[key]:6.2f}x')
+
+
+def int_list(s):
+    return [int(v) for v in s.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the genetic search hot paths')
+    parser.add_argument('--depths', type=int_list, default=[2, 3, 4])
+    parser.add_argument('--pop-sizes', type=int_list, default=[100, 500])
+    parser.add_argument('--data-sizes', type=int_list, default=[100, 1000, 10000])
+    parser.add_argument('--n-exprs', type=int, default=200, help='expressions per measurement')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=2023)
+    parser.add_argument('--interval-analysis', choices=['off', 'on', 'both'], default='both',
+                        help='params.interval_analysis of the evaluation benchmarks')
+    parser.add_argument('--output', default='benchmarks.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files instead of running')
+    args = parser.parse_args()
+    if args.compare is not None:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+    else:
+        interval_settings = {'off': (False,), 'on': (True,), 'both': (False, True)}[args.interval_analysis]
+        doc = run_benchmarks(args.depths, args.pop_sizes, args.data_sizes, args.n_exprs, args.repeats, args.seed,
+                             interval_settings)
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=1)
+        print(f'Wrote {args.output}')
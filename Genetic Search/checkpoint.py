@@ -0,0 +1,127 @@
+import os
+import random
+import numpy as np
+from linearGenome import LinearGenome, genome_dtype
+from hashConsing import intern
+
+# Checkpoints of a GASolver
+#
+# A checkpoint holds everything needed to continue a run: the population and the elites
+# with their fitness values, the best solution so far, the population statistics (and the
+# per-evaluation statistics of steady-state runs), the iteration counters, the mini-batch state and the state of the random module.
+# It is an uncompressed .npz file of plain numpy arrays (loaded with allow_pickle=False).
+# Individuals are stored in the linearGenome encoding: the prefix order records of all
+# of them are concatenated into a single array and offsets[j]:offsets[j+1] is individual j.
+# Writing one is a few array copies, cheap enough to do every few generations
+# (params.checkpoint_path/checkpoint_interval, see GASolver.run_ga_iterations).
+
+checkpoint_format_version = 1
+
+
+# (code, offsets) encoding of a list of individuals (see the top of this file)
+def encode_individuals(individuals, lst_of_identifiers):
+    codes = []
+    for e in individuals:
+        if not isinstance(e, LinearGenome):
+            e = LinearGenome.from_expr(e, lst_of_identifiers)
+        codes.append(e.code)
+    offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(code) for code in codes])
+    code = np.concatenate(codes) if len(codes) > 0 else np.zeros(0, dtype=genome_dtype)
+    return (code, offsets)
+
+
+# Individuals of the given genome representation from their (code, offsets) encoding
+def decode_individuals(code, offsets, lst_of_identifiers, representation):
+    individuals = []
+    for j in range(len(offsets) - 1):
+        e = LinearGenome(code[offsets[j]:offsets[j+1]].copy(), lst_of_identifiers)
+        if representation != 'linear':
+            e = e.to_expr()
+            if representation == 'dag':
+                e = intern(e)
+        individuals.append(e)
+    return individuals
+
+
+## Function: save_checkpoint
+# Write the state of solver to path (atomically: a partially written checkpoint never
+# replaces the previous one).
+def save_checkpoint(solver, path):
+    individuals = [e for (e, _) in solver.pop] + [e for (e, _) in solver.elites]
+    fitness = [fit for (_, fit) in solver.pop] + [fit for (_, fit) in solver.elites]
+    has_best = solver.best_solution_so_far is not None
+    if has_best:
+        individuals.append(solver.best_solution_so_far)
+        fitness.append(solver.best_fitness_so_far)
+    (code, offsets) = encode_individuals(individuals, solver.identifiers)
+    (rng_version, rng_words, rng_gauss) = random.getstate()
+    has_order = solver.minibatch_order is not None
+    arrays = {
+        'format_version': np.array([checkpoint_format_version], dtype=np.int64),
+        'identifiers': np.array(list(solver.identifiers), dtype=str),
+        'representation': np.array([solver.params.genome_representation], dtype=str),
+        'counts': np.array([len(solver.pop), len(solver.elites), int(has_best)], dtype=np.int64),
+        'code': code,
+        'offsets': offsets,
+        'fitness': np.array(fitness, dtype=np.float64),
+        'best_fitness': np.array([solver.best_fitness_so_far], dtype=np.float64),
+        'population_stats': np.array(solver.population_stats, dtype=np.float64),
+        'evaluation_stats': np.array(solver.evaluation_stats, dtype=np.float64),
+        'scalars': np.array([solver.N, solver.iterNum, solver.minibatch_pos, int(has_order)], dtype=np.int64),
+        'minibatch_order': np.asarray(solver.minibatch_order if has_order else [], dtype=np.int64),
+        'rng_version': np.array([rng_version], dtype=np.int64),
+        'rng_words': np.array(rng_words, dtype=np.uint32),
+        'rng_gauss': np.array([np.nan if rng_gauss is None else rng_gauss, int(rng_gauss is not None)], dtype=np.float64),
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+## Function: load_checkpoint
+# Read a checkpoint written by save_checkpoint. Returns a dict with the arrays of the file;
+# pass it to restore_checkpoint.
+def load_checkpoint(path):
+    with np.load(path, allow_pickle=False) as data:
+        state = {name: data[name] for name in data.files}
+    assert int(state['format_version'][0]) == checkpoint_format_version, f'unsupported checkpoint format {state["format_version"][0]}'
+    return state
+
+
+# Population size stored in a checkpoint
+def checkpoint_pop_size(state):
+    return int(state['scalars'][0])
+
+
+## Function: restore_checkpoint
+# Put solver (a GASolver built with the same identifiers and representation) back in the
+# state stored in the checkpoint, including the state of the random module.
+def restore_checkpoint(solver, state):
+    identifiers = [str(id) for id in state['identifiers']]
+    assert identifiers == list(solver.identifiers), f'checkpoint identifiers {identifiers} differ from {solver.identifiers}'
+    representation = str(state['representation'][0])
+    assert representation == solver.params.genome_representation, \
+        f'checkpoint representation {representation} differs from {solver.params.genome_representation}'
+    (n_pop, n_elites, has_best) = [int(c) for c in state['counts']]
+    individuals = decode_individuals(state['code'], state['offsets'], identifiers, representation)
+    fitness = [float(f) for f in state['fitness']]
+    solver.pop = list(zip(individuals[:n_pop], fitness[:n_pop]))
+    solver.elites = list(zip(individuals[n_pop:n_pop + n_elites], fitness[n_pop:n_pop + n_elites]))
+    solver.best_fitness_so_far = float(state['best_fitness'][0])
+    solver.best_solution_so_far = None
+    if has_best:
+        solver.best_solution_so_far = solver.as_expr(individuals[-1])
+    solver.population_stats = [float(f) for f in state['population_stats']]
+    # (absent from the checkpoints written before it was recorded)
+    solver.evaluation_stats = [float(f) for f in state.get('evaluation_stats', [])]
+    (n, iter_num, minibatch_pos, has_order) = [int(v) for v in state['scalars']]
+    solver.N = n
+    solver.k = int(solver.params.elitism_fraction * n)
+    solver.iterNum = iter_num
+    solver.minibatch_pos = minibatch_pos
+    solver.minibatch_order = state['minibatch_order'] if has_order else None
+    (gauss, has_gauss) = state['rng_gauss']
+    random.setstate((int(state['rng_version'][0]), tuple([int(w) for w in state['rng_words']]),
+                     float(gauss) if has_gauss else None))
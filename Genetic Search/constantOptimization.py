@@ -0,0 +1,159 @@
+from copy import deepcopy
+import numpy as np
+from symbolicExpressions import *
+from fitnessAndValidityFunctions import all_point_blocks
+
+# Local optimization of the numeric constants of an expression
+#
+# The GA only changes constants by replacing them with random ones. Here the Const
+# leaves of a tree are gathered into a parameter vector theta and fitted to the
+# training data with Levenberg-Marquardt steps. The values and the Jacobian
+# d(output)/d(theta) are computed together in one forward pass over the batch of all
+# points (forward mode differentiation, see values_and_jacobian). A step is only kept
+# if the expression stays viable on the test points and its fitness improves.
+
+# Derivatives of the unary functions of UnaryFnApplication (f is the argument, v the value)
+derivative_funs = {
+    'sin': lambda f, v: np.cos(f),
+    'cos': lambda f, v: -np.sin(f),
+    'exp': lambda f, v: v,
+    'log': lambda f, v: 1.0/f,
+    'atan': lambda f, v: 1.0/(1.0 + f*f),
+    'tanh': lambda f, v: 1.0 - v*v,
+    'sinh': lambda f, v: np.cosh(f),
+    'cosh': lambda f, v: np.sinh(f),
+    'sqrt': lambda f, v: 0.5/v,
+}
+
+
+# The distinct Const leaves of e (in a fixed order)
+def const_leaves(e):
+    leaves = []
+    seen = set()
+    stack = [e]
+    while stack:
+        ej = stack.pop()
+        if id(ej) in seen:
+            continue
+        seen.add(id(ej))
+        if isinstance(ej, Const):
+            leaves.append(ej)
+        elif not ej.is_leaf_expr():
+            stack.extend([ej.get_child(j) for j in reversed(range(ej.num_children()))])
+    return leaves
+
+
+# (values, jacobian) of e over the n points of X. index maps id(leaf) to the position of
+# each Const leaf in theta; jacobian has shape (n, len(index)), or is None when the
+# subtree contains none of those leaves.
+def values_and_jacobian(e, X, n, index):
+    if e.is_leaf_expr():
+        v = e.eval_batch(X)
+        if id(e) not in index:
+            return (v, None)
+        jac = np.zeros((n, len(index)))
+        jac[:, index[id(e)]] = 1.0
+        return (v, jac)
+    children = [values_and_jacobian(e.get_child(j), X, n, index) for j in range(e.num_children())]
+    flist = [v for (v, _) in children]
+    v = e.apply_batch(flist, n)
+    if all([jac is None for (_, jac) in children]):
+        return (v, None)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        if isinstance(e, Plus):
+            jac = sum([jac for (_, jac) in children if jac is not None])
+        elif isinstance(e, Mult):
+            jac = np.zeros((n, len(index)))
+            for (j, (_, jac_j)) in enumerate(children):
+                if jac_j is not None:
+                    others = reduce(np.multiply, [f for (k, f) in enumerate(flist) if k != j], np.ones(n))
+                    jac = jac + others[:, None] * jac_j
+        elif isinstance(e, Minus):
+            ((_, jac1), (_, jac2)) = children
+            jac = (jac1 if jac1 is not None else 0.0) - (jac2 if jac2 is not None else 0.0)
+        elif isinstance(e, Div):
+            ((f1, jac1), (f2, jac2)) = children
+            jac = 0.0
+            if jac1 is not None:
+                jac = jac1 / f2[:, None]
+            if jac2 is not None:
+                jac = jac - (f1 / (f2 * f2))[:, None] * jac2
+        else:
+            assert isinstance(e, UnaryFnApplication)
+            assert e.fn_name in derivative_funs
+            jac = derivative_funs[e.fn_name](flist[0], v)[:, None] * children[0][1]
+    return (v, jac)
+
+
+# Viability, fitness and the Gauss-Newton terms J^T J and J^T r (jacobian J, residuals r
+# over the training points) of e, accumulated over the blocks of points. The terms are
+# None if e has no constants or the jacobian is not finite.
+def fitness_and_normal_equations(e, blocks, index):
+    (fitness, jtj, gradient) = (0.0, 0, 0)
+    for (b, block) in enumerate(blocks.blocks):
+        try:
+            (v, jac) = values_and_jacobian(e, block.X, block.n, index)
+        except EvaluationFailedException:
+            (v, jac) = (None, None)
+        (viable, fitness, finished) = blocks.accumulate(fitness, b, v, None)
+        if finished:
+            return (viable, fitness, None, None)
+        if jac is None or jtj is None:
+            (jtj, gradient) = (None, None)
+            continue
+        jac_train = jac[block.train_index]
+        if not np.all(np.isfinite(jac_train)):
+            (jtj, gradient) = (None, None)
+            continue
+        jtj = jtj + jac_train.T @ jac_train
+        gradient = gradient + jac_train.T @ (v[block.train_index] - block.y)
+    return (True, fitness, jtj, gradient)
+
+
+## Function: optimize_constants
+# Fit the constants of fun_expr with at most n_steps Levenberg-Marquardt steps.
+# fun_expr is not modified. Returns (expr, viable, fitness) where expr is a copy of
+# fun_expr with the fitted constants (or fun_expr itself if nothing was improved).
+def optimize_constants(fun_expr, lst_of_identifiers, params, n_steps=None):
+    if n_steps is None:
+        n_steps = params.constant_optimization_steps
+    blocks = all_point_blocks(lst_of_identifiers, params)
+    e = deepcopy(fun_expr)
+    leaves = const_leaves(e)
+    index = {id(leaf): j for (j, leaf) in enumerate(leaves)}
+    (viable, fitness, jtj, gradient) = fitness_and_normal_equations(e, blocks, index)
+    if not viable or fitness == -float('inf') or len(leaves) == 0 or jtj is None:
+        return (fun_expr, viable, fitness)
+    theta = np.array([leaf.get_constant() for leaf in leaves], dtype=float)
+    start_fitness = fitness
+    damping = params.constant_optimization_damping
+    for step in range(n_steps):
+        if jtj is None:
+            break
+        improved = False
+        # Increase the damping until the step improves the fitness (at most 10 tries)
+        for attempt in range(10):
+            a = jtj + damping * np.diag(np.diag(jtj) + 1E-12)
+            try:
+                delta = np.linalg.solve(a, -gradient)
+            except np.linalg.LinAlgError:
+                delta = np.linalg.lstsq(a, -gradient, rcond=None)[0]
+            new_theta = theta + delta
+            if np.all(np.isfinite(new_theta)):
+                for (leaf, f) in zip(leaves, new_theta):
+                    leaf.set_constant(float(f))
+                (new_viable, new_fitness, new_jtj, new_gradient) = fitness_and_normal_equations(e, blocks, index)
+                if new_viable and new_fitness > fitness:
+                    (theta, jtj, gradient, fitness) = (new_theta, new_jtj, new_gradient, new_fitness)
+                    damping = damping / 10.0
+                    improved = True
+                    break
+            damping = damping * 10.0
+        # Back to the last accepted constants
+        for (leaf, f) in zip(leaves, theta):
+            leaf.set_constant(float(f))
+        if not improved or -fitness <= 1E-12:
+            break
+    if fitness <= start_fitness:
+        return (fun_expr, True, start_fitness)
+    return (e, True, fitness)
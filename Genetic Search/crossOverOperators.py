@@ -5,7 +5,7 @@ from random import choice
 from random import choice, random 
 from symbolicExpressions import * 
 from geneticAlgParams import GAParams
-from makeRandomExpressions import generate_random_expr
+from makeRandomExpressions import generate_random_expr, generate_bounded_random_expr
 
 class CollectSubExprsVisitorForCrossOver(ExpressionVisitorPattern):
     def __init__(self, ret_list): 
@@ -41,13 +41,101 @@ def collect_all_subexpressions(e):
     e_subexpr_collector.visitExpr(e)
     return e_subexpr_list
 
-def random_subtree_crossover(e1, e2, copy = True): 
+# Like collect_all_subexpressions, with the path from the root to each subexpression:
+# the list of (parent, child index) pairs leading to it (see simulatedAnnealing.replace_on_path)
+def internal_nodes_with_paths(e):
+    ret_list = []
+    stack = [(e, ())]
+    while stack:
+        (ej, path) = stack.pop()
+        if not ej.is_leaf_expr():
+            ret_list.append((ej, path))
+            for j in range(ej.num_children()):
+                stack.append((ej.get_child(j), path + ((ej, j),)))
+    return ret_list
+
+# Size/depth limits (GAParams.max_tree_size/max_tree_depth, None means no limit)
+#
+# The operators below only build offspring within the limits. A crossover slot is a
+# subtree that can be exchanged, described by (ref, level, size, depth): ref locates it
+# (representation dependent), level is its distance from the root and size/depth are
+# those of the subtree. Putting the subtree of slot y at slot x of a tree of size_x nodes
+# gives a tree of size_x - x.size + y.size nodes and depth at most x.level + y.depth
+# (when the tree itself was within the depth limit).
+
+def slot_fits(x, y, size_x, max_size, max_depth):
+    (_, level_x, sub_size_x, _) = x
+    (_, _, sub_size_y, sub_depth_y) = y
+    return (max_size is None or size_x - sub_size_x + sub_size_y <= max_size) and \
+           (max_depth is None or level_x + sub_depth_y <= max_depth)
+
+# A random pair of slots (one of slots_a, one of slots_b) that can be exchanged within the
+# limits, or None if none was found in n_tries draws of the slot of the first tree.
+def choose_crossover_slots(slots_a, size_a, slots_b, size_b, max_size, max_depth, n_tries=10):
+    for t in range(n_tries):
+        x = choice(slots_a)
+        fitting = [y for y in slots_b if slot_fits(x, y, size_a, max_size, max_depth)
+                   and slot_fits(y, x, size_b, max_size, max_depth)]
+        if len(fitting) > 0:
+            return (x, choice(fitting))
+    return None
+
+# Crossover slots of an expression: ref is (parent, child index, path to the parent)
+def expr_crossover_slots(e):
+    sizes = {}
+    stack = [(e, False)]
+    while stack:
+        (ej, expanded) = stack.pop()
+        if ej.is_leaf_expr():
+            sizes[id(ej)] = (1, 0)
+        elif expanded:
+            children = [sizes[id(ej.get_child(j))] for j in range(ej.num_children())]
+            sizes[id(ej)] = (1 + sum([c[0] for c in children]), 1 + max([c[1] for c in children]))
+        elif id(ej) not in sizes:
+            stack.append((ej, True))
+            stack.extend([(ej.get_child(j), False) for j in range(ej.num_children())])
+    slots = []
+    for (node, path) in internal_nodes_with_paths(e):
+        for j in range(node.num_children()):
+            (size, depth) = sizes[id(node.get_child(j))]
+            slots.append(((node, j, path), len(path) + 1, size, depth))
+    return slots
+
+# Whether e can be put under a new parent node within the limits
+def can_grow(e, params):
+    return (params.max_tree_size is None or e.size() + 2 <= params.max_tree_size) and \
+           (params.max_tree_depth is None or e.depth() + 1 <= params.max_tree_depth)
+
+# Depth and size limits for a random expression put in place of child of e
+def replacement_limits(e, child, params):
+    max_size = None
+    if params.max_tree_size is not None:
+        max_size = max(1, params.max_tree_size - (e.size() - child.size()))
+    return (e.depth() - 1, max_size)
+
+# Exchange child sub1 of e_subst1 and child sub2 of e_subst2. The subtrees move from one
+# tree to the other, so they are detached first (set_child would copy them otherwise).
+def swap_children(e_subst1, sub1, e_subst2, sub2):
+    e_child1 = e_subst1.get_child(sub1).detach()
+    e_child2 = e_subst2.get_child(sub2).detach()
+    e_subst1.set_child(sub1, e_child2)
+    e_subst2.set_child(sub2, e_child1)
+
+def random_subtree_crossover(e1, e2, copy = True, max_size = None, max_depth = None): 
     # Crossover operator must take two expressions e1 and e2
     # Return a tuple of expresions (e3, e4)..
     if e1.is_leaf_expr() or e2.is_leaf_expr():
         return (e1, e2)
     e_a = deepcopy(e1) if copy else e1 
     e_b = deepcopy(e2) if copy else e2
+    if max_size is not None or max_depth is not None:
+        slots = choose_crossover_slots(expr_crossover_slots(e_a), e_a.size(), expr_crossover_slots(e_b), e_b.size(),
+                                       max_size, max_depth)
+        if slots is None:
+            return (e_a, e_b)
+        (((e_subst1, sub1, _), _, _, _), ((e_subst2, sub2, _), _, _, _)) = slots
+        swap_children(e_subst1, sub1, e_subst2, sub2)
+        return (e_a, e_b)
     
     ea_subexpr_list = collect_all_subexpressions(e_a)
     eb_subexpr_list = collect_all_subexpressions(e_b)
@@ -57,43 +145,59 @@ def random_subtree_crossover(e1, e2, copy = True):
     # Now choose a random child from each subexpression
     sub1 = choice(range(e_subst1.num_children()))
     sub2 = choice(range(e_subst2.num_children()))
-    e_child1 = e_subst1.get_child(sub1)
-    e_child2 = e_subst2.get_child(sub2)
     # Implement the crossover
-    e_subst1.set_child(sub1, e_child2)
-    e_subst2.set_child(sub2, e_child1)
+    swap_children(e_subst1, sub1, e_subst2, sub2)
     # Return the results
     return (e_a, e_b)
 
 
-def situate_expression_into_random_expr(e_orig, lst_of_identifiers, params):
+# With the size/depth limits of params the result stays within them if can_grow(e_orig, params)
+# With share, e_orig is shared by the new node as it is instead of being adopted (copied if
+# it belongs to a tree), like the children of Expr.with_child (see simulatedAnnealing).
+def situate_expression_into_random_expr(e_orig, lst_of_identifiers, params, share=False):
+    # The new node is built around a placeholder first child that with_child then replaces
+    e_first = Const(0.0) if share else e_orig
     u = random()
     if u <= 0.8:
-        e1 = generate_random_expr(params.depth, lst_of_identifiers, params)
+        if params.max_tree_size is None and params.max_tree_depth is None:
+            e1 = generate_random_expr(params.depth, lst_of_identifiers, params)
+        else:
+            depth = params.depth if params.max_tree_depth is None else min(params.depth, params.max_tree_depth - 1)
+            max_size = None if params.max_tree_size is None else max(1, params.max_tree_size - e_orig.size() - 1)
+            e1 = generate_bounded_random_expr(depth, max_size, lst_of_identifiers, params)
         if u <= 0.2:
-            return Plus([e_orig, e1])
+            e_new = Plus([e_first, e1])
         elif u <= 0.4:
-            return Minus(e_orig, e1)
+            e_new = Minus(e_first, e1)
         elif u <= 0.6:
-            return Div(e_orig, e1)
+            e_new = Div(e_first, e1)
         else: 
-            return Mult([e_orig, e1])
+            e_new = Mult([e_first, e1])
     else:
         fn = choice(params.allowed_unary_funs)
-        return UnaryFnApplication(fn, e_orig)
+        e_new = UnaryFnApplication(fn, e_first)
+    return e_new.with_child(0, e_orig) if share else e_new
 
 
 def random_expression_mutation(e_orig, lst_of_identifiers, params, copy=True):
     e_copy = deepcopy(e_orig) if copy else e_orig 
     e_subexprs = collect_all_subexpressions(e_copy)
     e_random_subexpr = choice(e_subexprs)
+    # The subexpression becomes the new root. The rest of a copy is dropped, so it is
+    # detached from it (with copy=False it stays part of e_orig).
+    if copy:
+        e_random_subexpr.detach()
     if random() <= params.replace_by_subexpr:
         return e_random_subexpr
-    elif random() <= params.grow_subexpr:
+    elif random() <= params.grow_subexpr and can_grow(e_random_subexpr, params):
         return situate_expression_into_random_expr(e_random_subexpr, lst_of_identifiers, params)
     else: 
         child_id = choice(range(e_random_subexpr.num_children()))
-        rexpr = generate_random_expr(e_random_subexpr.depth()-1, lst_of_identifiers, params)
+        if params.max_tree_size is None:
+            rexpr = generate_random_expr(e_random_subexpr.depth()-1, lst_of_identifiers, params)
+        else:
+            (depth, max_size) = replacement_limits(e_random_subexpr, e_random_subexpr.get_child(child_id), params)
+            rexpr = generate_bounded_random_expr(depth, max_size, lst_of_identifiers, params)
         e_random_subexpr.set_child(child_id, rexpr)
         return e_random_subexpr
 
@@ -2,8 +2,66 @@ from geneticAlgParams import GAParams
 from geneticSearchAlgorithms import curve_fit_using_genetic_algorithm
 from random import random
 import math 
-from matplotlib import pyplot as plt
+import os
 from simulatedAnnealing import run_simulated_annealing 
+from exprCompiler import compile_expr
+import numpy as np
+
+# matplotlib is only imported when something is plotted, so that batch runs (see
+# curveFittingCli) neither pay for it nor need a display. With headless the figures
+# are drawn off screen (to be saved to files).
+def get_pyplot(headless=False):
+    import matplotlib
+    if headless:
+        matplotlib.use('Agg')
+    from matplotlib import pyplot
+    return pyplot
+
+# Run the chosen method ('ga' or 'sa') and return (best_expr, best_fitness, stats)
+# n_sa_steps: number of steps of simulated annealing;
+# n_workers, callback, worker_addresses: see curve_fit_using_genetic_algorithm
+def run_curve_fitting(params, lst_of_identifiers, pop_size, num_iters, method, n_sa_steps=20000, n_workers=None, callback=None,
+                      worker_addresses=None):
+    if method == 'ga':
+        (best_expr, best_fitness, stats) = curve_fit_using_genetic_algorithm(params, lst_of_identifiers, pop_size, num_iters,
+                                                                             n_workers, callback, worker_addresses)
+        best_expr = best_expr.simplify()
+        print(f'GA Returned Solution: {best_expr} with fitness {best_fitness}')
+    else: 
+        params.temperature = params.simulated_annealing_start_temp
+        (best_expr, best_fitness, stats) = run_simulated_annealing(n_sa_steps, lst_of_identifiers, params)
+        best_expr = best_expr.simplify()
+        print(f'SA Returned Solution: {best_expr} with fitness {best_fitness}')
+    return (best_expr, best_fitness, stats)
+
+# Figure 1: the data points and the fitted curve (plus the ground truth if given) of a single
+# identifier id; figure 2: the max fitness after every iteration.
+# The figures are saved to plot_path (figure 2 to <name>-stats<ext>) if given, otherwise shown.
+def plot_results(id, x_values, y_values, test_xvalues, fit_values, stats, truth_values=None, plot_path=None):
+    plt = get_pyplot(headless=plot_path is not None)
+    plt.figure(1)
+    plt.plot(x_values, y_values, 'x')
+    plt.plot(test_xvalues, fit_values, 'r-', label='ga_fit')
+    if truth_values is not None:
+        plt.plot(test_xvalues, truth_values, 'g-', label='ground-truth')
+    plt.legend()
+    plt.xlabel(id)
+    plt.ylabel('y')
+    plot_stats(plt, stats)
+    if plot_path is None:
+        plt.show()
+    else:
+        (root, ext) = os.path.splitext(plot_path)
+        plt.figure(1).savefig(plot_path)
+        plt.figure(2).savefig(root + '-stats' + (ext or '.png'))
+        plt.close('all')
+
+def plot_stats(plt, stats):
+    plt.figure(2)
+    plt.plot(range(len(stats)), [st for st in stats], 'b-')
+    plt.xlabel('Iters')
+    plt.ylabel('Max Fitness')
+
 def one_dimensional_curve_fitting_test(lambda_fun, x_limits, n_data_points, pop_size = 1000, num_iters = 100, n_test_points = 100, method='ga'):
     params = GAParams()
     (a, b) = x_limits
@@ -21,30 +79,51 @@ def one_dimensional_curve_fitting_test(lambda_fun, x_limits, n_data_points, pop_
     
     params.test_points = test_points
     params.regression_training_data = data 
-    if method == 'ga':
-        (best_expr, best_fitness, stats) = curve_fit_using_genetic_algorithm(params, ['x'], pop_size, num_iters)
-        best_expr = best_expr.simplify()
-        print(f'GA Returned Solution: {best_expr} with fitness {best_fitness}')
-    else: 
-        params.temperature = params.simulated_annealing_start_temp
-        (best_expr, best_fitness, stats) = run_simulated_annealing(20000, ['x'], params)
-    plt.figure(1)
+    (best_expr, best_fitness, stats) = run_curve_fitting(params, ['x'], pop_size, num_iters, method)
     x_values = [x_value for ([x_value], _) in data]
-    plt.plot(x_values, [y for (_,y) in data],'x')
     test_xvalues = sorted([x for [x] in test_points])
-    result = [best_expr.eval({'x':x_value}) for x_value in test_xvalues ]
+    best_fn = compile_expr(best_expr)
+    result = [best_fn({'x':x_value}) for x_value in test_xvalues ]
     gTruth = [lambda_fun(x_value) for x_value in test_xvalues ]
-    plt.plot(test_xvalues, result, 'r-',label='ga_fit')
-    plt.plot(test_xvalues, gTruth, 'g-', label='ground-truth')
-    plt.legend()
-    plt.xlabel('x')
-    plt.ylabel('y')
-    plt.figure(2)
-    plt.plot(range(len(stats)), [st for st in stats], 'b-')
-    plt.xlabel('Iters')
-    plt.ylabel('Max Fitness')
-    #plt.plot(range(len(stats)), [(st[1] if st[1] > -100 else -100) for st in stats], 'r--')
-    plt.show()
+    plot_results('x', x_values, [y for (_,y) in data], test_xvalues, result, stats, gTruth)
+
+# Test points for a trainingData.ColumnarDataset: a grid of n_test_points+1 points over the
+# range of the data for a single identifier, otherwise n_test_points+1 rows spread over the data.
+def dataset_test_points(dataset, n_test_points = 100):
+    if len(dataset.identifiers) == 1:
+        (a, b) = dataset.column_range(dataset.identifiers[0])
+        return [[x_value] for x_value in np.linspace(a, b, n_test_points+1)]
+    rows = np.unique(np.linspace(0, len(dataset)-1, n_test_points+1).astype(int))
+    return [dataset[i][0] for i in rows]
+
+# Curve fitting on a trainingData.ColumnarDataset (e.g. loaded from a CSV or NPY file).
+# Plots (for a single identifier) at most max_plot_points of the data.
+def dataset_curve_fitting_test(dataset, pop_size = 1000, num_iters = 100, n_test_points = 100, method='ga', max_plot_points = 5000):
+    params = GAParams()
+    params.test_points = dataset_test_points(dataset, n_test_points)
+    params.regression_training_data = dataset
+    (best_expr, best_fitness, stats) = run_curve_fitting(params, dataset.identifiers, pop_size, num_iters, method)
+    plot_dataset_results(dataset, params.test_points, best_expr, stats, max_plot_points)
+    return (best_expr, best_fitness, stats)
+
+# Plot the result of a fit on a dataset (see plot_results; only the statistics for
+# several identifiers)
+def plot_dataset_results(dataset, test_points, best_expr, stats, max_plot_points = 5000, plot_path = None):
+    if len(dataset.identifiers) == 1:
+        id = dataset.identifiers[0]
+        rows = np.unique(np.linspace(0, len(dataset)-1, min(len(dataset), max_plot_points)).astype(int))
+        test_xvalues = sorted([x for [x] in test_points])
+        best_fn = compile_expr(best_expr)
+        plot_results(id, dataset.columns[id][rows], dataset.y[rows], test_xvalues,
+                     [best_fn({id: x_value}) for x_value in test_xvalues], stats, plot_path=plot_path)
+        return
+    plt = get_pyplot(headless=plot_path is not None)
+    plot_stats(plt, stats)
+    if plot_path is None:
+        plt.show()
+    else:
+        plt.figure(2).savefig(plot_path)
+        plt.close('all')
 
 if __name__ == '__main__':
     one_dimensional_curve_fitting_test(lambda x: 0.2*math.exp(x/4.0) -  math.sin(2*x)  , (-10.0, 10.0), 25, method='sa')
@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from geneticAlgParams import GAParams
+from trainingData import ColumnarDataset
+from geneticSearchAlgorithms import resume_genetic_algorithm
+from curveFitting import run_curve_fitting, dataset_test_points
+from instrumentation import json_safe
+
+# Command line curve fitting for batch jobs
+#
+#   python curveFittingCli.py data.csv --target y --method ga --pop-size 500 --iterations 100 \
+#       --seed 1 --output result.json --stats-output stats.jsonl --plot fit.png
+#
+# The data is a CSV file with a header row, a single 2D .npy file (identifier columns followed
+# by the target, --identifiers required) or a data set directory (see trainingData).
+# With --remote-workers the candidates are scored by evaluation workers on other hosts, started
+# there with python remoteEvaluation.py --host <interface> --port <port> (one per core; workers
+# listen on 127.0.0.1 only unless given --host, and --data-dir lets them load shared data sets).
+# The result (expression, fitness, statistics, run time) is written as JSON to --output.
+# Nothing is displayed: matplotlib is only imported when --plot is given, and the figures are
+# then drawn off screen and saved, so runs work on nodes without a display.
+
+
+def load_dataset(path, lst_of_identifiers, target, mmap):
+    if path.endswith('.csv'):
+        return ColumnarDataset.from_csv(path, lst_of_identifiers, target)
+    return ColumnarDataset.load(path, lst_of_identifiers, mmap)
+
+
+def make_params(args, dataset):
+    params = GAParams()
+    params.regression_training_data = dataset
+    params.test_points = dataset_test_points(dataset, args.n_test_points)
+    params.genome_representation = args.representation
+    params.depth = args.depth
+    params.stats_output = args.stats_output
+    params.checkpoint_path = args.checkpoint
+    params.checkpoint_interval = args.checkpoint_interval
+    return params
+
+
+## Function: run
+# Fit the data set described by the parsed command line args and return the result document
+def run(args):
+    random.seed(args.seed)
+    identifiers = None if args.identifiers is None else args.identifiers.split(',')
+    dataset = load_dataset(args.data, identifiers, args.target, not args.no_mmap)
+    params = make_params(args, dataset)
+    worker_addresses = None if args.remote_workers is None else args.remote_workers.split(',')
+    start = time.perf_counter()
+    if args.method == 'ga' and args.checkpoint is not None and args.resume and os.path.exists(args.checkpoint):
+        (best_expr, best_fitness, stats) = resume_genetic_algorithm(params, dataset.identifiers, args.checkpoint,
+                                                                    args.iterations, args.workers,
+                                                                    worker_addresses=worker_addresses)
+        best_expr = best_expr.simplify()
+    else:
+        (best_expr, best_fitness, stats) = run_curve_fitting(params, dataset.identifiers, args.pop_size, args.iterations,
+                                                             args.method, n_sa_steps=args.iterations, n_workers=args.workers,
+                                                             worker_addresses=worker_addresses)
+    seconds = time.perf_counter() - start
+    if args.plot is not None:
+        from curveFitting import plot_dataset_results
+        plot_dataset_results(dataset, params.test_points, best_expr, stats, plot_path=args.plot)
+    return {'expression': str(best_expr), 'fitness': best_fitness, 'method': args.method,
+            'identifiers': dataset.identifiers, 'n_data': len(dataset), 'pop_size': args.pop_size,
+            'iterations': args.iterations, 'seed': args.seed, 'seconds': seconds, 'stats': list(stats)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Symbolic regression of a data set by genetic search or simulated annealing')
+    parser.add_argument('data', help='CSV file, 2D .npy file or data set directory')
+    parser.add_argument('--target', default='y', help='name of the target column of a CSV file')
+    parser.add_argument('--identifiers', help='comma separated input columns (default: all columns but the target)')
+    parser.add_argument('--no-mmap', action='store_true', help='read .npy data into memory instead of memory mapping it')
+    parser.add_argument('--method', choices=['ga', 'sa'], default='ga')
+    parser.add_argument('--pop-size', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=100, help='generations (ga) or steps (sa)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help='evaluate on this many worker processes (ga)')
+    parser.add_argument('--remote-workers', help='comma separated host:port of evaluation workers (ga, see remoteEvaluation)')
+    parser.add_argument('--representation', choices=['tree', 'linear', 'dag'], default='tree')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the random initial expressions')
+    parser.add_argument('--n-test-points', type=int, default=100)
+    parser.add_argument('--output', default='result.json', help='JSON file receiving the result')
+    parser.add_argument('--stats-output', help='JSON lines file receiving per generation statistics (ga)')
+    parser.add_argument('--checkpoint', help='checkpoint file (ga)')
+    parser.add_argument('--checkpoint-interval', type=int, default=10)
+    parser.add_argument('--resume', action='store_true', help='continue from --checkpoint if it exists')
+    parser.add_argument('--plot', help='save the plots to this image file (imports matplotlib)')
+    parser.add_argument('--quiet', action='store_true', help='do not print progress')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.quiet:
+        with contextlib.redirect_stdout(io.StringIO()):
+            doc = run(args)
+    else:
+        doc = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(json_safe(doc), f, indent=1, allow_nan=False)
+    print(f'{doc["expression"]} fitness {doc["fitness"]} (wrote {args.output})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import math
+from collections import OrderedDict
+import numpy as np
+from symbolicExpressions import *
+
+# Compile expressions into straight-line Python functions.
+#
+# Expr.eval / Expr.eval_batch walk the tree with one method call per node on every
+# evaluation. compile_expr instead generates the source of a flat function with one
+# assignment per node, compiles it once and caches the result keyed by the structure
+# of the expression, so re-evaluating the same tree (elites, duplicates produced by
+# crossover) only pays for the arithmetic.
+#
+# Two flavors are generated:
+#   'scalar': f(env) with env a dict of floats, behaves exactly like e.eval(env)
+#             (raises EvaluationFailedException on domain errors).
+#   'batch':  f(X) with X a dict of numpy columns, behaves like e.eval_batch(X)
+#             (failed points are NaN).
+
+# Maximum number of compiled functions we keep around (least recently used are dropped).
+max_compiled_cache_size = 20000
+
+_compiled_cache = OrderedDict()
+
+def _fail(msg):
+    raise EvaluationFailedException(msg)
+
+def _lookup(env, symb):
+    if symb in env:
+        return env[symb]
+    raise EvaluationFailedException(f'no values for identifier {symb}')
+
+def _lookup_batch(X, symb):
+    if symb in X:
+        return np.asarray(X[symb], dtype=float)
+    raise EvaluationFailedException(f'no values for identifier {symb}')
+
+# Names visible to the generated code.
+_namespace = {
+    '_fail': _fail,
+    '_lookup': _lookup,
+    '_lookup_batch': _lookup_batch,
+    '_mark_failed': mark_failed,
+    '_batch_size': batch_size,
+    '_np': np,
+    '_errstate': np.errstate,
+    'inf': math.inf,
+    'nan': math.nan,
+}
+_scalar_funs = {'sin': math.sin, 'cos': math.cos, 'tan': math.tan, 'exp': math.exp, 'atan': math.atan,
+                'tanh': math.tanh, 'log': math.log, 'sinh': math.sinh, 'cosh': math.cosh, 'sqrt': math.sqrt}
+for (fn_name, fn) in _scalar_funs.items():
+    _namespace['_' + fn_name] = fn
+for (fn_name, fn) in batch_funs.items():
+    _namespace['_batch_' + fn_name] = fn
+
+
+class _CodeGenerator:
+    def __init__(self, batch):
+        self.batch = batch
+        self.lines = []
+        # structure key -> name of the temporary holding its value, so that repeated
+        # subexpressions inside one tree are only computed once.
+        self.temps = {}
+
+    def new_temp(self, key, rhs):
+        t = f't{len(self.temps)}'
+        self.temps[key] = t
+        self.lines.append(f'{t} = {rhs}')
+        return t
+
+    def emit(self, e):
+        key = e.structure_key()
+        if key in self.temps:
+            return self.temps[key]
+        if isinstance(e, Const):
+            return self.new_temp(key, repr(float(e.get_constant())))
+        if isinstance(e, Ident):
+            lookup = '_lookup_batch(X, ' if self.batch else '_lookup(env, '
+            return self.new_temp(key, lookup + repr(e.symb) + ')')
+        if isinstance(e, Plus) or isinstance(e, Mult):
+            op = ' + ' if isinstance(e, Plus) else ' * '
+            args = [self.emit(ej) for ej in e.e_list]
+            if not args:
+                return self.new_temp(key, '0.0' if isinstance(e, Plus) else '1.0')
+            return self.new_temp(key, op.join(args))
+        if isinstance(e, Minus) or isinstance(e, Div):
+            a = self.emit(e.args[0])
+            b = self.emit(e.args[1])
+            if self.batch:
+                bad = f'{b}_bad'
+                self.lines.append(f'{bad} = abs({b}) <= 1E-10')
+                if isinstance(e, Minus):
+                    return self.new_temp(key, f'_mark_failed({a} - {b}, {bad})')
+                return self.new_temp(key, f'_mark_failed({a} / _np.where({bad}, 1.0, {b}), {bad})')
+            # Minus fails on the same condition as Minus.eval
+            self.lines.append(f"if abs({b}) <= 1E-10: _fail('division by ' + str({b}))")
+            op = ' - ' if isinstance(e, Minus) else ' / '
+            return self.new_temp(key, a + op + b)
+        if isinstance(e, UnaryFnApplication):
+            a = self.emit(e.arg)
+            if self.batch:
+                return self.new_temp(key, f'_batch_{e.fn_name}({a})')
+            if e.fn_name == 'log':
+                self.lines.append(f"if not ({a} > 0): _fail('function log raised exception')")
+            elif e.fn_name == 'sqrt':
+                self.lines.append(f"if not ({a} >= 0.0): _fail('function sqrt raised exception')")
+            return self.new_temp(key, f'_{e.fn_name}({a})')
+        raise NotImplementedError(f'Cannot compile expression of type {e.__class__}')
+
+    def source(self, e):
+        result = self.emit(e)
+        if self.batch:
+            body = ['n = _batch_size(X)', 'with _errstate(all=\'ignore\'):']
+            body += ['    ' + line for line in self.lines]
+            # Constant subtrees evaluate to plain floats: broadcast to one value per point
+            body += [f'    return _np.broadcast_to(_np.asarray({result}, dtype=float), (n,))']
+            return 'def _compiled(X):\n' + '\n'.join(['    ' + line for line in body]) + '\n'
+        body = self.lines + [f'return {result}']
+        return 'def _compiled(env):\n' + '\n'.join(['    ' + line for line in body]) + '\n'
+
+
+# Source code of the function compile_expr generates for e (useful for debugging).
+def expr_source(e, batch=False):
+    return _CodeGenerator(batch).source(e)
+
+
+# Return a compiled callable equivalent to e.eval (batch=False) or e.eval_batch (batch=True).
+def compile_expr(e, batch=False):
+    cache_key = (batch, e.structure_key())
+    fn = _compiled_cache.get(cache_key)
+    if fn is not None:
+        _compiled_cache.move_to_end(cache_key)
+        return fn
+    namespace = dict(_namespace)
+    exec(compile(expr_source(e, batch), '<compiled expr>', 'exec'), namespace)
+    fn = namespace['_compiled']
+    _compiled_cache[cache_key] = fn
+    while len(_compiled_cache) > max_compiled_cache_size:
+        _compiled_cache.popitem(last=False)
+    return fn
+
+
+def clear_compiled_cache():
+    _compiled_cache.clear()
+
+
+if __name__ == '__main__':
+    e = Plus([Mult([Const(2.0), Ident('x')]), UnaryFnApplication('log', Ident('x')), Div(Ident('x'), Minus(Ident('x'), Const(1.0)))])
+    print(expr_source(e))
+    print(expr_source(e, batch=True))
+    print(compile_expr(e)({'x': 2.0}), e.eval({'x': 2.0}))
+    print(compile_expr(e, batch=True)({'x': np.array([-1.0, 1.0, 2.0])}))
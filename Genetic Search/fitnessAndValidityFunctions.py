@@ -1,5 +1,12 @@
-from symbolicExpressions import * 
-import math 
+from symbolicExpressions import *
+from exprCompiler import compile_expr
+from fitnessCache import canonical_structure_key, get_fitness_cache
+from trainingData import ColumnarDataset
+from subtreeValueCache import SubtreeValueCache
+from intervalAnalysis import analyze, bounding_box, SAFE, UNKNOWN, INVALID
+from collections import OrderedDict
+import math
+import numpy as np
 debug = False
 
 def make_env(lst_of_identifiers, test_pt):
@@ -8,36 +15,433 @@ def make_env(lst_of_identifiers, test_pt):
         env[id] = v
     return env
 
+# Points as a 2D array with one row per point and one column per identifier
+def point_array(lst_of_identifiers, test_point_list):
+    if len(test_point_list) == 0:
+        return np.zeros((0, len(lst_of_identifiers)))
+    return np.array(test_point_list, dtype=float).reshape(len(test_point_list), -1)[:, :len(lst_of_identifiers)]
+
+# Column oriented environment for Expr.eval_batch:
+# maps each identifier to a numpy array with its value at every point of test_point_list.
+def make_batch_env(lst_of_identifiers, test_point_list):
+    return columns_env(lst_of_identifiers, point_array(lst_of_identifiers, test_point_list))
+
+def columns_env(lst_of_identifiers, points):
+    env = {}
+    for (j, id) in enumerate(lst_of_identifiers):
+        env[id] = points[:, j]
+    return env
+
+# The point lists inside params do not change during a run, so we convert them only once.
+# Entries hold on to the lists they were made from and are reused while the same list
+# objects with the same lengths are passed. A list modified in place must be replaced by a
+# new one or clear_point_cache called (GASolver and run_simulated_annealing clear the cache
+# when they start).
+# Maximum number of conversions we keep around (least recently used are dropped).
+max_point_cache_size = 16
+
+_point_cache = OrderedDict()
+
+# make() for the point lists in lists, computed once (see above)
+def _cached_points(key, lists, make):
+    lengths = [len(lst) for lst in lists]
+    entry = _point_cache.get(key)
+    if entry is not None and all([a is b for (a, b) in zip(entry[0], lists)]) and entry[1] == lengths:
+        _point_cache.move_to_end(key)
+        return entry[2]
+    value = make()
+    _point_cache[key] = (lists, lengths, value)
+    while len(_point_cache) > max_point_cache_size:
+        _point_cache.popitem(last=False)
+    return value
+
+def clear_point_cache():
+    _point_cache.clear()
+
+def get_batch_env(lst_of_identifiers, point_list):
+    return _cached_points((id(point_list), tuple(lst_of_identifiers), 'env'), [point_list],
+                          lambda: make_batch_env(lst_of_identifiers, point_list))
+
+# (columns, targets) for the training data (a list of rows or a trainingData.ColumnarDataset)
+def get_training_batch(lst_of_identifiers, regression_training_data):
+    if isinstance(regression_training_data, ColumnarDataset):
+        return (regression_training_data.columns_env(lst_of_identifiers), regression_training_data.y)
+    return _cached_points((id(regression_training_data), tuple(lst_of_identifiers), 'y'), [regression_training_data],
+                          lambda: _make_training_batch(lst_of_identifiers, regression_training_data))
+
+def _make_training_batch(lst_of_identifiers, regression_training_data):
+    env = make_batch_env(lst_of_identifiers, [test_pt for (test_pt, _) in regression_training_data])
+    y = np.array([y for (_, y) in regression_training_data], dtype=float)
+    return (env, y)
+
+# Test points and training points merged for evaluate_expr.
+# Every distinct point is stored once: first the (distinct) test points, then the
+# training points that are not test points. train_index maps each training row to
+# its position in that order.
+class FusedPointSet:
+    def __init__(self, lst_of_identifiers, test_point_list, regression_training_data):
+        self.identifiers = lst_of_identifiers
+        test = point_array(lst_of_identifiers, test_point_list)
+        train = point_array(lst_of_identifiers, [test_pt for (test_pt, _) in regression_training_data])
+        self.y = np.array([y for (_, y) in regression_training_data], dtype=float)
+        (unique_points, inverse) = np.unique(np.concatenate((test, train)), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        test_ids = np.unique(inverse[:len(test)])
+        is_test = np.zeros(len(unique_points), dtype=bool)
+        is_test[test_ids] = True
+        order = np.concatenate((test_ids, np.flatnonzero(~is_test)))
+        position = np.empty(len(order), dtype=np.intp)
+        position[order] = np.arange(len(order))
+        self.points = unique_points[order]
+        self.n_test = len(test_ids)
+        self.train_index = position[inverse[len(test):]]
+        # Training rows sorted by the position of their point, so that the rows whose
+        # point lies in points[a:b] form one contiguous range (see rows_between)
+        row_order = np.argsort(self.train_index, kind='stable')
+        self.sorted_index = self.train_index[row_order]
+        self.sorted_y = self.y[row_order]
+
+    # Range of sorted rows whose point is in points[a:b]
+    def rows_between(self, a, b):
+        return (np.searchsorted(self.sorted_index, a), np.searchsorted(self.sorted_index, b))
+
+    def test_env(self):
+        return columns_env(self.identifiers, self.points[:self.n_test])
+
+    # (start, environment) for the remaining (training only) points, chunk_size points at a time
+    def training_envs(self, chunk_size):
+        for start in range(self.n_test, len(self.points), chunk_size):
+            yield (start, columns_env(self.identifiers, self.points[start:start + chunk_size]))
+
+def get_fused_point_set(lst_of_identifiers, test_point_list, regression_training_data):
+    return _cached_points((id(test_point_list), id(regression_training_data), tuple(lst_of_identifiers), 'fused'),
+                          [test_point_list, regression_training_data],
+                          lambda: FusedPointSet(lst_of_identifiers, test_point_list, regression_training_data))
+
+# A block of points: environment X of n points, the first n_test of which are test points,
+# and the training rows row_start, row_start+1, ... with their points at X[train_index] and
+# targets y.
+class PointBlock:
+    def __init__(self, X, n_test, train_index, y, row_start):
+        self.X = X
+        self.n = batch_size(X)
+        self.n_test = n_test
+        self.train_index = train_index
+        self.y = y
+        self.row_start = row_start
+
+
+# All the points of params (test points first) as a list of blocks, see all_point_blocks.
+# Used by the evaluators that keep value vectors around (simulatedAnnealing,
+# constantOptimization, hashConsing): they evaluate an expression one block at a time and
+# add up the scores of the blocks with accumulate.
+class PointBlocks:
+    def __init__(self, blocks, n_rows):
+        self.blocks = blocks
+        # Number of training rows
+        self.n_rows = n_rows
+
+    # False if block b holds no test point and none of the training rows (all rows if None)
+    def uses_block(self, b, rows=None):
+        block = self.blocks[b]
+        if rows is None or block.n_test > 0:
+            return True
+        rows = np.asarray(rows, dtype=np.intp)
+        return bool(np.any((rows >= block.row_start) & (rows < block.row_start + len(block.y))))
+
+    # (viable, fitness) of the values v over block b (None if the evaluation failed).
+    # viable is False if a test point failed; the fitness is -inf if a training point failed.
+    # With rows only those training rows are used (see compute_subsample_fitness).
+    def score_block(self, b, v, rows=None):
+        block = self.blocks[b]
+        if v is None:
+            return (False, -float('inf')) if b == 0 else (True, -float('inf'))
+        if np.isnan(v[:block.n_test]).any():
+            return (False, -float('inf'))
+        (train_index, y, scale) = (block.train_index, block.y, 1.0)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.intp)
+            local = rows[(rows >= block.row_start) & (rows < block.row_start + len(y))] - block.row_start
+            (train_index, y, scale) = (train_index[local], y[local], self.n_rows/max(1, len(rows)))
+        yHat = v[train_index]
+        if np.isnan(yHat).any():
+            return (True, -float('inf'))
+        with np.errstate(over='ignore', invalid='ignore'):
+            return (True, -scale * float(np.sum((yHat - y)**2)))
+
+    # Add the score of block b with values v to the fitness of the previous blocks.
+    # Returns (viable, fitness, finished): finished when the result cannot change any more
+    # (only the first block holds test points).
+    def accumulate(self, fitness, b, v, rows=None):
+        (viable, block_fitness) = self.score_block(b, v, rows)
+        if not viable:
+            return (False, -float('inf'), True)
+        fitness = fitness + block_fitness
+        return (True, fitness, fitness == -float('inf'))
+
+    # (viable, fitness) of an expression, values_fn(b, block) giving its values over block b
+    # (see evaluate_expr)
+    def score(self, values_fn, rows=None):
+        fitness = 0.0
+        for (b, block) in enumerate(self.blocks):
+            if not self.uses_block(b, rows):
+                continue
+            try:
+                v = values_fn(b, block)
+            except EvaluationFailedException:
+                v = None
+            (viable, fitness, finished) = self.accumulate(fitness, b, v, rows)
+            if finished:
+                return (viable, fitness)
+        return (True, fitness)
+
+
+## Function: all_point_blocks
+# The test and training points of params as PointBlocks. Lists of rows are held in memory
+# anyway: they form a single block of the merged points (see FusedPointSet). A
+# ColumnarDataset is not copied: the test points form the first block, followed by blocks
+# of params.eval_chunk_size training rows that are views of its (possibly memory mapped)
+# columns.
+def all_point_blocks(lst_of_identifiers, params):
+    data = params.regression_training_data
+    if isinstance(data, ColumnarDataset):
+        test = point_array(lst_of_identifiers, params.test_points)
+        blocks = [PointBlock(columns_env(lst_of_identifiers, test), len(test), np.zeros(0, dtype=np.intp), np.zeros(0), 0)]
+        chunk_size = max(1, params.eval_chunk_size)
+        for start in range(0, len(data), chunk_size):
+            stop = min(len(data), start + chunk_size)
+            blocks.append(PointBlock(data.columns_env(lst_of_identifiers, start, stop), 0, np.arange(stop - start),
+                                     np.asarray(data.y[start:stop], dtype=float), start))
+        return PointBlocks(blocks, len(data))
+    point_set = get_fused_point_set(lst_of_identifiers, params.test_points, data)
+    block = PointBlock(columns_env(lst_of_identifiers, point_set.points), point_set.n_test, point_set.train_index, point_set.y, 0)
+    return PointBlocks([block], len(point_set.y))
+
+# (viable, fitness) from the values v of an expression over the merged points of a FusedPointSet,
+# see evaluate_expr. With rows only those training rows are used (see compute_subsample_fitness).
+def score_values(v, n_test, train_index, y, rows=None):
+    if v is None or np.isnan(v[:n_test]).any():
+        return (False, -float('inf'))
+    scale = 1.0
+    if rows is not None:
+        (train_index, y, scale) = (train_index[rows], y[rows], len(y)/max(1, len(rows)))
+    yHat = v[train_index]
+    if np.isnan(yHat).any():
+        return (True, -float('inf'))
+    with np.errstate(over='ignore', invalid='ignore'):
+        return (True, -scale * float(np.sum((yHat - y)**2)))
+
+# Function mapping a batch environment to output values for fun_expr.
+# Expr trees are compiled, other representations (linearGenome) bring their own eval_batch.
+def batch_evaluator(fun_expr):
+    if isinstance(fun_expr, Expr):
+        return compile_expr(fun_expr, batch=True)
+    return fun_expr.eval_batch
+
+# Bounding box of the test points (see intervalAnalysis)
+def get_test_box(lst_of_identifiers, test_point_list):
+    return _cached_points((id(test_point_list), tuple(lst_of_identifiers), 'box'), [test_point_list],
+                          lambda: bounding_box(get_batch_env(lst_of_identifiers, test_point_list)))
+
+# Viability of fun_expr at params.test_points proved by interval analysis: SAFE, INVALID
+# or UNKNOWN (see intervalAnalysis). Always UNKNOWN if params.interval_analysis is off
+# or fun_expr is not an Expr tree.
+def interval_viability(fun_expr, lst_of_identifiers, params):
+    if not params.interval_analysis or not isinstance(fun_expr, Expr) or len(params.test_points) == 0:
+        return UNKNOWN
+    (_, status) = analyze(fun_expr, get_test_box(lst_of_identifiers, params.test_points))
+    return status
+
+# Viability at params.test_points: by interval analysis when it is conclusive, otherwise
+# by evaluating the points (checkFunctionValidity)
+def check_viability(fun_expr, lst_of_identifiers, params):
+    status = interval_viability(fun_expr, lst_of_identifiers, params)
+    if status != UNKNOWN:
+        return status == SAFE
+    return checkFunctionValidity(fun_expr, lst_of_identifiers, params.test_points)
+
 def checkFunctionValidity(fun_expr, lst_of_identifiers, test_point_list):
-    for test_pt in test_point_list:
-        env = make_env(lst_of_identifiers, test_pt) 
-        try:
-            fun_expr.eval(env)
-        except:
-            if debug:
-                print(f'Failed expression {fun_expr}')
-            return False 
-    return True 
+    X = get_batch_env(lst_of_identifiers, test_point_list)
+    try:
+        values = batch_evaluator(fun_expr)(X)
+    except EvaluationFailedException:
+        values = None
+    if values is None or np.isnan(values).any():
+        if debug:
+            print(f'Failed expression {fun_expr}')
+        return False
+    return True
 
 
+# is_viable_expr and compute_fitness first look the expression up in the
+# fitness cache of params (see fitnessCache) unless params.fitness_cache_size is 0.
 def is_viable_expr(fun_expr, lst_of_identifiers, params):
-    return checkFunctionValidity(fun_expr, lst_of_identifiers, params.test_points)
+    if params.fitness_cache_size <= 0:
+        return check_viability(fun_expr, lst_of_identifiers, params)
+    cache = get_fitness_cache(params)
+    key = canonical_structure_key(fun_expr)
+    viable = cache.lookup(key, 0)
+    if viable is None:
+        viable = check_viability(fun_expr, lst_of_identifiers, params)
+        cache.store(key, 0, viable)
+    return viable
+
+
+# cutoff: if given, stop as soon as the partial fitness drops below cutoff and return it.
+# Every point can only lower the fitness (it is a negative sum of squared errors), so the
+# returned value is then an upper bound of the true fitness that is already below cutoff.
+# Bounds are never stored in the fitness cache.
+def compute_fitness(fun_expr, lst_of_identifiers, params, cutoff=None):
+    if params.fitness_cache_size <= 0:
+        (fitness, _) = compute_training_fitness(fun_expr, lst_of_identifiers, params.regression_training_data, cutoff, params.eval_chunk_size)
+        return fitness
+    cache = get_fitness_cache(params)
+    key = canonical_structure_key(fun_expr)
+    fitness = cache.lookup(key, 1)
+    if fitness is None:
+        (fitness, exact) = compute_training_fitness(fun_expr, lst_of_identifiers, params.regression_training_data, cutoff, params.eval_chunk_size)
+        if exact:
+            cache.store(key, 1, fitness)
+    return fitness
 
 
-def compute_fitness(fun_expr, lst_of_identifiers, params):
-    regression_training_data = params.regression_training_data 
+# Fitness (negative sum of squared errors) over regression_training_data, no caching.
+# The points are evaluated chunk_size at a time (all at once if None).
+# Returns (fitness, exact) where exact is False if the evaluation stopped early at cutoff.
+def compute_training_fitness(fun_expr, lst_of_identifiers, regression_training_data, cutoff=None, chunk_size=None):
+    (X, y) = get_training_batch(lst_of_identifiers, regression_training_data)
+    return batch_fitness(fun_expr, X, y, cutoff, chunk_size)
+
+
+# Fitness of fun_expr on a random subsample of regression_training_data: rows holds the
+# indices of the sampled rows. The sum of squared errors is scaled by (number of rows in
+# the data)/(number of sampled rows) to estimate the fitness on the whole data.
+# Returns (fitness, exact) like compute_training_fitness.
+def compute_subsample_fitness(fun_expr, lst_of_identifiers, regression_training_data, rows, cutoff=None, chunk_size=None):
+    (X, y) = get_training_batch(lst_of_identifiers, regression_training_data)
+    X_sub = {id: col[rows] for (id, col) in X.items()}
+    return batch_fitness(fun_expr, X_sub, y[rows], cutoff, chunk_size, len(y)/max(1, len(rows)))
+
+
+# Scaled negative sum of squared errors of fun_expr over the columns X with targets y.
+def batch_fitness(fun_expr, X, y, cutoff=None, chunk_size=None, scale=1.0):
+    n = len(y)
+    chunk_size = n if chunk_size is None else chunk_size
+    fn = batch_evaluator(fun_expr)
     fitness = 0.0
-    for (test_pt, y) in regression_training_data:
-        env = make_env(lst_of_identifiers, test_pt) 
+    for start in range(0, n, max(1, chunk_size)):
+        stop = min(n, start + chunk_size)
         try:
-            yHat = fun_expr.eval(env)
-            fitness = fitness - (yHat - y)**2
-        except:
-            fitness = -float('inf') 
+            yHat = fn({id: col[start:stop] for (id, col) in X.items()})
+        except EvaluationFailedException:
+            yHat = None
+        if yHat is None or np.isnan(yHat).any():
             if debug:
-                print(f'Warning: Expression evaluation failed: {fun_expr} @ {test_pt}')
-            return fitness 
-    return (fitness)
-    
-               
+                print(f'Warning: Expression evaluation failed: {fun_expr}')
+            return (-float('inf'), True)
+        with np.errstate(over='ignore', invalid='ignore'):
+            fitness = fitness - scale * float(np.sum((yHat - y[start:stop])**2))
+        if cutoff is not None and fitness < cutoff and stop < n:
+            return (fitness, False)
+    return (fitness, True)
+
+
+# Viability and fitness of fun_expr in a single pass: returns (viable, fitness).
+# Equivalent to (is_viable_expr(...), compute_fitness(...)) but test and training points
+# are evaluated together (shared points only once), test points first, and the
+# evaluation stops at the first chunk with a failed point. Non viable expressions get
+# fitness -inf. cutoff works as in compute_fitness.
+# rows: if given, the fitness is estimated on those training rows only (see compute_subsample_fitness).
+def evaluate_expr(fun_expr, lst_of_identifiers, params, cutoff=None, rows=None):
+    if rows is not None:
+        if not is_viable_expr(fun_expr, lst_of_identifiers, params):
+            return (False, -float('inf'))
+        (fitness, _) = compute_subsample_fitness(fun_expr, lst_of_identifiers, params.regression_training_data,
+                                                 rows, cutoff, params.eval_chunk_size)
+        return (True, fitness)
+    if params.fitness_cache_size > 0:
+        cache = get_fitness_cache(params)
+        key = canonical_structure_key(fun_expr)
+        viable = cache.lookup(key, 0)
+        fitness = cache.lookup(key, 1) if viable else None
+        if viable is False:
+            return (False, -float('inf'))
+        if fitness is not None:
+            return (True, fitness)
+    (viable, fitness, exact) = evaluate_expr_uncached(fun_expr, lst_of_identifiers, params, cutoff)
+    if params.fitness_cache_size > 0:
+        cache.store(key, 0, viable)
+        if viable and exact:
+            cache.store(key, 1, fitness)
+    return (viable, fitness)
 
+
+# (point set, subtree value cache) of params over the merged test/training points (see FusedPointSet)
+def get_subtree_value_cache(lst_of_identifiers, params):
+    point_set = get_fused_point_set(lst_of_identifiers, params.test_points, params.regression_training_data)
+    if params.subtree_value_cache is not None:
+        (cached_point_set, cache) = params.subtree_value_cache
+        if cached_point_set is point_set and cache.max_bytes == params.subtree_cache_bytes:
+            return (point_set, cache)
+    cache = SubtreeValueCache(columns_env(lst_of_identifiers, point_set.points), params.subtree_cache_bytes)
+    params.subtree_value_cache = (point_set, cache)
+    return (point_set, cache)
+
+# evaluate_expr_uncached through the subtree value cache (no chunking, the whole vector is cached)
+def evaluate_expr_with_subtree_cache(fun_expr, lst_of_identifiers, params):
+    (point_set, cache) = get_subtree_value_cache(lst_of_identifiers, params)
+    try:
+        values = cache.evaluate(fun_expr)
+    except EvaluationFailedException:
+        values = None
+    (viable, fitness) = score_values(values, point_set.n_test, point_set.train_index, point_set.y)
+    return (viable, fitness, True)
+
+# Returns (viable, fitness, exact), see compute_training_fitness
+# Expressions that interval analysis proves invalid are rejected without evaluating them.
+def evaluate_expr_uncached(fun_expr, lst_of_identifiers, params, cutoff=None):
+    status = interval_viability(fun_expr, lst_of_identifiers, params)
+    if status == INVALID:
+        return (False, -float('inf'), True)
+    if params.subtree_cache_bytes > 0 and isinstance(fun_expr, Expr) \
+            and not isinstance(params.regression_training_data, ColumnarDataset):
+        return evaluate_expr_with_subtree_cache(fun_expr, lst_of_identifiers, params)
+    if isinstance(params.regression_training_data, ColumnarDataset):
+        # Columnar data sets are streamed from their columns and not merged with the test points
+        if status != SAFE and not checkFunctionValidity(fun_expr, lst_of_identifiers, params.test_points):
+            return (False, -float('inf'), True)
+        (fitness, exact) = compute_training_fitness(fun_expr, lst_of_identifiers, params.regression_training_data,
+                                                    cutoff, params.eval_chunk_size)
+        return (True, fitness, exact)
+    point_set = get_fused_point_set(lst_of_identifiers, params.test_points, params.regression_training_data)
+    fn = batch_evaluator(fun_expr)
+    n_points = len(point_set.points)
+    fitness = 0.0
+    # A failure after the test points passed only makes the fitness -inf (as the NaN values do)
+    viable = False
+    try:
+        values = fn(point_set.test_env())
+        if np.isnan(values).any():
+            if debug:
+                print(f'Failed expression {fun_expr}')
+            return (False, -float('inf'), True)
+        viable = True
+        chunks = point_set.training_envs(params.eval_chunk_size)
+        start = 0
+        while values is not None:
+            stop = start + len(values)
+            if np.isnan(values).any():
+                if debug:
+                    print(f'Warning: Expression evaluation failed: {fun_expr}')
+                return (True, -float('inf'), True)
+            # Add the errors of the training rows whose point was just evaluated
+            (lo, hi) = point_set.rows_between(start, stop)
+            with np.errstate(over='ignore', invalid='ignore'):
+                fitness = fitness - float(np.sum((values[point_set.sorted_index[lo:hi] - start] - point_set.sorted_y[lo:hi])**2))
+            if cutoff is not None and fitness < cutoff and stop < n_points:
+                return (True, fitness, False)
+            (start, X) = next(chunks, (stop, None))
+            values = fn(X) if X is not None else None
+    except EvaluationFailedException:
+        return (viable, -float('inf'), True)
+    return (True, fitness, True)
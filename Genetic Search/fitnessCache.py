@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from symbolicExpressions import *
+
+# Memoization of viability/fitness results keyed by the structure of an expression
+#
+# Once the population converges, crossover and mutation keep producing trees that were
+# already scored. canonical_structure_key maps structurally identical trees to the same
+# key and FitnessCache remembers the results for the most recently seen keys.
+
+
+# Like Expr.structure_key but the children of Plus/Mult are sorted, so that
+# (x + 1.0) and (1.0 + x) get the same key. (Floating point addition/multiplication
+# are not associative, so the cached fitness may differ in the last bits from the one
+# obtained by evaluating the other ordering.)
+def canonical_structure_key(e):
+    if isinstance(e, Const):
+        return ('const', e.get_constant())
+    elif isinstance(e, Ident):
+        return ('ident', e.symb)
+    elif isinstance(e, Plus):
+        return ('+',) + tuple(sorted([canonical_structure_key(ej) for ej in e.e_list]))
+    elif isinstance(e, Mult):
+        return ('*',) + tuple(sorted([canonical_structure_key(ej) for ej in e.e_list]))
+    elif isinstance(e, Minus):
+        return ('-', canonical_structure_key(e.args[0]), canonical_structure_key(e.args[1]))
+    elif isinstance(e, Div):
+        return ('/', canonical_structure_key(e.args[0]), canonical_structure_key(e.args[1]))
+    elif isinstance(e, UnaryFnApplication):
+        return (e.fn_name, canonical_structure_key(e.arg))
+    else:
+        # Other representations (e.g. linearGenome) provide their own key
+        return e.structure_key()
+
+
+class FitnessCache:
+    def __init__(self, max_size):
+        # Maximum number of expressions we remember (least recently used are evicted)
+        self.max_size = max_size
+        # canonical key -> [viable, fitness] where unknown entries are None
+        self.entries = OrderedDict()
+        # Identifies the data the cached results were computed on
+        self.data_token = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    # Drop everything if the results were computed for different data.
+    def check_data(self, data_token):
+        if data_token != self.data_token:
+            self.clear()
+            self.data_token = data_token
+
+    # Return the cached value at slot (0: viability, 1: fitness), None if unknown.
+    def lookup(self, key, slot):
+        entry = self.entries.get(key)
+        if entry is None or entry[slot] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[slot]
+
+    def store(self, key, slot, value):
+        if self.max_size <= 0:
+            return
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = [None, None]
+            self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.entries.move_to_end(key)
+        entry[slot] = value
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self):
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hit_rate()}
+
+    def __repr__(self):
+        return f'FitnessCache({len(self.entries)}/{self.max_size} entries, {self.hits} hits, {self.misses} misses)'
+
+
+# The cache used for params (created on first use with params.fitness_cache_size entries).
+def get_fitness_cache(params):
+    cache = params.fitness_cache
+    if cache is None:
+        cache = FitnessCache(params.fitness_cache_size)
+        params.fitness_cache = cache
+    # Results are only valid for the data currently held by params
+    cache.check_data((id(params.test_points), len(params.test_points),
+                      id(params.regression_training_data), len(params.regression_training_data)))
+    return cache
+
+
+# Return the list with later structural duplicates (same canonical key) removed.
+# By default lst holds (expression, fitness) tuples; key_fun picks the expression out of an item.
+def remove_duplicates(lst, key_fun=lambda item: item[0]):
+    seen = set()
+    ret_list = []
+    for item in lst:
+        key = canonical_structure_key(key_fun(item))
+        if key not in seen:
+            seen.add(key)
+            ret_list.append(item)
+    return ret_list
@@ -1,3 +1,5 @@
+from copy import copy
+
 class GAParams:
     def __init__(self):
         self.allowed_unary_funs = ['sin', 'sin', 'sin', 'cos', 'cos', 'cos', 
@@ -8,12 +10,90 @@ class GAParams:
         self.replace_by_subexpr = 0.3
         self.grow_subexpr = 0.2
         self.lst_of_random_constants = [1.0, -1.0, 2.0, -2.0, 0.5, -0.5, None]
+        # List of ([x1, x2, ...], y) rows or a trainingData.ColumnarDataset
         self.regression_training_data = []
         self.test_points = [] 
         self.depth = 3
+        # Limits on the number of nodes and the depth of the individuals built by the
+        # crossover/mutation operators (None: no limit)
+        self.max_tree_size = None
+        self.max_tree_depth = None
+        # Parsimony pressure: parent selection uses fitness - parsimony_coefficient * (number of nodes)
+        self.parsimony_coefficient = 0.0
         self.elitism_fraction = 0.2
         self.temperature = 10
+        # Steady-state GA (see GASolver.steady_state_generation): offspring replace the worst
+        # individual one at a time instead of a whole generation at once. Parents are chosen by
+        # tournament (tournament_size); minibatch_size, elitism_fraction, constant optimization
+        # and simplification of the elites do not apply.
+        self.steady_state = False
+        # Parent selection: 'boltzmann' (weights exp(fitness/temperature)), 'rank' or 'tournament'
+        # (see selection). rank_selection_pressure is the weight of the best individual
+        # relative to the average (between 1 and 2).
+        self.selection = 'boltzmann'
+        self.tournament_size = 3
+        self.rank_selection_pressure = 1.5
         self.simulated_annealing_cool_steps=100
         self.simulated_annealing_cool_frac = 0.8
         self.simulated_annealing_start_temp = 100
+        # Memory (in bytes) for the node values remembered between the steps of simulated annealing (see IncrementalEvaluator)
+        self.simulated_annealing_cache_bytes = 1 << 28
+        # Representation of individuals in GASolver: 'tree' (Expr objects), 'linear' (see linearGenome)
+        # or 'dag' (Expr objects sharing their common subexpressions, see hashConsing)
+        self.genome_representation = 'tree'
+        # Number of expressions whose viability/fitness we memoize (0 disables the cache, see fitnessCache)
+        self.fitness_cache_size = 0
+        self.fitness_cache = None
+        # Decide viability by interval analysis over the bounding box of test_points when it
+        # is conclusive, instead of evaluating the points (see intervalAnalysis).
+        # interval_guided_generation: random expressions avoid operands that interval
+        # analysis cannot prove valid (divisors near 0, log/sqrt of negative values, ...)
+        self.interval_analysis = True
+        self.interval_guided_generation = False
+        # Replace structurally identical individuals by new random ones when forming the next generation
+        self.remove_duplicates = False
+        # Number of points evaluated at a time by the chunked evaluators (see evaluate_expr)
+        self.eval_chunk_size = 65536
+        # Stop scoring an offspring once it is known to be worse than the worst elite.
+        # Such offspring get an upper bound of their fitness instead of the exact value.
+        self.fitness_racing = False
+        # Mini-batch fitness: score offspring on minibatch_size training rows (None: all rows),
+        # a different subsample every generation. The batch size is multiplied by
+        # minibatch_growth after each generation (1.0 keeps it constant).
+        self.minibatch_size = None
+        self.minibatch_growth = 1.0
+        # Memory (in bytes) for caching the values of subtrees on the nodes themselves, so that
+        # offspring only re-evaluate the paths changed by crossover/mutation (0 disables, see subtreeValueCache)
+        self.subtree_cache_bytes = 0
+        self.subtree_value_cache = None
+        # Fit the constants of the elites (and of a random constant_optimization_fraction of the
+        # offspring) with up to constant_optimization_steps Levenberg-Marquardt steps every
+        # generation (0 disables, see constantOptimization). constant_optimization_damping is
+        # the initial damping factor.
+        self.constant_optimization_steps = 0
+        self.constant_optimization_fraction = 0.0
+        self.constant_optimization_damping = 1E-3
+        # Replace the elites by their algebraically simplified versions every simplification_interval
+        # generations when these are as fit (0 disables, see simplification)
+        self.simplification_interval = 0
+        # Per generation timings and statistics of GASolver (see instrumentation), also
+        # appended as JSON lines to the file stats_output if it is not None
+        self.instrumentation = False
+        self.stats_output = None
+        # Save the state of GASolver to the file checkpoint_path every checkpoint_interval
+        # generations (None disables, see checkpoint and resume_genetic_algorithm)
+        self.checkpoint_path = None
+        self.checkpoint_interval = 10
+        # Island model (see islandModel): generations between migrations,
+        # fraction of an island's population sent at each migration and 'ring' or 'random' topology
+        self.island_migration_interval = 10
+        self.island_migration_rate = 0.05
+        self.island_topology = 'ring'
     # Do not forget to set the training data and test_points for viability
+
+    # Copy of the parameters to send to another process, without the caches built up in this one
+    def worker_copy(self):
+        params = copy(self)
+        params.fitness_cache = None
+        params.subtree_value_cache = None
+        return params
@@ -1,16 +1,32 @@
-from makeRandomExpressions import generate_random_expr
-from fitnessAndValidityFunctions import is_viable_expr, compute_fitness
+from makeRandomExpressions import generate_bounded_random_expr
+from fitnessAndValidityFunctions import evaluate_expr, clear_point_cache
 import random 
 import math 
+import heapq
+import numpy as np
 from crossOverOperators import random_expression_mutation, random_subtree_crossover
 from geneticAlgParams import GAParams
+from fitnessCache import remove_duplicates, canonical_structure_key
+from parallelEvaluation import ProcessPoolEvaluator
+from remoteEvaluation import RemoteEvaluator
+from linearGenome import LinearGenome, genome_subtree_crossover, genome_expression_mutation
+from constantOptimization import optimize_constants
+from simplification import simplify_expr
+from selection import make_selector, select_elites, tournament_draw, PopulationHeap
+from instrumentation import GenerationStats, write_json_line
+from checkpoint import save_checkpoint, load_checkpoint, restore_checkpoint, checkpoint_pop_size
+from hashConsing import intern, dag_subtree_crossover, dag_expression_mutation, DagEvaluator
 import time
+from contextlib import nullcontext
+from concurrent.futures import wait, FIRST_COMPLETED
 #############################
 class GASolver: 
-    def __init__(self, params, lst_of_identifiers, n):
+    def __init__(self, params, lst_of_identifiers, n, evaluator=None):
         # Parameters for GA: see geneticAlgParams
         # Also includes test data for regression and checking validity
         self.params = params
+        # The point lists may have been modified in place since the last run
+        clear_point_cache()
         # The population size 
         self.N = n
         # Store the actual population (you can use other data structures if you wish)
@@ -28,6 +44,25 @@ class GASolver:
         # List to store elites in each generation
         self.elites = []
         self.iterNum = 0
+        # Optional batch evaluator (e.g. parallelEvaluation.ProcessPoolEvaluator).
+        # When set, candidates are scored a whole batch at a time through evaluator.evaluate
+        # Interned individuals share their subexpressions, which hashConsing.DagEvaluator evaluates once
+        if evaluator is None and params.genome_representation == 'dag':
+            evaluator = DagEvaluator(params, lst_of_identifiers)
+        self.evaluator = evaluator
+        # Mini-batch fitness (params.minibatch_size): training rows used this generation
+        # (None means all of them), a random order of all rows and our position in it
+        self.minibatch_rows = None
+        self.minibatch_order = None
+        self.minibatch_pos = 0
+        # Per generation instrumentation (see instrumentation): None when disabled.
+        # Every callback is called as callback(solver, record) at the end of each generation.
+        self.stats = GenerationStats() if (params.instrumentation or params.stats_output is not None) else None
+        self.callbacks = []
+        # Steady-state mode (params.steady_state): the population as a heap (built on first use)
+        # and the best fitness so far after every evaluation
+        self.heap = None
+        self.evaluation_stats = []
     
     
     
@@ -35,10 +70,12 @@ class GASolver:
     # TODO #1:
     # Generate Initial Population
     def generate_initial_pop(self):
+        if self.evaluator is not None:
+            return self.generate_initial_pop_batched()
         while(len(self.pop) < self.N):
-            expr = generate_random_expr(self.params.depth, self.identifiers, self.params)
-            if(is_viable_expr(expr, self.identifiers, self.params)):
-                fit = compute_fitness(expr, self.identifiers, self.params)
+            expr = self.random_individual()
+            viable, fit = evaluate_expr(expr, self.identifiers, self.params)
+            if(viable):
                 self.pop.append((expr, fit))
     
     #############################
@@ -47,29 +84,169 @@ class GASolver:
     def mutate(self):
         # Empty list to store N - k mutations
         mutations = []
-        # Empty list  to compute weights
-        weightList = []
-        # Compute weight for probability of being randomly selected
-        for sample in self.pop:
-            weightList.append(math.exp(sample[1]/self.params.temperature))
+        # Parent selection for this generation (params.selection, see selection)
+        with self.timing('selection'):
+            selector = make_selector(self.selection_fitnesses(), self.params)
+        cutoff = self.racing_cutoff()
+        if self.evaluator is not None:
+            return self.mutate_batched(selector, cutoff)
         # While # of mutations < N - k
         while(len(mutations) < (self.N - self.k - 1)):
             # Generate e1 and e2
-            e1, e2 = random.choices(self.pop, weights = weightList, k=2)
+            with self.timing('selection'):
+                e1, e2 = self.pop[selector.draw()], self.pop[selector.draw()]
             # Generate cross
-            e1_cross, e2_cross = random_subtree_crossover(e1[0], e2[0], copy = True)
+            with self.timing('crossover'):
+                e1_cross, e2_cross = self.crossover(e1[0], e2[0])
             # Generate Mutations
-            e1_mutation = random_expression_mutation(e1_cross, self.identifiers, self.params, copy = True)
-            e2_mutation = random_expression_mutation(e2_cross, self.identifiers, self.params, copy = True)
+            with self.timing('mutation'):
+                e1_mutation = self.mutation(e1_cross)
+                e2_mutation = self.mutation(e2_cross)
             
             # If mutations are viable, append them to mutations list
-            if(is_viable_expr(e1_mutation, self.identifiers, self.params)):
-                mutations.append((e1_mutation, compute_fitness(e1_mutation, self.identifiers, self.params)))
-            if(is_viable_expr(e2_mutation, self.identifiers, self.params)):
-                mutations.append((e2_mutation, compute_fitness(e2_mutation, self.identifiers, self.params)))
+            for e_mutation in (e1_mutation, e2_mutation):
+                with self.timing('evaluation'):
+                    viable, fit = evaluate_expr(e_mutation, self.identifiers, self.params, cutoff, self.minibatch_rows)
+                if self.stats is not None:
+                    self.stats.count_evaluations([viable])
+                if(viable):
+                    mutations.append((e_mutation, fit))
         # Return list of mutations
         return mutations
     
+    #############################
+    # Instrumentation (see instrumentation)
+    # Context manager timing a phase of the generation (does nothing when disabled)
+    def timing(self, phase):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.timing(phase)
+
+    # callback(solver, record) is called at the end of every generation
+    def add_callback(self, callback):
+        if self.stats is None:
+            self.stats = GenerationStats()
+        self.callbacks.append(callback)
+
+    def report_generation(self):
+        if self.stats is None:
+            return
+        record = self.stats.record(self)
+        for callback in self.callbacks:
+            callback(self, record)
+        if self.params.stats_output is not None:
+            write_json_line(self.params.stats_output, record)
+
+    #############################
+    # Fitness values used for parent selection: with params.parsimony_coefficient > 0
+    # larger individuals are penalized (fitness - parsimony_coefficient * number of nodes)
+    def selection_fitnesses(self):
+        if self.params.parsimony_coefficient <= 0:
+            return [fit for (_, fit) in self.pop]
+        return [fit - self.params.parsimony_coefficient * e.size() for (e, fit) in self.pop]
+
+    #############################
+    # Fitness of the worst individual that elitism will keep in this generation.
+    # With params.fitness_racing, offspring evaluation stops once below it.
+    def racing_cutoff(self):
+        if not self.params.fitness_racing or self.k <= 0 or len(self.pop) < self.k:
+            return None
+        return heapq.nlargest(self.k, [fit for (_, fit) in self.pop])[-1]
+
+    #############################
+    # Choose the training rows for this generation (params.minibatch_size).
+    # Rows are taken in turn from a random order of all rows, which is redrawn once used up.
+    def next_minibatch(self):
+        n = len(self.params.regression_training_data)
+        if self.params.minibatch_size is None:
+            self.minibatch_rows = None
+            return
+        size = int(self.params.minibatch_size * self.params.minibatch_growth ** self.iterations_done())
+        if size >= n:
+            self.minibatch_rows = None
+            return
+        if self.minibatch_order is None or self.minibatch_pos + size > n:
+            rng = np.random.default_rng(random.getrandbits(64))
+            self.minibatch_order = rng.permutation(n)
+            self.minibatch_pos = 0
+        self.minibatch_rows = np.sort(self.minibatch_order[self.minibatch_pos:self.minibatch_pos + size])
+        self.minibatch_pos = self.minibatch_pos + size
+
+    # Number of generations run so far
+    def iterations_done(self):
+        return len(self.population_stats)
+
+    #############################
+    # Random candidate for the initial population
+    def random_individual(self):
+        depth = self.params.depth
+        if self.params.max_tree_depth is not None:
+            depth = min(depth, self.params.max_tree_depth)
+        expr = generate_bounded_random_expr(depth, self.params.max_tree_size, self.identifiers, self.params)
+        if self.params.genome_representation == 'linear':
+            expr = LinearGenome.from_expr(expr, self.identifiers)
+        elif self.params.genome_representation == 'dag':
+            expr = intern(expr)
+        return expr
+
+    #############################
+    # Batched versions of generate_initial_pop/mutate used with self.evaluator.
+    # Candidates are generated in this process (so the random choices do not depend on
+    # the evaluator) and then scored together; only viable ones are kept, in order.
+    def generate_initial_pop_batched(self):
+        while(len(self.pop) < self.N):
+            candidates = [self.random_individual() for j in range(self.N - len(self.pop))]
+            for (expr, (viable, fit)) in zip(candidates, self.evaluator.evaluate(candidates)):
+                if viable and len(self.pop) < self.N:
+                    self.pop.append((expr, fit))
+
+    def mutate_batched(self, selector, cutoff=None):
+        mutations = []
+        while(len(mutations) < (self.N - self.k - 1)):
+            candidates = []
+            while(len(mutations) + len(candidates) < (self.N - self.k - 1)):
+                with self.timing('selection'):
+                    e1, e2 = self.pop[selector.draw()], self.pop[selector.draw()]
+                with self.timing('crossover'):
+                    e1_cross, e2_cross = self.crossover(e1[0], e2[0])
+                with self.timing('mutation'):
+                    candidates.append(self.mutation(e1_cross))
+                    candidates.append(self.mutation(e2_cross))
+            with self.timing('evaluation'):
+                results = self.evaluator.evaluate(candidates, cutoff, self.minibatch_rows)
+            if self.stats is not None:
+                self.stats.count_evaluations([viable for (viable, _) in results])
+            for (expr, (viable, fit)) in zip(candidates, results):
+                if viable:
+                    mutations.append((expr, fit))
+        return mutations
+
+    #############################
+    # Crossover / mutation operators for the configured genome representation
+    # Linear genomes and interned expressions are never modified in place so they need no copies.
+    # The offspring respect params.max_tree_size and params.max_tree_depth.
+    def crossover(self, e1, e2):
+        (max_size, max_depth) = (self.params.max_tree_size, self.params.max_tree_depth)
+        if self.params.genome_representation == 'linear':
+            return genome_subtree_crossover(e1, e2, max_size, max_depth)
+        elif self.params.genome_representation == 'dag':
+            return dag_subtree_crossover(e1, e2, max_size, max_depth)
+        return random_subtree_crossover(e1, e2, copy = True, max_size = max_size, max_depth = max_depth)
+
+    def mutation(self, e):
+        if self.params.genome_representation == 'linear':
+            return genome_expression_mutation(e, self.identifiers, self.params)
+        elif self.params.genome_representation == 'dag':
+            return dag_expression_mutation(e, self.identifiers, self.params)
+        return random_expression_mutation(e, self.identifiers, self.params, copy = True)
+
+    #############################
+    # Convert an individual to an Expr tree
+    def as_expr(self, e):
+        if isinstance(e, LinearGenome):
+            return e.to_expr()
+        return e
+
     #############################
     # Compute Fitness Helper
     def take_second(self, x):
@@ -79,9 +256,62 @@ class GASolver:
     # TODO #3:
     # Elitism
     def elitism(self):
-        self.pop = sorted(self.pop, key = self.take_second, reverse = True)
         # Append top k elites to self.elites
-        self.elites = self.pop[:self.k]
+        self.elites = select_elites(self.pop, self.k)
+        # With mini-batches the fitness of offspring is only an estimate: re-score the elites on all the data
+        if self.minibatch_rows is not None:
+            self.elites = sorted([(e, evaluate_expr(e, self.identifiers, self.params)[1]) for (e, _) in self.elites],
+                                 key = self.take_second, reverse = True)
+
+    #############################
+    # Fit the constants of the elites and of a random sample of the offspring
+    # (params.constant_optimization_steps, see constantOptimization)
+    def optimize_constants(self, mutations):
+        if self.params.constant_optimization_steps <= 0:
+            return mutations
+        self.elites = sorted([self.optimize_individual(e, fit) for (e, fit) in self.elites],
+                             key = self.take_second, reverse = True)
+        n_sampled = int(self.params.constant_optimization_fraction * len(mutations))
+        if n_sampled > 0:
+            mutations = list(mutations)
+            for j in random.sample(range(len(mutations)), n_sampled):
+                mutations[j] = self.optimize_individual(*mutations[j])
+        return mutations
+
+    def optimize_individual(self, e, fit):
+        (e_opt, viable, fit_opt) = optimize_constants(self.as_expr(e), self.identifiers, self.params)
+        if not viable or fit_opt <= fit:
+            return (e, fit)
+        return (self.as_individual(e_opt), fit_opt)
+
+    # Convert an Expr tree to the configured genome representation
+    def as_individual(self, e):
+        if self.params.genome_representation == 'linear':
+            return LinearGenome.from_expr(e, self.identifiers)
+        elif self.params.genome_representation == 'dag':
+            return intern(e)
+        return e
+
+    #############################
+    # Replace the elites by their simplified versions every params.simplification_interval
+    # generations (see simplification)
+    def simplify_elites(self):
+        interval = self.params.simplification_interval
+        if interval <= 0 or (self.iterations_done() + 1) % interval != 0:
+            return
+        self.elites = sorted([self.simplify_individual(e, fit) for (e, fit) in self.elites],
+                             key = self.take_second, reverse = True)
+
+    # The simplified individual is kept if it is smaller and (up to rounding) as fit.
+    # Leaves are not kept: the mutation operators need an internal node.
+    def simplify_individual(self, e, fit):
+        e_simple = simplify_expr(self.as_expr(e))
+        if e_simple.is_leaf_expr() or e_simple.size() >= e.size():
+            return (e, fit)
+        (viable, fit_simple) = evaluate_expr(e_simple, self.identifiers, self.params)
+        if not viable or fit_simple < fit - 1E-9 * (1.0 + abs(fit)):
+            return (e, fit)
+        return (self.as_individual(e_simple), fit_simple)
 
     #############################
     # TODO #3:
@@ -90,11 +320,18 @@ class GASolver:
         
         # Make a list that concatenates elites with mutations from this iteration
         nextGen = self.elites + mutations
+        if self.params.remove_duplicates:
+            n = len(nextGen)
+            nextGen = remove_duplicates(nextGen)
+            nextGen = nextGen + self.fresh_individuals(n - len(nextGen), nextGen)
         # Update self.pop
         self.pop = nextGen
-        # Reorder population to observe best so far
-        self.pop = sorted(self.pop, key = self.take_second, reverse = True)
-        bestThisGen = self.pop[0][1]
+        # Best of this generation
+        best = max(self.pop, key = self.take_second)
+        # Only elites have exact fitness values when using mini-batches
+        if self.minibatch_rows is not None and len(self.elites) > 0:
+            best = self.elites[0]
+        bestThisGen = best[1]
         if(self.iterNum <= 1):
             self.iterNum = self.iterNum + 1
             print('Initial Fitness:', self.best_fitness_so_far)
@@ -102,10 +339,35 @@ class GASolver:
         if(bestThisGen > self.best_fitness_so_far):
             # Update best so far and print notification
             self.best_fitness_so_far = bestThisGen
-            self.best_solution_so_far = self.pop[0][0]
+            self.best_solution_so_far = self.as_expr(best[0])
         # Append best fitness for population statistics metrics
         self.population_stats.append(self.best_fitness_so_far)
     
+    # m random viable individuals structurally different from those of pop and from each other
+    # (they replace the duplicates removed from the next generation)
+    def fresh_individuals(self, m, pop):
+        seen = set([canonical_structure_key(e) for (e, _) in pop])
+        fresh = []
+        while len(fresh) < m:
+            candidates = []
+            for j in range(m - len(fresh)):
+                e = self.random_individual()
+                key = canonical_structure_key(e)
+                if key not in seen:
+                    seen.add(key)
+                    candidates.append(e)
+            with self.timing('evaluation'):
+                if self.evaluator is not None:
+                    results = self.evaluator.evaluate(candidates, None, self.minibatch_rows)
+                else:
+                    results = [evaluate_expr(e, self.identifiers, self.params, None, self.minibatch_rows) for e in candidates]
+            if self.stats is not None:
+                self.stats.count_evaluations([viable for (viable, _) in results])
+            for (e, (viable, fit)) in zip(candidates, results):
+                if viable and len(fresh) < m:
+                    fresh.append((e, fit))
+        return fresh
+
     #############################
     # Pretty Print Runtime
     def printTime(self, runtime):
@@ -115,31 +377,199 @@ class GASolver:
         seconds = runtime % 60
         print('Runtime (m:s): {0}:{1}'.format(int(minutes), int(seconds)))
 
+    #############################
+    # Migration support (see islandModel)
+    # Copies of the m best individuals of the current population
+    def top_individuals(self, m):
+        return select_elites(self.pop, m)
+
+    # Replace the worst individuals of the population by the migrants. Unpickled migrants are
+    # plain trees or genomes: they are converted to the representation of this solver
+    # (interned on 'dag' islands).
+    def receive_migrants(self, migrants):
+        migrants = [(self.as_individual(self.as_expr(e)), fit) for (e, fit) in migrants]
+        survivors = select_elites(self.pop, max(0, len(self.pop) - len(migrants)))
+        self.pop = survivors + migrants
+        if(len(self.pop) == 0):
+            return
+        best = max(self.pop, key = self.take_second)
+        if(best[1] > self.best_fitness_so_far):
+            self.best_fitness_so_far = best[1]
+            self.best_solution_so_far = self.as_expr(best[0])
+
+    #############################
+    # Steady-state mode (params.steady_state)
+    # Offspring are produced and inserted one at a time: a viable offspring fitter than the
+    # worst individual replaces it (selection.PopulationHeap, O(log N) per insertion) and the
+    # best individual is never lost, so there is no separate elitism. Parents are drawn by
+    # tournament. A "generation" is N evaluations, the unit of num_iters, population_stats,
+    # checkpoints and instrumentation records; evaluation_stats has the best fitness after
+    # every evaluation.
+    def population_heap(self):
+        if self.heap is None or self.heap.items is not self.pop:
+            key_fun = canonical_structure_key if self.params.remove_duplicates else None
+            self.heap = PopulationHeap(self.pop, key_fun)
+            best = max(self.pop, key = self.take_second)
+            if best[1] > self.best_fitness_so_far:
+                self.best_fitness_so_far = best[1]
+                self.best_solution_so_far = self.as_expr(best[0])
+        return self.heap
+
+    # Two offspring of parents drawn by tournament from the heap
+    def breed(self, heap):
+        if self.params.parsimony_coefficient <= 0:
+            fitness_of = self.take_second
+        else:
+            fitness_of = lambda item: item[1] - self.params.parsimony_coefficient * item[0].size()
+        with self.timing('selection'):
+            e1 = heap.items[tournament_draw(heap.items, self.params.tournament_size, fitness_of)][0]
+            e2 = heap.items[tournament_draw(heap.items, self.params.tournament_size, fitness_of)][0]
+        with self.timing('crossover'):
+            (e1_cross, e2_cross) = self.crossover(e1, e2)
+        with self.timing('mutation'):
+            return [self.mutation(e1_cross), self.mutation(e2_cross)]
+
+    # Offspring worse than the worst individual are dropped, so with params.fitness_racing
+    # their evaluation can stop there
+    def steady_state_cutoff(self, heap):
+        return heap.worst()[1] if self.params.fitness_racing else None
+
+    def insert_offspring(self, heap, e, viable, fit):
+        if self.stats is not None:
+            self.stats.count_evaluations([viable])
+        if viable and fit > heap.worst()[1]:
+            key = heap.key_fun(e) if heap.key_fun is not None else None
+            if key is None or not heap.contains_key(key):
+                heap.replace_worst((e, fit), key)
+                if fit > self.best_fitness_so_far:
+                    self.best_fitness_so_far = fit
+                    self.best_solution_so_far = self.as_expr(e)
+        self.evaluation_stats.append(self.best_fitness_so_far)
+
+    # N evaluations of offspring. With a ProcessPoolEvaluator the offspring are scored
+    # asynchronously: a few pairs per worker are in flight and each result is inserted as soon
+    # as it arrives (slow evaluations do not hold up the others), so runs with workers depend
+    # on the timing of the evaluations.
+    def steady_state_generation(self):
+        heap = self.population_heap()
+        if isinstance(self.evaluator, ProcessPoolEvaluator):
+            pending = {}
+            n_submitted = 0
+            while n_submitted < self.N or len(pending) > 0:
+                while n_submitted < self.N and len(pending) < 2 * self.evaluator.n_workers:
+                    offspring = self.breed(heap)
+                    pending[self.evaluator.submit(offspring, self.steady_state_cutoff(heap))] = offspring
+                    n_submitted = n_submitted + len(offspring)
+                with self.timing('evaluation'):
+                    (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for (e, (viable, fit)) in zip(pending.pop(future), future.result()):
+                        self.insert_offspring(heap, e, viable, fit)
+        else:
+            n_evaluated = 0
+            while n_evaluated < self.N:
+                offspring = self.breed(heap)
+                with self.timing('evaluation'):
+                    if self.evaluator is not None:
+                        results = self.evaluator.evaluate(offspring, self.steady_state_cutoff(heap))
+                    else:
+                        results = [evaluate_expr(e, self.identifiers, self.params, self.steady_state_cutoff(heap))
+                                   for e in offspring]
+                for (e, (viable, fit)) in zip(offspring, results):
+                    self.insert_offspring(heap, e, viable, fit)
+                n_evaluated = n_evaluated + len(offspring)
+        self.population_stats.append(self.best_fitness_so_far)
+
     #############################
     # GA Driver
-    def run_ga_iterations(self, n_iter=1000):
-        start = time.time()
+    # Initialize best fitness and generate the initial population
+    def initialize(self):
         # Initialize best fitness to -inf so that we catch the first generation that is greater 
         self.best_fitness_so_far = -math.inf
-        # Empty list to store mutations
-        mutations = []
         # Generate Initial Population
         self.generate_initial_pop()
 
-        for i in range(n_iter):
-            # Mutate & Crossover
-            mutations = self.mutate()
-            # Elitism
+    # One generation of the GA
+    def run_generation(self):
+        if self.stats is not None:
+            self.stats.reset()
+        if self.params.steady_state:
+            self.steady_state_generation()
+            self.report_generation()
+            return
+        self.next_minibatch()
+        # Mutate & Crossover
+        mutations = self.mutate()
+        # Elitism
+        with self.timing('elitism'):
             self.elitism()
-            # NextGen
+        # Local search on the constants
+        with self.timing('constant_optimization'):
+            mutations = self.optimize_constants(mutations)
+        with self.timing('simplification'):
+            self.simplify_elites()
+        # NextGen
+        with self.timing('elitism'):
             self.next_gen(mutations)
+        self.report_generation()
+
+    # Run generations until n_iter generations are done. With resume the solver continues
+    # from its current state (see restore_checkpoint) instead of a new initial population.
+    def run_ga_iterations(self, n_iter=1000, resume=False):
+        start = time.time()
+        if not resume:
+            self.initialize()
+        while self.iterations_done() < n_iter:
+            self.run_generation()
+            self.checkpoint_if_due()
         finish = time.time()
         runtime = finish - start
         self.printTime(runtime)
+
+    # Save a checkpoint every params.checkpoint_interval generations (see checkpoint)
+    def checkpoint_if_due(self):
+        if self.params.checkpoint_path is None or self.params.checkpoint_interval <= 0:
+            return
+        if self.iterations_done() % self.params.checkpoint_interval == 0:
+            save_checkpoint(self, self.params.checkpoint_path)
+
+## Function: make_evaluator
+# Context manager giving the batch evaluator of a run: a RemoteEvaluator on the evaluation
+# workers at worker_addresses (see remoteEvaluation), otherwise a ProcessPoolEvaluator with
+# n_workers processes, otherwise None (evaluation in this process).
+def make_evaluator(params, lst_of_identifiers, n_workers=None, worker_addresses=None):
+    if worker_addresses:
+        return RemoteEvaluator(params, lst_of_identifiers, worker_addresses)
+    if n_workers is not None:
+        return ProcessPoolEvaluator(params, lst_of_identifiers, n_workers)
+    return nullcontext(None)
+
 ## Function: curve_fit_using_genetic_algorithms
 # Run curvefitting using given parameters and return best result, best fitness and population statistics.
-# DO NOT MODIFY
-def curve_fit_using_genetic_algorithm(params, lst_of_identifiers, pop_size, num_iters):
-    solver = GASolver(params, lst_of_identifiers, pop_size)
-    solver.run_ga_iterations(num_iters)
-    return (solver.best_solution_so_far, solver.best_fitness_so_far, solver.population_stats)
\ No newline at end of file
+# n_workers: if given, score candidates on a pool of that many worker processes (see parallelEvaluation).
+# worker_addresses: if given, score candidates on these evaluation workers instead (see remoteEvaluation).
+# callback: if given, called as callback(solver, record) after every generation (see instrumentation).
+def curve_fit_using_genetic_algorithm(params, lst_of_identifiers, pop_size, num_iters, n_workers=None, callback=None,
+                                      worker_addresses=None):
+    with make_evaluator(params, lst_of_identifiers, n_workers, worker_addresses) as evaluator:
+        solver = GASolver(params, lst_of_identifiers, pop_size, evaluator)
+        if callback is not None:
+            solver.add_callback(callback)
+        solver.run_ga_iterations(num_iters)
+    return (solver.best_solution_so_far, solver.best_fitness_so_far, solver.population_stats)
+
+## Function: resume_genetic_algorithm
+# Continue the run saved in the checkpoint file checkpoint_path until num_iters generations
+# are done in total. Same arguments and results as curve_fit_using_genetic_algorithm;
+# params must describe the same problem as the interrupted run.
+def resume_genetic_algorithm(params, lst_of_identifiers, checkpoint_path, num_iters, n_workers=None, callback=None,
+                             worker_addresses=None):
+    state = load_checkpoint(checkpoint_path)
+    pop_size = checkpoint_pop_size(state)
+    with make_evaluator(params, lst_of_identifiers, n_workers, worker_addresses) as evaluator:
+        solver = GASolver(params, lst_of_identifiers, pop_size, evaluator)
+        restore_checkpoint(solver, state)
+        if callback is not None:
+            solver.add_callback(callback)
+        solver.run_ga_iterations(num_iters, resume=True)
+    return (solver.best_solution_so_far, solver.best_fitness_so_far, solver.population_stats)
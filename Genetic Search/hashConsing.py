@@ -0,0 +1,232 @@
+import math
+import weakref
+from random import choice, random
+from symbolicExpressions import *
+from makeRandomExpressions import generate_random_expr, generate_bounded_random_expr
+from crossOverOperators import collect_all_subexpressions, internal_nodes_with_paths, situate_expression_into_random_expr, \
+    choose_crossover_slots, expr_crossover_slots, can_grow, replacement_limits
+from fitnessAndValidityFunctions import all_point_blocks
+from fitnessCache import canonical_structure_key, get_fitness_cache
+
+# Hash-consing of expressions (genome_representation = 'dag')
+#
+# Crossover copies subtrees from one individual to another, so a converged population
+# holds many copies of the same subexpressions. With hash-consing every distinct
+# subexpression exists once: ExprTable.intern maps a tree to its canonical nodes, and
+# the individuals of the population are DAGs sharing them. Interned nodes are immutable
+# (set_child raises TypeError), so the operators below build new nodes along the path
+# to the change instead of copying the parents (path copying). DagEvaluator scores a
+# whole batch of individuals evaluating every distinct subexpression only once.
+#
+# The table only holds weak references: nodes no longer used by any individual are freed.
+
+
+class ExprTable:
+    def __init__(self):
+        # node key -> interned node
+        self.nodes = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Key of a node whose children are interned: the children are identified by their id
+    # (they are kept alive by the node, so their ids cannot be reused while it exists)
+    def node_key(self, e):
+        if isinstance(e, Const):
+            return ('const', repr(e.get_constant()))
+        elif isinstance(e, Ident):
+            return ('ident', e.symb)
+        elif isinstance(e, Plus):
+            return ('+',) + tuple([id(ej) for ej in e.e_list])
+        elif isinstance(e, Mult):
+            return ('*',) + tuple([id(ej) for ej in e.e_list])
+        elif isinstance(e, Minus):
+            return ('-', id(e.args[0]), id(e.args[1]))
+        elif isinstance(e, Div):
+            return ('/', id(e.args[0]), id(e.args[1]))
+        else:
+            assert isinstance(e, UnaryFnApplication)
+            return (e.fn_name, id(e.arg))
+
+    # Canonical (interned) version of the tree e. The nodes of e are reused where
+    # possible, so e must not be modified afterwards.
+    def intern(self, e):
+        if e._interned:
+            return e
+        if not e.is_leaf_expr():
+            for j in range(e.num_children()):
+                child = e.get_child(j)
+                child_interned = self.intern(child)
+                if child_interned is not child:
+                    e.set_child(j, child_interned)
+        key = self.node_key(e)
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        e._interned = True
+        e._parent = None
+        self.nodes[key] = e
+        return e
+
+    # Interned node with child idx of node replaced by e_new
+    def with_child(self, node, idx, e_new):
+        return self.intern(node.with_child(idx, self.intern(e_new)))
+
+
+# The table shared by all the individuals of this process
+expr_table = ExprTable()
+
+def intern(e):
+    return expr_table.intern(e)
+
+
+# path is the list of (parent, child index) from the root down to a subtree.
+# Return the new (interned) root obtained by putting e_new in place of that subtree.
+def replace_on_path(path, e_new):
+    for (parent, idx) in reversed(path):
+        e_new = expr_table.with_child(parent, idx, e_new)
+    return e_new
+
+
+# Same as crossOverOperators.random_subtree_crossover for interned expressions
+def dag_subtree_crossover(e1, e2, max_size=None, max_depth=None):
+    if e1.is_leaf_expr() or e2.is_leaf_expr():
+        return (e1, e2)
+    if max_size is not None or max_depth is not None:
+        slots = choose_crossover_slots(expr_crossover_slots(e1), e1.size(), expr_crossover_slots(e2), e2.size(),
+                                       max_size, max_depth)
+        if slots is None:
+            return (e1, e2)
+        (((e_subst1, sub1, path1), _, _, _), ((e_subst2, sub2, path2), _, _, _)) = slots
+        e_a = replace_on_path(path1 + ((e_subst1, sub1),), e_subst2.get_child(sub2))
+        e_b = replace_on_path(path2 + ((e_subst2, sub2),), e_subst1.get_child(sub1))
+        return (e_a, e_b)
+    (e_subst1, path1) = choice(internal_nodes_with_paths(e1))
+    (e_subst2, path2) = choice(internal_nodes_with_paths(e2))
+    sub1 = choice(range(e_subst1.num_children()))
+    sub2 = choice(range(e_subst2.num_children()))
+    e_a = replace_on_path(path1 + ((e_subst1, sub1),), e_subst2.get_child(sub2))
+    e_b = replace_on_path(path2 + ((e_subst2, sub2),), e_subst1.get_child(sub1))
+    return (e_a, e_b)
+
+
+# Same as crossOverOperators.random_expression_mutation for interned expressions
+def dag_expression_mutation(e_orig, lst_of_identifiers, params):
+    e_random_subexpr = choice(collect_all_subexpressions(e_orig))
+    if random() <= params.replace_by_subexpr:
+        return e_random_subexpr
+    elif random() <= params.grow_subexpr and can_grow(e_random_subexpr, params):
+        return intern(situate_expression_into_random_expr(e_random_subexpr, lst_of_identifiers, params))
+    else:
+        child_id = choice(range(e_random_subexpr.num_children()))
+        if params.max_tree_size is None:
+            rexpr = generate_random_expr(e_random_subexpr.depth()-1, lst_of_identifiers, params)
+        else:
+            (depth, max_size) = replacement_limits(e_random_subexpr, e_random_subexpr.get_child(child_id), params)
+            rexpr = generate_bounded_random_expr(depth, max_size, lst_of_identifiers, params)
+        return expr_table.with_child(e_random_subexpr, child_id, rexpr)
+
+
+# Batch values of the expressions roots over the n points of X. Yields (root, values) for
+# every distinct root (values is None if the evaluation failed). Every distinct node is
+# evaluated once, and its values are dropped as soon as all of its parents are evaluated.
+def dag_values(roots, X, n):
+    # Distinct nodes, children before parents, and the number of parents of each one
+    order = []
+    n_uses = {}
+    seen = set()
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            (e, expanded) = stack.pop()
+            if expanded:
+                order.append(e)
+                continue
+            if id(e) in seen:
+                continue
+            seen.add(id(e))
+            stack.append((e, True))
+            if not e.is_leaf_expr():
+                for j in range(e.num_children()):
+                    child = e.get_child(j)
+                    n_uses[id(child)] = n_uses.get(id(child), 0) + 1
+                    stack.append((child, False))
+    root_ids = set([id(root) for root in roots])
+    values = {}
+    for e in order:
+        if e.is_leaf_expr():
+            try:
+                v = e.eval_batch(X)
+            except EvaluationFailedException:
+                v = None
+        else:
+            children = [e.get_child(j) for j in range(e.num_children())]
+            flist = [values[id(child)] for child in children]
+            v = None if any([f is None for f in flist]) else e.apply_batch(flist, n)
+            for child in children:
+                n_uses[id(child)] -= 1
+                if n_uses[id(child)] == 0:
+                    del values[id(child)]
+        if n_uses.get(id(e), 0) > 0:
+            values[id(e)] = v
+        if id(e) in root_ids:
+            yield (e, v)
+
+
+# Scores batches of (interned) expressions like parallelEvaluation.ProcessPoolEvaluator,
+# sharing the work on common subexpressions (see dag_values). The results agree with
+# fitnessAndValidityFunctions.evaluate_expr; cutoff is ignored (fitness values are exact).
+class DagEvaluator:
+    def __init__(self, params, lst_of_identifiers):
+        self.params = params
+        self.identifiers = list(lst_of_identifiers)
+
+    # Return the list of (viable, fitness) for the list of expressions exprs.
+    def evaluate(self, exprs, cutoff=None, rows=None):
+        params = self.params
+        results = [None] * len(exprs)
+        keys = [None] * len(exprs)
+        use_cache = rows is None and params.fitness_cache_size > 0
+        if use_cache:
+            cache = get_fitness_cache(params)
+            for (i, e) in enumerate(exprs):
+                keys[i] = canonical_structure_key(e)
+                viable = cache.lookup(keys[i], 0)
+                fitness = cache.lookup(keys[i], 1) if viable else None
+                if viable is False:
+                    results[i] = (False, -math.inf)
+                elif fitness is not None:
+                    results[i] = (True, fitness)
+        # Positions of the expressions still to be scored, by root
+        positions = {}
+        roots = []
+        for (i, e) in enumerate(exprs):
+            if results[i] is None:
+                if id(e) not in positions:
+                    positions[id(e)] = []
+                    roots.append(e)
+                positions[id(e)].append(i)
+        if len(roots) > 0:
+            # One block of points at a time; roots whose result is final are dropped
+            blocks = all_point_blocks(self.identifiers, params)
+            scores = {id(root): (True, 0.0) for root in roots}
+            for (b, block) in enumerate(blocks.blocks):
+                if len(roots) == 0:
+                    break
+                if not blocks.uses_block(b, rows):
+                    continue
+                live = []
+                for (root, v) in dag_values(roots, block.X, block.n):
+                    (viable, fitness, finished) = blocks.accumulate(scores[id(root)][1], b, v, rows)
+                    scores[id(root)] = (viable, fitness)
+                    if not finished:
+                        live.append(root)
+                roots = live
+            for (root_id, result) in scores.items():
+                for i in positions[root_id]:
+                    results[i] = result
+                    if use_cache:
+                        cache.store(keys[i], 0, result[0])
+                        if result[0]:
+                            cache.store(keys[i], 1, result[1])
+        return results
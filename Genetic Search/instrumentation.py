@@ -0,0 +1,122 @@
+import json
+import math
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+from symbolicExpressions import *
+from linearGenome import LinearGenome
+
+# Per generation instrumentation of GASolver
+#
+# When params.instrumentation is set (or a callback/params.stats_output is given),
+# GASolver times the phases of every generation and, at the end of it, builds a record
+# (a dict, see GenerationStats.record) that is passed to the callbacks and appended as
+# one JSON line to params.stats_output. The phases are
+#   selection             building the selector and drawing parents
+#   crossover / mutation  the genetic operators
+#   evaluation            viability and fitness of the offspring (a single fused pass,
+#                         see fitnessAndValidityFunctions.evaluate_expr)
+#   elitism               choosing the elites and forming the next generation
+#   constant_optimization see constantOptimization
+#   simplification        see simplification
+
+
+# Approximate number of bytes used by the objects of the individuals of pop.
+# Objects shared by several individuals (see hashConsing) are counted once.
+def population_memory(pop):
+    seen = set()
+    total = 0
+    for (e, _) in pop:
+        stack = [e]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            total = total + sys.getsizeof(obj)
+            if isinstance(obj, LinearGenome):
+                total = total + obj.code.nbytes
+                continue
+            for v in node_fields(obj):
+                if isinstance(v, Expr):
+                    stack.append(v)
+                elif isinstance(v, (list, tuple)) and id(v) not in seen:
+                    seen.add(id(v))
+                    total = total + sys.getsizeof(v)
+                    for item in v:
+                        if isinstance(item, Expr):
+                            stack.append(item)
+    return total
+
+
+# Values of the fields of an Expr node (see Expr._fields), without the parent pointer and cached data
+def node_fields(e):
+    return [getattr(e, name) for name in e._fields]
+
+
+class GenerationStats:
+    phases = ('selection', 'crossover', 'mutation', 'evaluation', 'elitism', 'constant_optimization', 'simplification')
+
+    def __init__(self):
+        self.reset()
+
+    # Called at the start of every generation
+    def reset(self):
+        self.seconds = {phase: 0.0 for phase in self.phases}
+        self.n_evaluations = 0
+        self.n_rejected = 0
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def timing(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - start
+
+    # viabilities: viability of each evaluated offspring
+    def count_evaluations(self, viabilities):
+        for viable in viabilities:
+            self.n_evaluations += 1
+            if not viable:
+                self.n_rejected += 1
+
+    # Record of the generation that just finished
+    def record(self, solver):
+        sizes = [e.size() for (e, _) in solver.pop]
+        depths = [e.depth() for (e, _) in solver.pop]
+        seconds = dict(self.seconds)
+        seconds['total'] = time.perf_counter() - self.start
+        return {'generation': solver.iterations_done(),
+                'best_fitness': solver.best_fitness_so_far,
+                'best_fitness_this_generation': max([fit for (_, fit) in solver.pop], default=-math.inf),
+                'seconds': seconds,
+                'evaluations': self.n_evaluations,
+                'rejected': self.n_rejected,
+                'rejection_rate': self.n_rejected / max(1, self.n_evaluations),
+                'pop_size': len(solver.pop),
+                'mean_size': float(np.mean(sizes)) if sizes else 0.0,
+                'max_size': max(sizes, default=0),
+                'mean_depth': float(np.mean(depths)) if depths else 0.0,
+                'max_depth': max(depths, default=0),
+                'memory_bytes': population_memory(solver.pop)}
+
+
+# record with the non-finite floats (e.g. the -inf fitness of a generation without viable
+# individual) replaced by None: JSON has no infinities or NaN.
+def json_safe(record):
+    if isinstance(record, dict):
+        return {key: json_safe(v) for (key, v) in record.items()}
+    if isinstance(record, (list, tuple)):
+        return [json_safe(v) for v in record]
+    if isinstance(record, float) and not math.isfinite(record):
+        return None
+    return record
+
+
+# Append record as one line of JSON to the file at path
+def write_json_line(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(json_safe(record), allow_nan=False) + '\n')
@@ -0,0 +1,192 @@
+import math
+import numpy as np
+from symbolicExpressions import *
+
+# Interval analysis of expressions
+#
+# An interval (lo, hi) encloses every value a subexpression takes when the identifiers
+# range over a box (identifier -> (lo, hi)), in practice the bounding box of
+# params.test_points (see fitnessAndValidityFunctions.get_test_box). The bounds are
+# rounded outwards so that floating point errors cannot make them too tight.
+# analyze(e, box) returns (interval, status) where status is
+#   SAFE     the evaluation cannot fail anywhere in the box, so e is viable at the test points
+#   INVALID  some operation fails everywhere in the box, so e fails at every test point
+#   UNKNOWN  neither could be proved: the points have to be evaluated
+# The failures are those of Expr.eval/eval_batch: Div (and Minus, see symbolicExpressions)
+# by |f| <= 1E-10, log of f <= 0, sqrt of f < 0, overflow of exp/sinh/cosh and NaN
+# (e.g. inf - inf). Any interval with an infinite bound makes the status UNKNOWN.
+
+SAFE = 'safe'
+UNKNOWN = 'unknown'
+INVALID = 'invalid'
+
+# Bounds of an interval nothing is known about
+unbounded = (-math.inf, math.inf)
+
+# exp overflows for arguments above 709.78, sinh/cosh for |arguments| above 710.47.
+# (safe below, certain failure above) with some margin on both sides.
+exp_limits = (709.0, 710.0)
+cosh_limits = (710.0, 711.0)
+
+division_threshold = 1E-10
+
+
+def _widen(lo, hi):
+    return (math.nextafter(lo, -math.inf), math.nextafter(hi, math.inf))
+
+
+# Interval and status of a result computed with bounds (lo, hi)
+def _checked(lo, hi, status=SAFE):
+    if math.isfinite(lo) and math.isfinite(hi):
+        return (_widen(lo, hi), status)
+    return (unbounded, UNKNOWN)
+
+
+def _add(a, b):
+    return _widen(a[0] + b[0], a[1] + b[1])
+
+
+def _mult(a, b):
+    products = [a[0]*b[0], a[0]*b[1], a[1]*b[0], a[1]*b[1]]
+    return _widen(min(products), max(products))
+
+
+# Status of an operation failing for a divisor in [-division_threshold, division_threshold]
+def _divisor_status(b):
+    if -division_threshold <= b[0] and b[1] <= division_threshold:
+        return INVALID
+    if b[0] > division_threshold or b[1] < -division_threshold:
+        return SAFE
+    return UNKNOWN
+
+
+def _sin_interval(lo, hi, phase):
+    # Maxima of sin(x + phase) are at pi/2 - phase + 2 k pi, minima at -pi/2 - phase + 2 k pi
+    if hi - lo >= 2*math.pi:
+        return (-1.0, 1.0)
+    values = [math.sin(lo + phase), math.sin(hi + phase)]
+    (lo_v, hi_v) = _widen(min(values), max(values))
+    # Slack for the rounding of lo + phase
+    eps = 1E-12 * (1.0 + abs(lo) + abs(hi))
+    if math.floor((hi + eps - (math.pi/2 - phase)) / (2*math.pi)) >= math.ceil((lo - eps - (math.pi/2 - phase)) / (2*math.pi)):
+        hi_v = 1.0
+    if math.floor((hi + eps + math.pi/2 + phase) / (2*math.pi)) >= math.ceil((lo - eps + math.pi/2 + phase) / (2*math.pi)):
+        lo_v = -1.0
+    return (max(-1.0, lo_v - eps), min(1.0, hi_v + eps))
+
+
+## Function: unary_interval
+# Interval and status of fn_name applied to the values in the interval a
+def unary_interval(fn_name, a):
+    (lo, hi) = a
+    if fn_name == 'sin':
+        return (_sin_interval(lo, hi, 0.0), SAFE)
+    elif fn_name == 'cos':
+        return (_sin_interval(lo, hi, math.pi/2), SAFE)
+    elif fn_name == 'atan':
+        return (_widen(math.atan(lo), math.atan(hi)), SAFE)
+    elif fn_name == 'tanh':
+        return ((max(-1.0, math.nextafter(math.tanh(lo), -math.inf)), min(1.0, math.nextafter(math.tanh(hi), math.inf))), SAFE)
+    elif fn_name == 'log':
+        if hi <= 0.0:
+            return (unbounded, INVALID)
+        if lo <= 0.0:
+            return (unbounded, UNKNOWN)
+        return _checked(math.log(lo), math.log(hi))
+    elif fn_name == 'sqrt':
+        if hi < 0.0:
+            return (unbounded, INVALID)
+        if lo < 0.0:
+            return (unbounded, UNKNOWN)
+        return _checked(math.sqrt(lo), math.sqrt(hi))
+    elif fn_name == 'exp':
+        if lo > exp_limits[1]:
+            return (unbounded, INVALID)
+        if hi > exp_limits[0]:
+            return (unbounded, UNKNOWN)
+        return _checked(math.exp(lo), math.exp(hi))
+    elif fn_name == 'sinh' or fn_name == 'cosh':
+        if lo > cosh_limits[1] or hi < -cosh_limits[1]:
+            return (unbounded, INVALID)
+        if hi > cosh_limits[0] or lo < -cosh_limits[0]:
+            return (unbounded, UNKNOWN)
+        if fn_name == 'sinh':
+            return _checked(math.sinh(lo), math.sinh(hi))
+        top = max(math.cosh(lo), math.cosh(hi))
+        bottom = 1.0 if lo <= 0.0 <= hi else min(math.cosh(lo), math.cosh(hi))
+        return _checked(bottom, top)
+    return (unbounded, UNKNOWN)
+
+
+## Function: node_interval
+# Interval and status of the (non leaf) node e given the intervals of its children
+# (the status of the children is not taken into account, see analyze)
+def node_interval(e, child_intervals):
+    if isinstance(e, (Minus, Div)):
+        status = _divisor_status(child_intervals[1])
+        if status == INVALID:
+            return (unbounded, INVALID)
+    if not isinstance(e, UnaryFnApplication) and \
+            not all([math.isfinite(a[0]) and math.isfinite(a[1]) for a in child_intervals]):
+        return (unbounded, UNKNOWN)
+    if isinstance(e, Plus):
+        result = child_intervals[0]
+        for a in child_intervals[1:]:
+            result = _add(result, a)
+        return _checked(*result)
+    elif isinstance(e, Mult):
+        result = child_intervals[0]
+        for a in child_intervals[1:]:
+            result = _mult(result, a)
+        return _checked(*result)
+    elif isinstance(e, Minus):
+        (a, b) = child_intervals
+        (result, value_status) = _checked(a[0] - b[1], a[1] - b[0])
+        return (result, UNKNOWN if status == UNKNOWN else value_status)
+    elif isinstance(e, Div):
+        (a, b) = child_intervals
+        if status != SAFE:
+            return (unbounded, status)
+        return _checked(*_mult(a, _widen(1.0/b[1], 1.0/b[0])))
+    else:
+        assert isinstance(e, UnaryFnApplication)
+        return unary_interval(e.fn_name, child_intervals[0])
+
+
+# Interval of a leaf
+def leaf_interval(e, box):
+    if isinstance(e, Const):
+        f = e.get_constant()
+        return ((f, f), SAFE) if math.isfinite(f) else (unbounded, UNKNOWN)
+    if e.symb in box:
+        return (box[e.symb], SAFE)
+    return (unbounded, UNKNOWN)
+
+
+## Function: analyze
+# (interval, status) of e over box, see the top of this file
+def analyze(e, box):
+    if e.is_leaf_expr():
+        return leaf_interval(e, box)
+    child_intervals = []
+    status = SAFE
+    for j in range(e.num_children()):
+        (a, child_status) = analyze(e.get_child(j), box)
+        if child_status == INVALID:
+            return (unbounded, INVALID)
+        if child_status == UNKNOWN:
+            status = UNKNOWN
+        child_intervals.append(a)
+    (result, node_status) = node_interval(e, child_intervals)
+    if node_status != SAFE:
+        status = node_status
+    return (result, status)
+
+
+# Bounding box of the points in the column environment X (see Expr.eval_batch)
+def bounding_box(X):
+    box = {}
+    for (id, col) in X.items():
+        if len(col) > 0:
+            box[id] = (float(np.min(col)), float(np.max(col)))
+    return box
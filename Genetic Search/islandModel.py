@@ -0,0 +1,118 @@
+import math
+import random
+from multiprocessing import Pipe, Process
+from geneticSearchAlgorithms import GASolver
+from geneticAlgParams import GAParams
+
+# Island model GA
+#
+# n_islands independent GASolver populations evolve in separate processes, each with
+# its own random number stream. Every params.island_migration_interval generations each
+# island sends copies of its best individuals (params.island_migration_rate of its
+# population) to another island, where they replace the worst individuals.
+#   'ring'   topology: island i sends to island i+1 (mod n_islands)
+#   'random' topology: a new random permutation (without fixed points) at every migration
+
+
+def _island_main(conn, params, lst_of_identifiers, pop_size, seed):
+    random.seed(seed)
+    solver = GASolver(params, lst_of_identifiers, pop_size)
+    solver.initialize()
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg[0] == 'run':
+            (_, n_gens, n_migrants) = msg
+            for j in range(n_gens):
+                solver.run_generation()
+            conn.send(solver.top_individuals(n_migrants))
+        elif msg[0] == 'migrants':
+            solver.receive_migrants(msg[1])
+        elif msg[0] == 'result':
+            conn.send((solver.best_solution_so_far, solver.best_fitness_so_far, solver.population_stats))
+        else:
+            break
+    conn.close()
+
+
+# Island i sends its migrants to destinations[i]
+def migration_destinations(n_islands, topology, rng):
+    if n_islands < 2:
+        return list(range(n_islands))
+    if topology == 'ring':
+        return [(i + 1) % n_islands for i in range(n_islands)]
+    elif topology == 'random':
+        while True:
+            destinations = list(range(n_islands))
+            rng.shuffle(destinations)
+            if all([destinations[i] != i for i in range(n_islands)]):
+                return destinations
+    else:
+        assert False, f'Unknown migration topology {topology}'
+
+
+## Function: run_island_model
+# Same contract as curve_fit_using_genetic_algorithm: returns best result, best fitness and
+# population statistics (best fitness so far over all islands after each generation).
+# pop_size is the population of each island.
+def run_island_model(params, lst_of_identifiers, pop_size, num_iters, n_islands=4, seed=None):
+    rng = random.Random(seed)
+    n_migrants = max(1, int(params.island_migration_rate * pop_size))
+    interval = max(1, params.island_migration_interval)
+    # Each island builds its own caches
+    island_params = params.worker_copy()
+    connections = []
+    processes = []
+    for i in range(n_islands):
+        (parent_conn, child_conn) = Pipe()
+        p = Process(target=_island_main,
+                    args=(child_conn, island_params, lst_of_identifiers, pop_size, rng.getrandbits(64)))
+        p.start()
+        child_conn.close()
+        connections.append(parent_conn)
+        processes.append(p)
+    try:
+        gens_done = 0
+        while gens_done < num_iters:
+            n_gens = min(interval, num_iters - gens_done)
+            for conn in connections:
+                conn.send(('run', n_gens, n_migrants))
+            emigrants = [conn.recv() for conn in connections]
+            gens_done = gens_done + n_gens
+            if gens_done < num_iters:
+                destinations = migration_destinations(n_islands, params.island_topology, rng)
+                for (i, migrants) in enumerate(emigrants):
+                    connections[destinations[i]].send(('migrants', migrants))
+        results = []
+        for conn in connections:
+            conn.send(('result',))
+            results.append(conn.recv())
+        for conn in connections:
+            conn.send(('stop',))
+    finally:
+        # Closing the connections stops the islands waiting for a message; islands still
+        # running generations (the run was interrupted) are terminated
+        for conn in connections:
+            conn.close()
+        for p in processes:
+            p.join(timeout=1.0)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+    (best_expr, best_fitness, _) = max(results, key=lambda r: r[1])
+    stats = [max([r[2][j] for r in results]) for j in range(num_iters)]
+    return (best_expr, best_fitness, stats)
+
+
+if __name__ == '__main__':
+    params = GAParams()
+    data = []
+    for i in range(100):
+        x_value = -10.0 + 20.0 * random.random()
+        data.append(([x_value], 0.2 * math.exp(x_value / 4.0) - math.sin(2 * x_value)))
+    params.regression_training_data = data
+    params.test_points = [[-10.0 + 0.2 * j] for j in range(101)]
+    (best_expr, best_fitness, stats) = run_island_model(params, ['x'], 200, 30, n_islands=4, seed=1)
+    print(f'Island model returned solution: {best_expr} with fitness {best_fitness}')
@@ -0,0 +1,372 @@
+import math
+from random import choice, random
+import numpy as np
+from symbolicExpressions import *
+from geneticAlgParams import GAParams
+from makeRandomExpressions import generate_random_expr, generate_bounded_random_expr
+from crossOverOperators import choose_crossover_slots
+
+# Linear (array backed) genome representation
+#
+# Instead of a graph of Expr objects, an individual is a single numpy record array
+# listing its nodes in prefix order. Every record stores
+#    op  : opcode (see OP_* below)
+#    arg : identifier index (OP_IDENT), function index (OP_UNARY) or number of children (OP_PLUS/OP_MULT)
+#    val : the constant (OP_CONST)
+#    end : index one past the last node of the subtree rooted here
+# so the subtree rooted at node i is exactly the slice code[i:end[i]]. Crossover and
+# mutation are then slice splices and evaluation is a small stack machine.
+# Use to_expr/from_expr to go back and forth with the Expr classes (printing, simplify).
+
+OP_CONST = 0
+OP_IDENT = 1
+OP_PLUS = 2
+OP_MULT = 3
+OP_MINUS = 4
+OP_DIV = 5
+OP_UNARY = 6
+
+FN_NAMES = ['sin', 'cos', 'tan', 'exp', 'atan', 'tanh', 'log', 'sinh', 'cosh', 'sqrt']
+FN_INDEX = {fn_name: j for (j, fn_name) in enumerate(FN_NAMES)}
+
+genome_dtype = np.dtype([('op', np.int8), ('arg', np.int32), ('val', np.float64), ('end', np.int32)], align=False)
+
+_scalar_funs = [math.sin, math.cos, math.tan, math.exp, math.atan, math.tanh, math.log, math.sinh, math.cosh, math.sqrt]
+
+
+# Compute the end field for a code array whose op/arg fields are filled in.
+def _fill_ends(code):
+    ops = code['op']
+    args = code['arg']
+    ends = code['end']
+    # Scan from the right: a stack of the end indices of the subtrees seen so far.
+    stack = []
+    for i in range(len(code) - 1, -1, -1):
+        op = ops[i]
+        if op == OP_CONST or op == OP_IDENT:
+            ends[i] = i + 1
+        else:
+            k = 1 if op == OP_UNARY else (2 if op == OP_MINUS or op == OP_DIV else args[i])
+            last_end = i + 1
+            for _ in range(k):
+                last_end = stack.pop()
+            ends[i] = last_end
+        stack.append(ends[i])
+    assert len(stack) == 1, 'malformed genome'
+    return code
+
+
+class LinearGenome:
+    __slots__ = ('code', 'identifiers')
+
+    def __init__(self, code, identifiers):
+        self.code = code
+        self.identifiers = tuple(identifiers)
+
+    @staticmethod
+    def from_expr(e, lst_of_identifiers):
+        id_index = {symb: j for (j, symb) in enumerate(lst_of_identifiers)}
+        records = []
+        stack = [e]
+        while stack:
+            ej = stack.pop()
+            if isinstance(ej, Const):
+                records.append((OP_CONST, 0, ej.get_constant(), 0))
+            elif isinstance(ej, Ident):
+                records.append((OP_IDENT, id_index[ej.symb], 0.0, 0))
+            elif isinstance(ej, Plus) or isinstance(ej, Mult):
+                records.append((OP_PLUS if isinstance(ej, Plus) else OP_MULT, len(ej.e_list), 0.0, 0))
+                stack.extend(reversed(ej.e_list))
+            elif isinstance(ej, Minus) or isinstance(ej, Div):
+                records.append((OP_MINUS if isinstance(ej, Minus) else OP_DIV, 2, 0.0, 0))
+                stack.extend(reversed(ej.args))
+            elif isinstance(ej, UnaryFnApplication):
+                records.append((OP_UNARY, FN_INDEX[ej.fn_name], 0.0, 0))
+                stack.append(ej.arg)
+            else:
+                raise NotImplementedError(f'Cannot linearize expression of type {ej.__class__}')
+        return LinearGenome(_fill_ends(np.array(records, dtype=genome_dtype)), lst_of_identifiers)
+
+    def to_expr(self):
+        return self.subtree_expr(0)
+
+    # Expr for the subtree rooted at node i
+    def subtree_expr(self, i):
+        code = self.code
+        values = []
+        for j in range(int(code['end'][i]) - 1, i - 1, -1):
+            op = code['op'][j]
+            if op == OP_CONST:
+                values.append(Const(float(code['val'][j])))
+            elif op == OP_IDENT:
+                values.append(Ident(self.identifiers[code['arg'][j]]))
+            elif op == OP_UNARY:
+                values.append(UnaryFnApplication(FN_NAMES[code['arg'][j]], values.pop()))
+            elif op == OP_MINUS or op == OP_DIV:
+                e1 = values.pop()
+                e2 = values.pop()
+                values.append(Minus(e1, e2) if op == OP_MINUS else Div(e1, e2))
+            else:
+                e_list = [values.pop() for _ in range(code['arg'][j])]
+                values.append(Plus(e_list) if op == OP_PLUS else Mult(e_list))
+        return values.pop()
+
+    def __len__(self):
+        return len(self.code)
+
+    # Number of nodes (same as Expr.size)
+    def size(self):
+        return len(self.code)
+
+    def __repr__(self):
+        return str(self.to_expr())
+
+    def is_leaf_expr(self):
+        return self.code['op'][0] <= OP_IDENT
+
+    def structure_key(self):
+        return (self.identifiers, self.code[['op', 'arg', 'val']].tobytes())
+
+    def simplify(self):
+        return self.to_expr().simplify()
+
+    # Indices of the roots of the children of node i
+    def child_indices(self, i):
+        ends = self.code['end']
+        children = []
+        j = i + 1
+        while j < ends[i]:
+            children.append(j)
+            j = int(ends[j])
+        return children
+
+    # Indices of all non-leaf nodes (the candidates CollectSubExprsVisitorForCrossOver would collect)
+    def internal_nodes(self):
+        return np.flatnonzero(self.code['op'] > OP_IDENT)
+
+    def depth(self):
+        return int(self.node_depths()[0])
+
+    # Depth of the subtree rooted at every node
+    def node_depths(self):
+        ops = self.code['op']
+        depths = np.zeros(len(ops), dtype=np.int32)
+        for i in range(len(ops) - 1, -1, -1):
+            if ops[i] > OP_IDENT:
+                depths[i] = 1 + max([depths[j] for j in self.child_indices(i)])
+        return depths
+
+    # Distance of every node from the root (number of its ancestors)
+    def node_levels(self):
+        ends = self.code['end']
+        levels = np.zeros(len(ends), dtype=np.int32)
+        # Ends of the subtrees of the ancestors of the current node
+        stack = []
+        for i in range(len(ends)):
+            while stack and stack[-1] <= i:
+                stack.pop()
+            levels[i] = len(stack)
+            stack.append(int(ends[i]))
+        return levels
+
+    # Stack machine evaluation over a batch of points (same conventions as Expr.eval_batch).
+    def eval_batch(self, X):
+        code = self.code
+        ops = code['op']
+        args = code['arg']
+        n = batch_size(X)
+        columns = []
+        for symb in self.identifiers:
+            columns.append(np.asarray(X[symb], dtype=float) if symb in X else None)
+        stack = []
+        with np.errstate(all='ignore'):
+            for j in range(len(code) - 1, -1, -1):
+                op = ops[j]
+                if op == OP_CONST:
+                    stack.append(np.full(n, code['val'][j]))
+                elif op == OP_IDENT:
+                    col = columns[args[j]]
+                    if col is None:
+                        raise EvaluationFailedException(f'no values for identifier {self.identifiers[args[j]]}')
+                    stack.append(col)
+                elif op == OP_UNARY:
+                    stack.append(batch_funs[FN_NAMES[args[j]]](stack.pop()))
+                elif op == OP_PLUS:
+                    r = stack.pop()
+                    for _ in range(args[j] - 1):
+                        r = r + stack.pop()
+                    stack.append(r)
+                elif op == OP_MULT:
+                    r = stack.pop()
+                    for _ in range(args[j] - 1):
+                        r = r * stack.pop()
+                    stack.append(r)
+                else:
+                    f1 = stack.pop()
+                    f2 = stack.pop()
+                    bad = np.abs(f2) <= 1E-10
+                    if op == OP_MINUS:
+                        stack.append(mark_failed(f1 - f2, bad))
+                    else:
+                        stack.append(mark_failed(f1/np.where(bad, 1.0, f2), bad))
+        return stack.pop()
+
+    # Scalar stack machine evaluation (same conventions as Expr.eval).
+    def eval(self, env):
+        code = self.code
+        ops = code['op']
+        args = code['arg']
+        stack = []
+        for j in range(len(code) - 1, -1, -1):
+            op = ops[j]
+            if op == OP_CONST:
+                stack.append(float(code['val'][j]))
+            elif op == OP_IDENT:
+                symb = self.identifiers[args[j]]
+                if symb not in env:
+                    raise EvaluationFailedException(f'no values for identifier {symb}')
+                stack.append(env[symb])
+            elif op == OP_UNARY:
+                f = stack.pop()
+                fn_name = FN_NAMES[args[j]]
+                if (fn_name == 'log' and not f > 0) or (fn_name == 'sqrt' and not f >= 0.0):
+                    raise EvaluationFailedException(f'function {fn_name} raised exception')
+                stack.append(_scalar_funs[args[j]](f))
+            elif op == OP_PLUS:
+                stack.append(sum([stack.pop() for _ in range(args[j])]))
+            elif op == OP_MULT:
+                r = 1.0
+                for _ in range(args[j]):
+                    r = r * stack.pop()
+                stack.append(r)
+            else:
+                f1 = stack.pop()
+                f2 = stack.pop()
+                if abs(f2) <= 1E-10:
+                    raise EvaluationFailedException(f'division by {f2}')
+                stack.append(f1 - f2 if op == OP_MINUS else f1/f2)
+        return stack.pop()
+
+    # Subtree rooted at node i as a new genome
+    def subtree(self, i):
+        start = i
+        stop = int(self.code['end'][i])
+        sub = self.code[start:stop].copy()
+        sub['end'] -= start
+        return LinearGenome(sub, self.identifiers)
+
+    # New genome where the subtree rooted at node i is replaced by the genome g
+    def replace_subtree(self, i, g):
+        code = self.code
+        start = i
+        stop = int(code['end'][i])
+        delta = len(g.code) - (stop - start)
+        head = code[:start].copy()
+        # Ancestors of node i are exactly the nodes before it whose subtree extends past it
+        head['end'][head['end'] > start] += delta
+        middle = g.code.copy()
+        middle['end'] += start
+        tail = code[stop:].copy()
+        tail['end'] += delta
+        return LinearGenome(np.concatenate((head, middle, tail)), self.identifiers)
+
+
+# Genome for a node of the given op/arg whose children are the given genomes
+def make_genome_node(op, arg, children, lst_of_identifiers):
+    head = np.zeros(1, dtype=genome_dtype)
+    head['op'] = op
+    head['arg'] = arg
+    parts = [head]
+    offset = 1
+    for g in children:
+        part = g.code.copy()
+        part['end'] += offset
+        offset += len(part)
+        parts.append(part)
+    head['end'] = offset
+    return LinearGenome(np.concatenate(parts), lst_of_identifiers)
+
+
+def generate_random_genome(depth, lst_of_identifiers, params, max_size=None):
+    return LinearGenome.from_expr(generate_bounded_random_expr(depth, max_size, lst_of_identifiers, params), lst_of_identifiers)
+
+
+# Crossover slots (see crossOverOperators.slot_fits) of a genome: every node but the root
+def genome_crossover_slots(g):
+    ends = g.code['end']
+    depths = g.node_depths()
+    levels = g.node_levels()
+    return [(i, int(levels[i]), int(ends[i]) - i, int(depths[i])) for i in range(1, len(g.code))]
+
+# Whether g can be put under a new parent node within the size/depth limits of params
+def genome_can_grow(g, params):
+    return (params.max_tree_size is None or len(g) + 2 <= params.max_tree_size) and \
+           (params.max_tree_depth is None or g.depth() + 1 <= params.max_tree_depth)
+
+
+# Same operator as crossOverOperators.random_subtree_crossover.
+# Genomes are never modified in place so no copy is ever needed.
+def genome_subtree_crossover(g1, g2, max_size=None, max_depth=None):
+    if g1.is_leaf_expr() or g2.is_leaf_expr():
+        return (g1, g2)
+    if max_size is not None or max_depth is not None:
+        slots = choose_crossover_slots(genome_crossover_slots(g1), len(g1), genome_crossover_slots(g2), len(g2),
+                                       max_size, max_depth)
+        if slots is None:
+            return (g1, g2)
+        ((c1, _, _, _), (c2, _, _, _)) = slots
+        return (g1.replace_subtree(c1, g2.subtree(c2)), g2.replace_subtree(c2, g1.subtree(c1)))
+    i1 = int(choice(g1.internal_nodes()))
+    i2 = int(choice(g2.internal_nodes()))
+    c1 = choice(g1.child_indices(i1))
+    c2 = choice(g2.child_indices(i2))
+    return (g1.replace_subtree(c1, g2.subtree(c2)), g2.replace_subtree(c2, g1.subtree(c1)))
+
+
+# Same operator as crossOverOperators.situate_expression_into_random_expr
+def situate_genome_into_random_genome(g_orig, lst_of_identifiers, params):
+    u = random()
+    if u <= 0.8:
+        depth = params.depth if params.max_tree_depth is None else min(params.depth, params.max_tree_depth - 1)
+        max_size = None if params.max_tree_size is None else max(1, params.max_tree_size - len(g_orig) - 1)
+        g1 = generate_random_genome(depth, lst_of_identifiers, params, max_size)
+        if u <= 0.2:
+            return make_genome_node(OP_PLUS, 2, [g_orig, g1], lst_of_identifiers)
+        elif u <= 0.4:
+            return make_genome_node(OP_MINUS, 2, [g_orig, g1], lst_of_identifiers)
+        elif u <= 0.6:
+            return make_genome_node(OP_DIV, 2, [g_orig, g1], lst_of_identifiers)
+        else:
+            return make_genome_node(OP_MULT, 2, [g_orig, g1], lst_of_identifiers)
+    else:
+        fn = choice(params.allowed_unary_funs)
+        return make_genome_node(OP_UNARY, FN_INDEX[fn], [g_orig], lst_of_identifiers)
+
+
+# Same operator as crossOverOperators.random_expression_mutation
+def genome_expression_mutation(g_orig, lst_of_identifiers, params):
+    i = int(choice(g_orig.internal_nodes()))
+    g_random_subexpr = g_orig.subtree(i)
+    if random() <= params.replace_by_subexpr:
+        return g_random_subexpr
+    elif random() <= params.grow_subexpr and genome_can_grow(g_random_subexpr, params):
+        return situate_genome_into_random_genome(g_random_subexpr, lst_of_identifiers, params)
+    else:
+        child = choice(g_random_subexpr.child_indices(0))
+        max_size = None
+        if params.max_tree_size is not None:
+            max_size = max(1, params.max_tree_size - (len(g_random_subexpr) - (int(g_random_subexpr.code['end'][child]) - child)))
+        rgenome = generate_random_genome(g_random_subexpr.depth()-1, lst_of_identifiers, params, max_size)
+        return g_random_subexpr.replace_subtree(child, rgenome)
+
+
+if __name__ == '__main__':
+    params = GAParams()
+    lst_of_identifiers = ['x', 'y']
+    g1 = generate_random_genome(3, lst_of_identifiers, params)
+    g2 = generate_random_genome(3, lst_of_identifiers, params)
+    print(f'g1 = {g1} and g2 = {g2}\n')
+    (ga, gb) = genome_subtree_crossover(g1, g2)
+    print(f'ga = {ga} and gb = {gb}')
+    gc = genome_expression_mutation(ga, lst_of_identifiers, params)
+    print(f'gc = {gc}  ({len(gc)} nodes, {gc.code.nbytes} bytes)')
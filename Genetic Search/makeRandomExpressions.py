@@ -1,6 +1,8 @@
 from random import choice, random 
 from symbolicExpressions import * 
 from geneticAlgParams import GAParams
+from intervalAnalysis import leaf_interval, node_interval, unary_interval, SAFE, UNKNOWN, INVALID
+from fitnessAndValidityFunctions import get_test_box
 
 
 def generate_random_constant(params):
@@ -12,40 +14,125 @@ def generate_random_constant(params):
 def generate_random_identifier(lst_of_identifiers):
     return Ident(choice(lst_of_identifiers))
 
-def generate_random_expr(depth, lst_of_identifiers, params):
-    if depth == 0: #or random() <= params.prob_of_early_cutoff_random_expr:
+# Random expression of at most the given depth with at most max_size nodes (None: no limit).
+# The size limit is a budget shared out while the expression is built: a node only takes
+# the forms whose smallest version fits, each child may use what its earlier siblings left
+# (keeping a node for each later sibling), and a budget of one node is a leaf.
+def generate_random_expr(depth, lst_of_identifiers, params, max_size=None):
+    if params.interval_guided_generation and len(params.test_points) > 0:
+        (e, _, _) = generate_guided_random_expr(depth, lst_of_identifiers, params,
+                                                get_test_box(lst_of_identifiers, params.test_points), max_size=max_size)
+        return e
+    if depth == 0 or (max_size is not None and max_size <= 1): #or random() <= params.prob_of_early_cutoff_random_expr:
         if random() <= params.prob_leaf_constant:
             return generate_random_constant(params)
         else:
             return generate_random_identifier(lst_of_identifiers)
     else: 
         # First choose what type of Expressions we wish to see.
-        expr_types = ['plus','mult','div', 'minus', 'unaryFunApp'] 
+        expr_types = fitting_expr_types(params, max_size)
         # should they be equiprobable, fix these.
         expr_choice = choice(expr_types)
+        generate = lambda budget: generate_random_expr(depth-1, lst_of_identifiers, params, budget)
         if expr_choice == 'plus':
-            num_subexprs = choice(params.subexpr_cardinality_list)
-            e_list = [generate_random_expr(depth -1 , lst_of_identifiers, params) for j in range(num_subexprs)]
+            num_subexprs = choice(fitting_cardinalities(params, max_size))
+            e_list = random_children(num_subexprs, max_size, generate)
             return Plus(e_list)
         elif expr_choice== 'mult':
-            num_subexprs = choice(params.subexpr_cardinality_list)
-            e_list = [generate_random_expr(depth -1 , lst_of_identifiers, params) for j in range(num_subexprs)]
+            num_subexprs = choice(fitting_cardinalities(params, max_size))
+            e_list = random_children(num_subexprs, max_size, generate)
             return Mult(e_list)
         elif expr_choice == 'minus':
-            e1 = generate_random_expr(depth-1 , lst_of_identifiers, params)
-            e2 = generate_random_expr(depth-1, lst_of_identifiers, params)
+            (e1, e2) = random_children(2, max_size, generate)
             return Minus(e1, e2)
         elif expr_choice == 'div':
-            e1 = generate_random_expr(depth-1 , lst_of_identifiers, params)
-            e2 = generate_random_expr(depth-1, lst_of_identifiers, params)
+            (e1, e2) = random_children(2, max_size, generate)
             return Div(e1, e2)
         elif expr_choice == 'unaryFunApp':
-            e = generate_random_expr(depth-1, lst_of_identifiers, params)
+            (e,) = random_children(1, max_size, generate)
             fun_name = choice(params.allowed_unary_funs)
             return UnaryFnApplication(fun_name, e)
         else: 
             assert False , f'Unknown function type {expr_choice}'
 
+# Node types of generate_random_expr whose smallest expression has at most max_size nodes
+def fitting_expr_types(params, max_size):
+    expr_types = ['plus','mult','div', 'minus', 'unaryFunApp']
+    if max_size is None:
+        return expr_types
+    fits = {'plus': len(fitting_cardinalities(params, max_size)) > 0, 'div': max_size >= 3, 'minus': max_size >= 3,
+            'unaryFunApp': max_size >= 2}
+    fits['mult'] = fits['plus']
+    return [t for t in expr_types if fits[t]]
+
+# Numbers of children of Plus/Mult that fit in max_size nodes
+def fitting_cardinalities(params, max_size):
+    return [n for n in params.subexpr_cardinality_list if max_size is None or 1 + n <= max_size]
+
+# n children generate(budget) of a node of at most max_size nodes (None: no limit): each child
+# gets the nodes left by its earlier siblings, minus one for each later sibling. generate may
+# return (expression, ...) tuples (see generate_guided_random_expr).
+def random_children(n, max_size, generate):
+    children = []
+    used = 1
+    for j in range(n):
+        budget = None if max_size is None else max_size - used - (n - 1 - j)
+        child = generate(budget)
+        children.append(child)
+        used = used + (child[0] if isinstance(child, tuple) else child).size()
+    return children
+
+# (node, interval, status) for the node e with children (child, interval, status), see intervalAnalysis.analyze
+def _analyzed_node(e, children):
+    (interval, status) = node_interval(e, [c[1] for c in children])
+    statuses = [c[2] for c in children] + [status]
+    if INVALID in statuses:
+        return (e, interval, INVALID)
+    if UNKNOWN in statuses:
+        return (e, interval, UNKNOWN)
+    return (e, interval, SAFE)
+
+# Random expression like generate_random_expr (params.interval_guided_generation) steered away
+# from invalid domains by interval analysis over box: the divisors of Div and Minus are drawn
+# again (up to n_tries times) until they are proved to stay away from 0, and the unary
+# functions until their argument is proved to be in their domain (no log/sqrt of negative
+# values, no overflow). Returns (expression, interval, status) as intervalAnalysis.analyze.
+def generate_guided_random_expr(depth, lst_of_identifiers, params, box, n_tries=5, max_size=None):
+    if depth == 0 or (max_size is not None and max_size <= 1):
+        if random() <= params.prob_leaf_constant:
+            e = generate_random_constant(params)
+        else:
+            e = generate_random_identifier(lst_of_identifiers)
+        (interval, status) = leaf_interval(e, box)
+        return (e, interval, status)
+    expr_choice = choice(fitting_expr_types(params, max_size))
+    generate = lambda budget: generate_guided_random_expr(depth-1, lst_of_identifiers, params, box, n_tries, budget)
+    if expr_choice == 'plus' or expr_choice == 'mult':
+        num_subexprs = choice(fitting_cardinalities(params, max_size))
+        children = random_children(num_subexprs, max_size, generate)
+        e_list = [c[0] for c in children]
+        return _analyzed_node(Plus(e_list) if expr_choice == 'plus' else Mult(e_list), children)
+    elif expr_choice == 'minus' or expr_choice == 'div':
+        # The divisor is drawn again in the nodes left by the first child
+        first = generate(None if max_size is None else max_size - 2)
+        for j in range(n_tries):
+            second = generate(None if max_size is None else max_size - 1 - first[0].size())
+            e = Minus(first[0], second[0]) if expr_choice == 'minus' else Div(first[0], second[0])
+            if node_interval(e, [first[1], second[1]])[1] == SAFE:
+                break
+        return _analyzed_node(e, [first, second])
+    else:
+        (arg,) = random_children(1, max_size, generate)
+        for j in range(n_tries):
+            fun_name = choice(params.allowed_unary_funs)
+            if unary_interval(fun_name, arg[1])[1] == SAFE:
+                break
+        return _analyzed_node(UnaryFnApplication(fun_name, arg[0]), [arg])
+
+# Random expression of at most the given depth with at most max_size nodes (None: no limit)
+def generate_bounded_random_expr(depth, max_size, lst_of_identifiers, params):
+    return generate_random_expr(max(0, depth), lst_of_identifiers, params, max_size)
+
 if __name__ == '__main__':
     params = GAParams()
     params.allowed_unary_funs = ['sin', 'sin', 'sin', 'cos', 'cos', 'cos', 
@@ -0,0 +1,65 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+from fitnessAndValidityFunctions import evaluate_expr
+
+# Evaluate batches of candidate expressions on a pool of worker processes.
+#
+# The parameters (training data and test points) are sent to every worker once, when
+# the pool starts. Afterwards only the candidate expressions travel to the workers and
+# (viable, fitness) pairs come back, in the same order as the candidates. All random
+# choices are made in the calling process, so for a fixed seed a GA run gives the same
+# result whatever the number of workers (except in steady-state mode, where results are
+# used in the order they complete).
+
+# State of a worker process (set once by _init_worker)
+_worker_params = None
+_worker_identifiers = None
+
+
+def _init_worker(params, lst_of_identifiers):
+    global _worker_params, _worker_identifiers
+    _worker_params = params
+    _worker_identifiers = lst_of_identifiers
+
+
+def _score_chunk(args):
+    (exprs, cutoff, rows) = args
+    return [evaluate_expr(expr, _worker_identifiers, _worker_params, cutoff, rows) for expr in exprs]
+
+
+class ProcessPoolEvaluator:
+    def __init__(self, params, lst_of_identifiers, n_workers=None, chunks_per_worker=4):
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        # Number of pieces each batch is cut into per worker (more pieces balance load better)
+        self.chunks_per_worker = chunks_per_worker
+        # Each worker builds its own caches, do not ship ours
+        worker_params = params.worker_copy()
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker,
+                                            initargs=(worker_params, list(lst_of_identifiers)))
+
+    # Return the list of (viable, fitness) for the list of expressions exprs.
+    # cutoff, rows: see fitnessAndValidityFunctions.evaluate_expr
+    def evaluate(self, exprs, cutoff=None, rows=None):
+        if len(exprs) == 0:
+            return []
+        n_chunks = max(1, min(len(exprs), self.n_workers * self.chunks_per_worker))
+        chunk_size = -(-len(exprs) // n_chunks)
+        chunks = [exprs[j:j + chunk_size] for j in range(0, len(exprs), chunk_size)]
+        results = []
+        for chunk_results in self.executor.map(_score_chunk, [(chunk, cutoff, rows) for chunk in chunks]):
+            results.extend(chunk_results)
+        return results
+
+    # Future of the list of (viable, fitness) for exprs, scored as a single task on one worker.
+    # Asynchronous counterpart of evaluate for small batches (see GASolver.steady_state_generation).
+    def submit(self, exprs, cutoff=None, rows=None):
+        return self.executor.submit(_score_chunk, (list(exprs), cutoff, rows))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
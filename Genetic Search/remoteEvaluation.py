@@ -0,0 +1,435 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import time
+from collections import deque
+import numpy as np
+from geneticAlgParams import GAParams
+from trainingData import ColumnarDataset
+from fitnessAndValidityFunctions import evaluate_expr, point_array
+from checkpoint import encode_individuals, decode_individuals
+
+# Evaluation of candidate batches on worker processes of other hosts
+#
+# A worker (python remoteEvaluation.py --port 5000, one per core) serves one client
+# connection at a time. The client (RemoteEvaluator) first sends the problem: identifiers,
+# test points and the evaluation settings of params; the worker keeps them for the whole
+# connection. A data set loaded from disk (ColumnarDataset.load) is read by the worker from
+# the same path when it can see it (shared file system) and the path is inside the
+# directory given to the worker with --data-dir; otherwise the client streams the training
+# data in blocks of block_rows rows. Afterwards the client sends batches of
+# expressions and the worker answers each one with the viability and fitness of its
+# expressions. A worker that fails to handle a message drops the connection and waits for
+# the next one.
+#
+# Every message is a 12 byte prefix (lengths of the header and of the payload), a JSON
+# header and an optional payload holding numpy arrays in .npz format. Expressions travel in
+# the linearGenome encoding (see checkpoint.encode_individuals). Nothing is unpickled, but
+# there is no authentication either: workers listen on 127.0.0.1 unless given another
+# --host, which should only be done on trusted networks.
+#
+# RemoteEvaluator has the interface of parallelEvaluation.ProcessPoolEvaluator. A batch is
+# cut into chunks and every worker gets up to pipeline_depth chunks at a time, so it does
+# not wait for the network between chunks. When a worker fails (connection error, or no
+# answer within timeout seconds) its chunks go back to the queue and are scored by the
+# other workers; failed workers are reconnected at the next batch. Answers carry the number
+# of their batch, so an answer to an abandoned batch can never be taken for a newer one.
+
+protocol_version = 2
+
+# Length prefix of a message: header length, payload length
+prefix = struct.Struct('!IQ')
+
+# Settings of GAParams used by the evaluation
+evaluation_settings = ('fitness_cache_size', 'eval_chunk_size', 'subtree_cache_bytes', 'interval_analysis')
+
+
+def send_message(sock, header, arrays=None):
+    payload = b''
+    if arrays is not None:
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        payload = buf.getvalue()
+    header_bytes = json.dumps(header).encode('utf-8')
+    sock.sendall(prefix.pack(len(header_bytes), len(payload)) + header_bytes + payload)
+
+
+def _recv_exact(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        n = n - len(chunk)
+    return b''.join(chunks)
+
+
+# (header, arrays) of the next message of sock (arrays is a dict of name -> numpy array)
+def recv_message(sock):
+    (n_header, n_payload) = prefix.unpack(_recv_exact(sock, prefix.size))
+    header = json.loads(_recv_exact(sock, n_header).decode('utf-8'))
+    arrays = {}
+    if n_payload > 0:
+        with np.load(io.BytesIO(_recv_exact(sock, n_payload)), allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+    return (header, arrays)
+
+
+#############################
+# Worker side
+
+# Problem of a client connection (see RemoteEvaluator.setup_message)
+class _Problem:
+    # data_dir: directory whose data sets may be loaded (None: the data is always sent)
+    def __init__(self, header, arrays, data_dir=None):
+        self.identifiers = header['identifiers']
+        # Linear genomes are scored as linear genomes, everything else as Expr trees
+        self.representation = 'linear' if header['representation'] == 'linear' else 'tree'
+        self.columnar = header['columnar']
+        self.params = GAParams()
+        for name in evaluation_settings:
+            setattr(self.params, name, header['settings'][name])
+        self.params.test_points = [list(row) for row in arrays['test_points'].tolist()]
+        data_path = header.get('data_path')
+        self.columns = None
+        if data_path is not None and _inside(data_path, data_dir) and os.path.exists(data_path):
+            self.params.regression_training_data = ColumnarDataset.load(data_path, self.identifiers, header['data_mmap'])
+        else:
+            n = header['n_rows']
+            self.columns = [np.empty(n) for id in self.identifiers]
+            self.y = np.empty(n)
+
+    def needs_data(self):
+        return self.columns is not None
+
+    # Store a block of training rows sent by the client
+    def add_block(self, header, arrays):
+        (start, stop) = (header['start'], header['start'] + len(arrays['y']))
+        for (j, col) in enumerate(self.columns):
+            col[start:stop] = arrays[f'x{j}']
+        self.y[start:stop] = arrays['y']
+
+    def finish_data(self):
+        if self.columnar:
+            self.params.regression_training_data = ColumnarDataset(self.identifiers, dict(zip(self.identifiers, self.columns)), self.y)
+        else:
+            points = np.column_stack(self.columns) if len(self.columns) > 0 else np.zeros((len(self.y), 0))
+            self.params.regression_training_data = list(zip([list(row) for row in points.tolist()], self.y.tolist()))
+        self.columns = None
+
+    def evaluate_batch(self, header, arrays):
+        exprs = decode_individuals(arrays['code'], arrays['offsets'], self.identifiers, self.representation)
+        rows = arrays['rows'] if 'rows' in arrays else None
+        results = [evaluate_expr(e, self.identifiers, self.params, header['cutoff'], rows) for e in exprs]
+        return {'viable': np.array([viable for (viable, _) in results], dtype=bool),
+                'fitness': np.array([fitness for (_, fitness) in results], dtype=np.float64)}
+
+
+# True if path is inside the directory data_dir (after resolving symbolic links and '..')
+def _inside(path, data_dir):
+    if data_dir is None:
+        return False
+    (path, data_dir) = (os.path.realpath(path), os.path.realpath(data_dir))
+    return os.path.commonpath([path, data_dir]) == data_dir
+
+
+def _handle_message(conn, problem, header, arrays, data_dir=None):
+    if header['type'] == 'setup':
+        if header['version'] != protocol_version:
+            raise ValueError(f'unsupported protocol version {header["version"]}')
+        problem = _Problem(header, arrays, data_dir)
+        send_message(conn, {'type': 'send_data' if problem.needs_data() else 'ready'})
+    elif problem is None:
+        raise ValueError(f'{header["type"]} message before setup')
+    elif header['type'] == 'data':
+        problem.add_block(header, arrays)
+    elif header['type'] == 'data_end':
+        problem.finish_data()
+        send_message(conn, {'type': 'ready'})
+    elif header['type'] == 'evaluate':
+        results = problem.evaluate_batch(header, arrays)
+        send_message(conn, {'type': 'result', 'batch': header['batch'], 'id': header['id']}, results)
+    else:
+        raise ValueError(f'unknown message type {header["type"]}')
+    return problem
+
+
+# Serve the client connected on conn until it disconnects. Any failure (the client went
+# away, a malformed message, an exception while scoring) ends the connection only: the
+# client is told about the error when it can still be reached. data_dir: see serve.
+def serve_connection(conn, data_dir=None):
+    problem = None
+    while True:
+        try:
+            (header, arrays) = recv_message(conn)
+            if header['type'] == 'close':
+                return
+            problem = _handle_message(conn, problem, header, arrays, data_dir)
+        except OSError:
+            return
+        except Exception as err:
+            try:
+                send_message(conn, {'type': 'error', 'message': f'{type(err).__name__}: {err}'})
+            except OSError:
+                pass
+            return
+
+
+## Function: serve
+# Run a worker on host:port. ready: if given, called with the port once listening (port 0
+# picks a free port). Clients may only make the worker load the data sets inside the
+# directory data_dir (None: none, the data is always sent).
+def serve(host='127.0.0.1', port=5000, ready=None, data_dir=None):
+    with socket.create_server((host, port)) as listener:
+        if ready is not None:
+            ready(listener.getsockname()[1])
+        while True:
+            try:
+                (conn, _) = listener.accept()
+            except OSError:
+                continue
+            with conn:
+                try:
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                    serve_connection(conn, data_dir)
+                except OSError:
+                    pass
+
+
+def _serve_local(queue, data_dir):
+    serve('127.0.0.1', 0, queue.put, data_dir)
+
+
+# n worker processes on this host (e.g. for tests), data_dir: see serve. Use as
+#   with LocalWorkers(4) as addresses:
+#       with RemoteEvaluator(params, ids, addresses) as evaluator: ...
+class LocalWorkers:
+    def __init__(self, n, data_dir=None):
+        queue = multiprocessing.Queue()
+        self.processes = [multiprocessing.Process(target=_serve_local, args=(queue, data_dir), daemon=True)
+                          for j in range(n)]
+        for process in self.processes:
+            process.start()
+        self.addresses = [('127.0.0.1', queue.get(timeout=60)) for j in range(n)]
+
+    def close(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    def __enter__(self):
+        return self.addresses
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+#############################
+# Client side
+
+class _Worker:
+    def __init__(self, address):
+        self.address = address
+        self.sock = None
+        # (chunk index, time sent) of the chunks sent and not answered yet, oldest first
+        self.outstanding = deque()
+
+    def alive(self):
+        return self.sock is not None
+
+
+class RemoteEvaluator:
+    # addresses: list of (host, port) or 'host:port' of running workers
+    def __init__(self, params, lst_of_identifiers, addresses, chunks_per_worker=4, pipeline_depth=2, timeout=60.0,
+                 block_rows=1 << 20):
+        self.identifiers = list(lst_of_identifiers)
+        self.representation = params.genome_representation
+        self.chunks_per_worker = chunks_per_worker
+        self.pipeline_depth = pipeline_depth
+        # Seconds to wait for the answer to a chunk before giving up on the worker
+        self.timeout = timeout
+        # Rows per message when the training data is streamed to a worker
+        self.block_rows = block_rows
+        self.data = params.regression_training_data
+        (self.setup_header, self.setup_arrays) = self.setup_message(params)
+        # Number of the current batch, sent with every chunk and echoed in the answers
+        self.batch = 0
+        self.workers = [_Worker(parse_address(address)) for address in addresses]
+        self.n_workers = len(self.workers)
+        self.reconnect()
+        if not any([w.alive() for w in self.workers]):
+            raise ConnectionError(f'could not connect to any evaluation worker of {addresses}')
+
+    def setup_message(self, params):
+        columnar = isinstance(self.data, ColumnarDataset)
+        header = {'type': 'setup', 'version': protocol_version, 'identifiers': self.identifiers,
+                  'representation': self.representation, 'columnar': columnar, 'n_rows': len(self.data),
+                  'settings': {name: getattr(params, name) for name in evaluation_settings}}
+        if columnar and self.data.source is not None:
+            header['data_path'] = os.path.abspath(self.data.source[0])
+            header['data_mmap'] = self.data.source[1]
+        arrays = {'test_points': point_array(self.identifiers, params.test_points)}
+        return (header, arrays)
+
+    # Training rows start..stop as arrays x0, x1, ... (one per identifier) and y
+    def data_block(self, start, stop):
+        if isinstance(self.data, ColumnarDataset):
+            arrays = {f'x{j}': np.asarray(self.data.columns[id][start:stop], dtype=float) for (j, id) in enumerate(self.identifiers)}
+            arrays['y'] = np.asarray(self.data.y[start:stop], dtype=float)
+            return arrays
+        rows = self.data[start:stop]
+        points = point_array(self.identifiers, [test_pt for (test_pt, _) in rows])
+        arrays = {f'x{j}': np.ascontiguousarray(points[:, j]) for j in range(len(self.identifiers))}
+        arrays['y'] = np.array([y for (_, y) in rows], dtype=float)
+        return arrays
+
+    def connect(self, w):
+        sock = socket.create_connection(w.address, timeout=self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_message(sock, self.setup_header, self.setup_arrays)
+            (header, _) = recv_message(sock)
+            if header['type'] == 'send_data':
+                for start in range(0, len(self.data), self.block_rows):
+                    stop = min(len(self.data), start + self.block_rows)
+                    send_message(sock, {'type': 'data', 'start': start}, self.data_block(start, stop))
+                send_message(sock, {'type': 'data_end'})
+                (header, _) = recv_message(sock)
+            if header['type'] != 'ready':
+                raise ConnectionError(header.get('message', 'setup failed'))
+        except BaseException:
+            sock.close()
+            raise
+        w.sock = sock
+
+    # Connect (again) to the workers that are not connected
+    def reconnect(self):
+        for w in self.workers:
+            if not w.alive():
+                try:
+                    self.connect(w)
+                except Exception:
+                    # Unreachable, or not answering the protocol: tried again at the next batch
+                    continue
+
+    # Drop the connection to w and put its chunks back at the front of queue
+    def fail(self, w, queue):
+        try:
+            w.sock.close()
+        except OSError:
+            pass
+        w.sock = None
+        while w.outstanding:
+            queue.appendleft(w.outstanding.pop()[0])
+
+    # Return the list of (viable, fitness) for the list of expressions exprs.
+    # cutoff, rows: see fitnessAndValidityFunctions.evaluate_expr
+    def evaluate(self, exprs, cutoff=None, rows=None):
+        if len(exprs) == 0:
+            return []
+        self.reconnect()
+        self.batch = self.batch + 1
+        n_chunks = max(1, min(len(exprs), self.n_workers * self.chunks_per_worker))
+        chunk_size = -(-len(exprs) // n_chunks)
+        chunks = [exprs[j:j + chunk_size] for j in range(0, len(exprs), chunk_size)]
+        queue = deque(range(len(chunks)))
+        try:
+            results = self.run_chunks(chunks, queue, cutoff, rows)
+        except BaseException:
+            # Workers still busy with this batch would answer it later: drop them
+            for w in self.workers:
+                if w.alive() and w.outstanding:
+                    self.fail(w, queue)
+            raise
+        return [result for chunk_results in results for result in chunk_results]
+
+    def run_chunks(self, chunks, queue, cutoff, rows):
+        results = [None] * len(chunks)
+        n_done = 0
+        while n_done < len(chunks):
+            live = [w for w in self.workers if w.alive()]
+            if len(live) == 0:
+                raise ConnectionError('all evaluation workers failed')
+            for w in live:
+                while queue and len(w.outstanding) < self.pipeline_depth:
+                    j = queue.popleft()
+                    try:
+                        self.send_chunk(w, j, chunks[j], cutoff, rows)
+                    except OSError:
+                        queue.appendleft(j)
+                        self.fail(w, queue)
+                        break
+            busy = [w for w in self.workers if w.alive() and w.outstanding]
+            if len(busy) == 0:
+                continue
+            wait = max(0.0, min([w.outstanding[0][1] for w in busy]) + self.timeout - time.time())
+            (readable, _, _) = select.select([w.sock for w in busy], [], [], wait)
+            for w in busy:
+                if w.sock in readable:
+                    try:
+                        (header, arrays) = recv_message(w.sock)
+                    except Exception:
+                        self.fail(w, queue)
+                        continue
+                    if header['type'] == 'error':
+                        raise RuntimeError(f'evaluation worker {w.address}: {header["message"]}')
+                    (j, _) = w.outstanding[0]
+                    if header['type'] != 'result' or header['batch'] != self.batch or header['id'] != j:
+                        self.fail(w, queue)
+                        continue
+                    w.outstanding.popleft()
+                    results[j] = list(zip([bool(v) for v in arrays['viable']], [float(f) for f in arrays['fitness']]))
+                    n_done = n_done + 1
+                elif time.time() - w.outstanding[0][1] > self.timeout:
+                    self.fail(w, queue)
+        return results
+
+    def send_chunk(self, w, j, chunk, cutoff, rows):
+        (code, offsets) = encode_individuals(chunk, self.identifiers)
+        arrays = {'code': code, 'offsets': offsets}
+        if rows is not None:
+            arrays['rows'] = np.asarray(rows, dtype=np.int64)
+        send_message(w.sock, {'type': 'evaluate', 'batch': self.batch, 'id': j, 'cutoff': cutoff}, arrays)
+        w.outstanding.append((j, time.time()))
+
+    def close(self):
+        for w in self.workers:
+            if w.alive():
+                try:
+                    send_message(w.sock, {'type': 'close'})
+                    w.sock.close()
+                except OSError:
+                    pass
+                w.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# (host, port) from 'host:port' or a (host, port) pair
+def parse_address(address):
+    if isinstance(address, str):
+        (host, port) = address.rsplit(':', 1)
+        return (host, int(port))
+    return (address[0], int(address[1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluation worker for RemoteEvaluator')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on (0.0.0.0: all of them)')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--data-dir', help='directory of the data sets that clients may make the worker load')
+    args = parser.parse_args()
+    serve(args.host, args.port, lambda port: print(f'Evaluation worker listening on {args.host}:{port}', flush=True),
+          args.data_dir)
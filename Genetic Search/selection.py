@@ -0,0 +1,173 @@
+import heapq
+import math
+import random
+import numpy as np
+
+# Parent selection for GASolver
+#
+# A selector is built once per generation from the fitness values of the population
+# and then draws indices into the population in O(1) (roulette wheels use an alias
+# table, see AliasTable) or O(tournament_size) time, without allocating anything per draw.
+#   'boltzmann'  : P(i) proportional to exp(fitness_i/temperature). Computed relative to the
+#                  best fitness (log-sum-exp trick) so that large SSE values do not underflow.
+#   'rank'       : linear ranking, P(i) grows linearly with the rank of i; the best
+#                  individual is rank_selection_pressure times as likely as average.
+#   'tournament' : the best of tournament_size individuals drawn uniformly at random.
+# All random numbers come from the random module, so runs are reproducible with random.seed.
+
+
+# Vose's alias method: draw index i with probability weights[i]/sum(weights) using one
+# uniform index and one biased coin flip.
+class AliasTable:
+    def __init__(self, weights):
+        n = len(weights)
+        assert n > 0
+        total = float(np.sum(weights))
+        if not total > 0 or not math.isfinite(total):
+            weights = np.ones(n)
+            total = float(n)
+        scaled = [w * n / total for w in weights]
+        self.n = n
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for (i, p) in enumerate(scaled) if p < 1.0]
+        large = [i for (i, p) in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            self.prob[i] = scaled[i]
+            self.alias[i] = j
+            scaled[j] = scaled[j] - (1.0 - scaled[i])
+            if scaled[j] < 1.0:
+                small.append(j)
+            else:
+                large.append(j)
+        # Left overs (rounding errors) keep probability 1
+
+    def draw(self):
+        i = int(random.random() * self.n)
+        if random.random() < self.prob[i]:
+            return i
+        return self.alias[i]
+
+
+# exp(fitness/temperature) normalized by the largest term. Individuals with fitness
+# -inf get weight 0; if every fitness is -inf all weights are 1.
+def boltzmann_weights(fitnesses, temperature):
+    f = np.asarray(fitnesses, dtype=float)
+    finite = np.isfinite(f)
+    if not finite.any():
+        return np.ones(len(f))
+    with np.errstate(over='ignore', invalid='ignore'):
+        return np.where(finite, np.exp((f - np.max(f[finite])) / temperature), 0.0)
+
+
+# Linear ranking weights: the worst individual gets 2 - pressure, the best gets pressure
+# (1 <= pressure <= 2); ties are broken by position.
+def rank_weights(fitnesses, pressure):
+    n = len(fitnesses)
+    ranks = np.empty(n)
+    ranks[np.argsort(np.asarray(fitnesses, dtype=float), kind='stable')] = np.arange(n)
+    if n == 1:
+        return np.ones(1)
+    return (2.0 - pressure) + 2.0 * (pressure - 1.0) * ranks / (n - 1)
+
+
+class RouletteSelector:
+    def __init__(self, weights):
+        self.table = AliasTable(weights)
+
+    def draw(self):
+        return self.table.draw()
+
+
+class TournamentSelector:
+    def __init__(self, fitnesses, tournament_size):
+        self.fitnesses = list(fitnesses)
+        self.n = len(self.fitnesses)
+        self.tournament_size = max(1, tournament_size)
+
+    def draw(self):
+        best = int(random.random() * self.n)
+        for j in range(self.tournament_size - 1):
+            i = int(random.random() * self.n)
+            if self.fitnesses[i] > self.fitnesses[best]:
+                best = i
+        return best
+
+
+## Function: make_selector
+# Selector for a population with the given fitness values using params.selection.
+# selector.draw() returns the index of the selected individual.
+def make_selector(fitnesses, params):
+    if params.selection == 'boltzmann':
+        return RouletteSelector(boltzmann_weights(fitnesses, params.temperature))
+    elif params.selection == 'rank':
+        return RouletteSelector(rank_weights(fitnesses, params.rank_selection_pressure))
+    elif params.selection == 'tournament':
+        return TournamentSelector(fitnesses, params.tournament_size)
+    else:
+        assert False, f'Unknown selection strategy {params.selection}'
+
+
+# Index of the best of tournament_size entries of items drawn uniformly at random,
+# comparing fitness_of(items[i])
+def tournament_draw(items, tournament_size, fitness_of):
+    n = len(items)
+    best = int(random.random() * n)
+    best_fitness = fitness_of(items[best])
+    for j in range(tournament_size - 1):
+        i = int(random.random() * n)
+        fitness = fitness_of(items[i])
+        if fitness > best_fitness:
+            (best, best_fitness) = (i, fitness)
+    return best
+
+
+# Population of a steady-state GASolver: the list items of (individual, fitness) pairs
+# with a heapq min-heap of (fitness, counter, position in items) entries. The worst individual
+# is replaced in place in O(log N); among equally bad individuals the one that has been in
+# the population longest goes first (counter), and the entries never compare individuals.
+# With key_fun the heap also counts the keys of the individuals, so that duplicates are
+# found in O(1).
+class PopulationHeap:
+    def __init__(self, items, key_fun=None):
+        self.items = items
+        self.key_fun = key_fun
+        # key -> number of individuals with that key
+        self.keys = {}
+        if key_fun is not None:
+            for (e, _) in items:
+                key = key_fun(e)
+                self.keys[key] = self.keys.get(key, 0) + 1
+        self.entries = [(fit, i, i) for (i, (_, fit)) in enumerate(items)]
+        heapq.heapify(self.entries)
+        self.counter = len(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def worst(self):
+        return self.items[self.entries[0][2]]
+
+    def contains_key(self, key):
+        return key in self.keys
+
+    # Put item = (individual, fitness) in place of the worst individual. key: key_fun(individual)
+    def replace_worst(self, item, key=None):
+        position = self.entries[0][2]
+        if self.key_fun is not None:
+            old_key = self.key_fun(self.items[position][0])
+            self.keys[old_key] -= 1
+            if self.keys[old_key] == 0:
+                del self.keys[old_key]
+            key = self.key_fun(item[0]) if key is None else key
+            self.keys[key] = self.keys.get(key, 0) + 1
+        self.items[position] = item
+        heapq.heapreplace(self.entries, (item[1], self.counter, position))
+        self.counter = self.counter + 1
+
+
+# The k fittest (individual, fitness) pairs of pop, best first, without sorting all of pop
+def select_elites(pop, k):
+    return heapq.nlargest(k, pop, key=lambda x: x[1])
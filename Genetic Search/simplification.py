@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from symbolicExpressions import *
+from fitnessCache import canonical_structure_key
+
+# Rule based algebraic simplification
+#
+# simplify_expr rewrites an expression in a single bottom-up pass: every node is rebuilt
+# from its already simplified children and the rules below are applied to it only.
+#   constant folding   operations on constants are evaluated (unless the evaluation fails)
+#   flattening         (a + (b + c)) -> (a + b + c), same for *
+#   identities         a + 0 -> a, a * 1 -> a, a * 0 -> 0, a/1 -> a, a/a -> 1, a - a -> 0
+#   like terms         a + 2*a -> 3*a (terms equal up to the order of the children of + and *)
+#   inverse functions  exp(log(a)) -> a, log(exp(a)) -> a
+# The result agrees with e wherever e can be evaluated, but some rules remove failures
+# (a/a -> 1 also holds where a is 0, a * 0 -> 0 drops a factor that may fail) and
+# reordering sums changes the rounding. GASolver.simplify_elites therefore scores the
+# simplified individuals again and only keeps them when they are as fit.
+# The nodes of e are never modified (e may be interned, see hashConsing). The builders below
+# only get new nodes: children taken out of a node that is dropped are detached from it, so
+# that the new parent does not have to copy them (see Expr.adopt).
+
+
+def _is_const(e, f=None):
+    return isinstance(e, Const) and (f is None or e.get_constant() == f)
+
+
+def _make_mult(factors):
+    flat = []
+    for ej in factors:
+        flat.extend([ek.detach() for ek in ej.e_list] if isinstance(ej, Mult) else [ej])
+    constant = 1.0
+    others = []
+    for ej in flat:
+        if isinstance(ej, Const):
+            constant = constant * ej.get_constant()
+        else:
+            others.append(ej)
+    if constant == 0.0 or len(others) == 0:
+        return Const(constant)
+    if constant != 1.0:
+        others.append(Const(constant))
+    return others[0] if len(others) == 1 else Mult(others)
+
+
+# Term of a sum as (coefficient, rest): (a * 2.0) -> (2.0, a), a -> (1.0, a)
+def _split_coefficient(t):
+    if isinstance(t, Mult):
+        consts = [ej for ej in t.e_list if isinstance(ej, Const)]
+        rest = [ej for ej in t.e_list if not isinstance(ej, Const)]
+        if len(consts) == 1 and len(rest) > 0:
+            rest = [ej.detach() for ej in rest]
+            return (consts[0].get_constant(), rest[0] if len(rest) == 1 else Mult(rest))
+    return (1.0, t)
+
+
+def _make_plus(terms):
+    flat = []
+    for ej in terms:
+        flat.extend([ek.detach() for ek in ej.e_list] if isinstance(ej, Plus) else [ej])
+    constant = 0.0
+    # canonical key of the term without coefficient -> [coefficient, term]
+    groups = OrderedDict()
+    for ej in flat:
+        if isinstance(ej, Const):
+            constant = constant + ej.get_constant()
+            continue
+        (c, rest) = _split_coefficient(ej)
+        key = canonical_structure_key(rest)
+        if key in groups:
+            groups[key][0] = groups[key][0] + c
+        else:
+            groups[key] = [c, rest]
+    out = []
+    for (c, rest) in groups.values():
+        if c != 0.0:
+            out.append(rest if c == 1.0 else _make_mult([rest, Const(c)]))
+    if constant != 0.0 or len(out) == 0:
+        out.append(Const(constant))
+    return out[0] if len(out) == 1 else Plus(out)
+
+
+def _make_minus(e1, e2):
+    if _is_const(e1) and _is_const(e2) and abs(e2.get_constant()) > 1E-10:
+        return Const(e1.get_constant() - e2.get_constant())
+    if canonical_structure_key(e1) == canonical_structure_key(e2):
+        return Const(0.0)
+    return Minus(e1, e2)
+
+
+def _make_div(e1, e2):
+    if _is_const(e1) and _is_const(e2) and abs(e2.get_constant()) > 1E-10:
+        return Const(e1.get_constant() / e2.get_constant())
+    if _is_const(e2, 1.0):
+        return e1
+    if canonical_structure_key(e1) == canonical_structure_key(e2):
+        return Const(1.0)
+    return Div(e1, e2)
+
+
+# Functions that cancel when applied to each other: f(g(a)) -> a
+inverse_funs = {'exp': 'log', 'log': 'exp'}
+
+def _make_unary(fn_name, e):
+    if isinstance(e, Const):
+        try:
+            r = unary_funs[fn_name](e.get_constant())
+        except (OverflowError, ValueError):
+            r = None
+        if r is not None:
+            return Const(r)
+    if isinstance(e, UnaryFnApplication) and inverse_funs.get(fn_name) == e.fn_name:
+        return e.arg.detach()
+    return UnaryFnApplication(fn_name, e)
+
+
+## Function: simplify_expr
+# Simplified copy of the expression e (see the top of this file)
+def simplify_expr(e):
+    if isinstance(e, Const):
+        return Const(e.get_constant())
+    elif isinstance(e, Ident):
+        return e
+    children = [simplify_expr(e.get_child(j)) for j in range(e.num_children())]
+    if isinstance(e, Plus):
+        return _make_plus(children)
+    elif isinstance(e, Mult):
+        return _make_mult(children)
+    elif isinstance(e, Minus):
+        return _make_minus(*children)
+    elif isinstance(e, Div):
+        return _make_div(*children)
+    else:
+        assert isinstance(e, UnaryFnApplication)
+        return _make_unary(e.fn_name, children[0])
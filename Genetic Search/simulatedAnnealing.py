@@ -1,11 +1,109 @@
 from makeRandomExpressions import generate_random_expr
-from fitnessAndValidityFunctions import is_viable_expr, compute_fitness
-from random import choices, random 
-import math 
-from crossOverOperators import random_expression_mutation, random_subtree_crossover
+from fitnessAndValidityFunctions import all_point_blocks, clear_point_cache
+from random import choice, random
+import math
+import time
+import numpy as np
+from symbolicExpressions import *
+from crossOverOperators import situate_expression_into_random_expr, internal_nodes_with_paths
 from geneticAlgParams import GAParams
 
 
+# Incremental evaluation for simulated annealing
+#
+# Every step of SA changes a single subtree of the current expression. Instead of
+# modifying the tree in place, a move builds the new tree by copying only the nodes on
+# the path from the root to the changed subtree (see replace_on_path); all other
+# subtrees are shared with the current tree. IncrementalEvaluator remembers the batch
+# values of the internal nodes of the current tree (at most
+# params.simulated_annealing_cache_bytes of them), so scoring a candidate mostly evaluates
+# the new nodes: the copied path and the freshly generated subtree. The points are
+# evaluated one block at a time (see all_point_blocks).
+class IncrementalEvaluator:
+    def __init__(self, lst_of_identifiers, params):
+        self.blocks = all_point_blocks(lst_of_identifiers, params)
+        self.max_bytes = params.simulated_annealing_cache_bytes
+        # Bytes of the values of one node over all the blocks
+        self.node_bytes = 8 * sum([block.n for block in self.blocks.blocks])
+        # id(node) -> (node, values per block) for nodes of the current expression
+        self.values = {}
+        self.used_bytes = 0
+        # Bytes of the values recorded by the current call to score
+        self.pending_bytes = 0
+
+    # Batch values of e over block b. Values of nodes that are not in self.values are
+    # computed and, while the memory allows it, recorded in new_values.
+    def node_values(self, e, b, new_values):
+        block = self.blocks.blocks[b]
+        if e.is_leaf_expr():
+            return e.eval_batch(block.X)
+        entry = self.values.get(id(e))
+        if entry is None or entry[0] is not e:
+            entry = new_values.get(id(e))
+        if entry is not None and entry[0] is e and entry[1][b] is not None:
+            return entry[1][b]
+        v = e.apply_batch([self.node_values(e.get_child(j), b, new_values) for j in range(e.num_children())], block.n)
+        if entry is None or entry[0] is not e:
+            if self.used_bytes + self.pending_bytes + self.node_bytes > self.max_bytes:
+                return v
+            entry = (e, [None] * len(self.blocks.blocks))
+            new_values[id(e)] = entry
+            self.pending_bytes += self.node_bytes
+        entry[1][b] = v
+        return v
+
+    # (viable, fitness) of e, see fitnessAndValidityFunctions.evaluate_expr
+    def score(self, e, new_values):
+        self.pending_bytes = 0
+        return self.blocks.score(lambda b, block: self.node_values(e, b, new_values))
+
+    # e becomes the current expression: keep the (complete) values of its nodes only
+    def commit(self, e, new_values):
+        values = {}
+        seen = set()
+        stack = [e]
+        while stack:
+            ej = stack.pop()
+            if ej.is_leaf_expr() or id(ej) in seen:
+                continue
+            seen.add(id(ej))
+            for entries in [self.values, new_values]:
+                entry = entries.get(id(ej))
+                if entry is not None and entry[0] is ej and all([v is not None for v in entry[1]]):
+                    values[id(ej)] = entry
+                    break
+            stack.extend([ej.get_child(j) for j in range(ej.num_children())])
+        self.values = values
+        self.used_bytes = len(values) * self.node_bytes
+
+
+# path is the list of (parent, child index) from the root down to a subtree.
+# Return the new root obtained by putting e_new in place of that subtree.
+def replace_on_path(path, e_new):
+    for (parent, idx) in reversed(path):
+        e_new = parent.with_child(idx, e_new)
+    return e_new
+
+
+# A random single subtree move, using the same kinds of changes (and probabilities)
+# as crossOverOperators.random_expression_mutation but applied inside the tree:
+# replace a subexpression by one of its children, grow it into a bigger expression or
+# replace one of its children by a random expression.
+def random_neighbor(e, lst_of_identifiers, params):
+    candidates = internal_nodes_with_paths(e)
+    if len(candidates) == 0:
+        return generate_random_expr(params.depth, lst_of_identifiers, params)
+    (node, path) = choice(candidates)
+    if random() <= params.replace_by_subexpr:
+        e_new = node.get_child(choice(range(node.num_children())))
+    elif random() <= params.grow_subexpr:
+        e_new = situate_expression_into_random_expr(node, lst_of_identifiers, params, share=True)
+    else:
+        child_id = choice(range(node.num_children()))
+        e_new = node.with_child(child_id, generate_random_expr(node.depth()-1, lst_of_identifiers, params))
+    return replace_on_path(path, e_new)
+
+
 # Implement simulated annealing: this is not compulsory but
 # one of the ways you can go "above and beyond" is to compare GA
 # to simulated annealing.
@@ -19,9 +117,52 @@ from geneticAlgParams import GAParams
 #        params.simulated_annealing_cool_steps=100
 #        params.simulated_annealing_cool_frac = 0.8
 #        params.simulated_annealing_start_temp = 100
-#  Feel free to reuse ideas from assignment 4.
-def run_simulated_annealing(n_steps, lst_of_identifiers, params):
-    raise NotImplementedError('Simulated Annealing not implemented')
+#        time_budget -- optional limit in seconds (stops early once exceeded)
+#  Returns best expression, best fitness and the best fitness so far after every step.
+def run_simulated_annealing(n_steps, lst_of_identifiers, params, time_budget=None):
+    start = time.time()
+    # The point lists may have been modified in place since the last run
+    clear_point_cache()
+    evaluator = IncrementalEvaluator(lst_of_identifiers, params)
+    # Start from a random viable expression
+    viable = False
+    while not viable:
+        current = generate_random_expr(params.depth, lst_of_identifiers, params)
+        new_values = {}
+        (viable, current_fitness) = evaluator.score(current, new_values)
+    evaluator.commit(current, new_values)
+    best_so_far = current
+    best_fitness_so_far = current_fitness
+    temperature = params.simulated_annealing_start_temp
+    stats = []
+    for step in range(n_steps):
+        candidate = random_neighbor(current, lst_of_identifiers, params)
+        new_values = {}
+        (viable, fitness) = evaluator.score(candidate, new_values)
+        if viable:
+            delta = fitness - current_fitness
+            if delta >= 0 or (temperature > 0 and random() < math.exp(delta/temperature)):
+                current = candidate
+                current_fitness = fitness
+                evaluator.commit(current, new_values)
+                if current_fitness > best_fitness_so_far:
+                    best_so_far = current
+                    best_fitness_so_far = current_fitness
+        stats.append(best_fitness_so_far)
+        if (step + 1) % params.simulated_annealing_cool_steps == 0:
+            temperature = temperature * params.simulated_annealing_cool_frac
+        if time_budget is not None and time.time() - start > time_budget:
+            break
     return (best_so_far, best_fitness_so_far, stats)
 
 
+if __name__ == '__main__':
+    params = GAParams()
+    data = []
+    for i in range(100):
+        x_value = -10.0 + 20.0 * random()
+        data.append(([x_value], 0.2 * math.exp(x_value / 4.0) - math.sin(2 * x_value)))
+    params.regression_training_data = data
+    params.test_points = [[-10.0 + 0.2 * j] for j in range(101)]
+    (best, best_fitness, stats) = run_simulated_annealing(20000, ['x'], params)
+    print(f'SA Returned Solution: {best} with fitness {best_fitness}')
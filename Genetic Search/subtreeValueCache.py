@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import weakref
+from symbolicExpressions import *
+
+# Per node cache of subtree values
+#
+# A SubtreeValueCache is bound to one batch environment X (a fixed set of points).
+# Evaluating an expression through it stores the output vector of every internal node
+# on the node itself (Expr._cached_value). When set_child replaces a subtree, only the
+# cached values of the node and its ancestors are dropped (Expr.invalidate_cached_values),
+# so re-evaluating after a mutation or crossover only recomputes the nodes on the path
+# from the root to the change. deepcopy shares the cached vectors with the copy, so the
+# offspring produced by the operators in crossOverOperators start with warm caches.
+#
+# The memory used by the cached vectors is bounded by max_bytes: when it is exceeded the
+# vectors of the least recently used nodes are dropped. A vector shared by several nodes
+# (a node and its copies) is counted once. Leaves are never cached (an identifier is just a
+# column of X and constants are cheap to rebuild).
+#
+# A mutable node belongs to a single tree (see Expr.adopt), so the parent pointers reach
+# every node whose value depends on it.
+
+class SubtreeValueCache:
+    def __init__(self, X, max_bytes):
+        self.X = X
+        self.n = batch_size(X)
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        # id(node) -> (weak reference to node, id(vector)), least recently used first
+        self.entries = OrderedDict()
+        # id(vector) -> [number of nodes holding it, bytes]
+        self.arrays = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Batch values of e over the points of X
+    def evaluate(self, e):
+        entry = e._cached_value
+        if entry is not None and entry[0] is self:
+            self.hits += 1
+            if id(e) in self.entries:
+                self.entries.move_to_end(id(e))
+            return entry[1]
+        if e.is_leaf_expr():
+            return e.eval_batch(self.X)
+        self.misses += 1
+        v = e.apply_batch([self.evaluate(e.get_child(j)) for j in range(e.num_children())], self.n)
+        self.store(e, v)
+        return v
+
+    def store(self, e, v):
+        if v.nbytes > self.max_bytes:
+            return
+        if e._cached_value is not None:
+            e._cached_value[0].release(e)
+        e._cached_value = (self, v)
+        self.track(e, v)
+
+    # e_copy is a copy of e (see Expr.__deepcopy__) sharing its cached values
+    def share(self, e, e_copy):
+        e_copy._cached_value = e._cached_value
+        self.track(e_copy, e._cached_value[1])
+
+    def track(self, e, v):
+        key = id(e)
+        if key in self.entries:
+            self._forget(key, self.entries[key][0])
+        # Forget the entry once the node is garbage collected
+        ref = weakref.ref(e, lambda r, key=key: self._forget(key, r))
+        self.entries[key] = (ref, id(v))
+        counted = self.arrays.get(id(v))
+        if counted is None:
+            self.arrays[id(v)] = [1, v.nbytes]
+            self.used_bytes += v.nbytes
+        else:
+            counted[0] += 1
+        while self.used_bytes > self.max_bytes and len(self.entries) > 0:
+            (_, (old_ref, _)) = next(iter(self.entries.items()))
+            old = old_ref()
+            if old is not None:
+                self.release(old)
+            else:
+                self._forget(next(iter(self.entries)), old_ref)
+            self.evictions += 1
+
+    # Drop the cached values of e
+    def release(self, e):
+        e._cached_value = None
+        entry = self.entries.get(id(e))
+        if entry is not None:
+            self._forget(id(e), entry[0])
+
+    def _forget(self, key, ref):
+        entry = self.entries.get(key)
+        # The id may have been reused by a newer node: only remove our own entry
+        if entry is not None and entry[0] is ref:
+            del self.entries[key]
+            counted = self.arrays[entry[1]]
+            counted[0] -= 1
+            if counted[0] == 0:
+                del self.arrays[entry[1]]
+                self.used_bytes -= counted[1]
+
+    def stats(self):
+        return {'nodes': len(self.entries), 'bytes': self.used_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def __repr__(self):
+        return f'SubtreeValueCache({len(self.entries)} nodes, {self.used_bytes}/{self.max_bytes} bytes, {self.hits} hits, {self.misses} misses)'
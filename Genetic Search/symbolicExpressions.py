@@ -1,6 +1,8 @@
 from functools import reduce 
 import math 
+import sys
 from copy import deepcopy
+import numpy as np
 
 # Abstract Syntax Tree Implementation in Python
 # Author: Sriram Sankaranarayanan (srirams@colorado)
@@ -21,11 +23,49 @@ class EvaluationFailedException(Exception):
 # This is a base class for all Expressions
 # Representing a generic expression. We will 
 # extend from this  base class.
+# Nodes use __slots__ (no per node __dict__). Besides the fields of each class
+# (listed in _fields) every node has
+#   _parent        parent of this node (set when the node is made a child of another one, cleared when
+#                  it is replaced or detached). Used to invalidate the cached data of the ancestors
+#                  when a subtree is replaced. A mutable node belongs to a single tree: set_child and
+#                  the constructors copy a child that still belongs to another node (see adopt).
+#   _cached_value  (cache, batch values) when a subtreeValueCache.SubtreeValueCache holds the values of this subtree
+#   _interned      True for the shared, immutable nodes of hashConsing.ExprTable
+#   _size, _depth  cached results of size()/depth() (None until computed)
+#   _key           cached result of structure_key() (None until computed)
+# Like the cached values, _size/_depth/_key are dropped along the parent pointers by set_child.
 class Expr: 
+    __slots__ = ('_parent', '_cached_value', '_interned', '_size', '_depth', '_key', '__weakref__')
+    _fields = ()
+
+    # Every node, however it is created (constructor, copy, unpickling), starts without
+    # parent or cached data
+    def __new__(cls, *args):
+        e = object.__new__(cls)
+        e._parent = None
+        e._cached_value = None
+        e._interned = False
+        e._size = None
+        e._depth = None
+        e._key = None
+        return e
+
     # Evaluate the expression using env to lookup values for identifier
     def eval(self, env):
         raise EvaluationFailedException('What do you want me to eval? I am just a parentless class here. Boo hoo!')
 
+    # Evaluate the expression over a whole batch of points at once.
+    # X maps each identifier to a numpy array holding its values (one column per identifier).
+    # Returns a numpy array with one output per point. Points where evaluation fails
+    # (log/sqrt of -ve number, division by zero, overflow) come back as NaN instead of raising.
+    def eval_batch(self, X):
+        raise EvaluationFailedException('What do you want me to eval_batch? I am just a parentless class here.')
+
+    # Batch value of this (non leaf) expression given the batch values flist of its
+    # children over n points. eval_batch is apply_batch applied to the children's eval_batch.
+    def apply_batch(self, flist, n):
+        raise NotImplementedError
+
     # Get the number of children
     def num_children(self): 
         raise NotImplementedError
@@ -36,20 +76,137 @@ class Expr:
 
     # Replace a subtree by e
     def set_child(self, idx, e):
+        self.check_mutable()
+        e = self.adopt(e)
+        old = self.get_child(idx)
+        self._put_child(idx, e)
+        self.disown(old)
+        self.invalidate_cached_values()
+
+    # Store e as child idx (no bookkeeping, see set_child)
+    def _put_child(self, idx, e):
         raise NotImplementedError
 
+    # The node to store as a child of self: e, or a copy of e if e still belongs to another
+    # tree (its parent would not see the changes made inside it). Interned nodes are immutable
+    # and shared as they are, without parent.
+    def adopt(self, e):
+        if e._interned:
+            return e
+        if e._parent is not None and e._parent is not self:
+            e = deepcopy(e)
+        e._parent = self
+        return e
+
+    # Called when old is no longer a child of self
+    def disown(self, old):
+        if old._parent is self and all([self.get_child(j) is not old for j in range(self.num_children())]):
+            old._parent = None
+
+    # Make this node the root of its own tree (the caller takes it out of its parent, or drops
+    # the parent): it is then adopted without copy and does not keep the old tree alive.
+    def detach(self):
+        self._parent = None
+        return self
+
+    # Called before modifying a node: interned nodes are shared and cannot be modified
+    def check_mutable(self):
+        if self._interned:
+            raise TypeError(f'{self} is interned (see hashConsing) and cannot be modified')
+
+    # Copy of this node with child idx replaced by e_new. This node is left unchanged
+    # and the copy shares all the other children with it (as well as e_new if e_new
+    # belongs to another tree): the shared subtrees keep their parent, so trees built
+    # this way (simulatedAnnealing, hashConsing) must not be modified with set_child.
+    def with_child(self, idx, e_new):
+        e_copy = self.__class__.__new__(self.__class__)
+        for name in self._fields:
+            setattr(e_copy, name, getattr(self, name))
+        if hasattr(e_copy, 'e_list'):
+            e_copy.e_list = list(self.e_list)
+        e_copy._put_child(idx, e_new)
+        if e_new._parent is None and not e_new._interned:
+            e_new._parent = e_copy
+        return e_copy
+
+    # Record that self is the parent of its children (copying those that belong to another tree)
+    def adopt_children(self):
+        for j in range(self.num_children()):
+            child = self.get_child(j)
+            adopted = self.adopt(child)
+            if adopted is not child:
+                self._put_child(j, adopted)
+
+    # Called by set_child: the values, sizes, depths and keys cached for this node and all of its ancestors are stale.
+    def invalidate_cached_values(self):
+        e = self
+        while e is not None:
+            if e._cached_value is not None:
+                e._cached_value[0].release(e)
+            e._size = None
+            e._depth = None
+            e._key = None
+            e = e._parent
+
+    # Copies share the cached values of the original (arrays are never modified in place).
+    # The copy of a tree is a tree of its own: its root has no parent and its nodes are the
+    # parents of their (copied) children. Copies of interned nodes are ordinary (mutable) nodes.
+    def __deepcopy__(self, memo):
+        e_copy = self.__class__.__new__(self.__class__)
+        memo[id(self)] = e_copy
+        for name in self._fields:
+            setattr(e_copy, name, deepcopy(getattr(self, name), memo))
+        e_copy._size = self._size
+        e_copy._depth = self._depth
+        e_copy._key = self._key
+        if not e_copy.is_leaf_expr():
+            e_copy.adopt_children()
+        if self._cached_value is not None:
+            self._cached_value[0].share(self, e_copy)
+        return e_copy
+
+    # Only the fields are pickled: no cached data, parent pointers or interned flag (the parent
+    # pointers are restored from the children lists when unpickling).
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __setstate__(self, state):
+        for (name, v) in state.items():
+            setattr(self, name, v)
+        if not self.is_leaf_expr():
+            self.adopt_children()
+
     # Leaf expressions are Const/Ident
     def is_leaf_expr(self):
         return False
 
-    # Compute tree depth
+    # Compute tree depth (cached on the node)
     def depth(self):
-        return 0
+        if self._depth is None:
+            self._depth = 1 + max([self.get_child(j).depth() for j in range(self.num_children())])
+        return self._depth
+
+    # Number of nodes of the tree (cached on the node)
+    def size(self):
+        if self._size is None:
+            self._size = 1 + sum([self.get_child(j).size() for j in range(self.num_children())])
+        return self._size
 
     # Do a simplification to be able to do some "constant folding"
     def simplify(self):
         return deepcopy(self)
 
+    # Hashable nested tuple describing the structure of the expression (cached on the node).
+    # Two expressions have the same key iff they are the same tree.
+    def structure_key(self):
+        if self._key is None:
+            self._key = self.make_structure_key()
+        return self._key
+
+    # structure_key of this (non leaf) expression, from the keys of its children
+    def make_structure_key(self):
+        raise NotImplementedError
+
 
 # Visitor Pattern for an expression
 # This is useful in implementing functionality outside the Expr class and its derived class.
@@ -103,10 +260,56 @@ class ExpressionVisitorPattern:
    
 
 
+# Number of points in a batch environment X (see Expr.eval_batch)
+def batch_size(X):
+    for v in X.values():
+        return len(v)
+    return 0
+
+# Replace the entries of r by NaN wherever fail_mask is True.
+def mark_failed(r, fail_mask):
+    if np.any(fail_mask):
+        r = np.where(fail_mask, np.nan, r)
+    return r
+
+# Vectorized counterparts of UnaryFnApplication.funs
+# Each takes a numpy array and returns NaN at the points where the scalar version fails:
+# domain errors for log/sqrt and overflow (math raises OverflowError, numpy returns inf).
+def _batch_log(f):
+    ok = f > 0
+    return mark_failed(np.log(np.where(ok, f, 1.0)), np.logical_not(ok))
+
+def _batch_sqrt(f):
+    ok = f >= 0.0
+    return mark_failed(np.sqrt(np.where(ok, f, 0.0)), np.logical_not(ok))
+
+def _batch_overflow_checked(np_fn):
+    def fn(f):
+        with np.errstate(over='ignore', invalid='ignore'):
+            r = np_fn(f)
+        return mark_failed(r, np.isinf(r) & np.isfinite(f))
+    return fn
+
+batch_funs = {'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'exp': _batch_overflow_checked(np.exp),
+    'atan': np.arctan,
+    'tanh': np.tanh,
+    'log': _batch_log,
+    'sinh': _batch_overflow_checked(np.sinh),
+    'cosh': _batch_overflow_checked(np.cosh),
+    'sqrt': _batch_sqrt
+}
+
+
 # Class Const: 
 #  Reprents a constant expression with f as the constant (double precision) number 
 
 class Const(Expr):
+    __slots__ = ('f',)
+    _fields = ('f',)
+
     def __init__(self, f):
         self.f = f
 
@@ -116,18 +319,60 @@ class Const(Expr):
     def eval(self, env):
         return  self.f
 
+    def eval_batch(self, X):
+        return np.full(batch_size(X), self.f)
+
     def is_leaf_expr(self):
         return True
 
+    def depth(self):
+        return 0
+
+    def size(self):
+        return 1
+
     def get_constant(self):
         return self.f
 
+    # Change the value of the constant (e.g. constantOptimization); the values cached for
+    # the expressions containing it are dropped.
+    def set_constant(self, f):
+        self.check_mutable()
+        self.f = f
+        self.invalidate_cached_values()
+
+    def structure_key(self):
+        return ('const', self.f)
+
 # Class: Ident
 # Represents a variable with symb (string) as the name of the variable.
+# Ident nodes are interned: there is a single (immutable) node per name, shared by all
+# the expressions using it. They do not record a parent (they have many).
 
 class Ident(Expr): 
+    __slots__ = ('symb',)
+    _fields = ('symb',)
+    # name -> the Ident node for that name
+    _instances = {}
+
+    def __new__(cls, symb):
+        e = cls._instances.get(symb)
+        if e is None:
+            e = Expr.__new__(cls)
+            e.symb = sys.intern(symb)
+            cls._instances[e.symb] = e
+        return e
+
     def __init__(self, symb):
-        self.symb = symb
+        pass
+
+    _parent = property(lambda self: None, lambda self, parent: None)
+
+    def __reduce__(self):
+        return (Ident, (self.symb,))
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __repr__(self):
         return self.symb
@@ -138,9 +383,24 @@ class Ident(Expr):
         else:
             raise EvaluationFailedException()
 
+    def eval_batch(self, X):
+        if self.symb in X:
+            return np.asarray(X[self.symb], dtype=float)
+        else:
+            raise EvaluationFailedException(f'no values for identifier {self.symb}')
+
+    def structure_key(self):
+        return ('ident', self.symb)
+
     def is_leaf_expr(self):
         return True
 
+    def depth(self):
+        return 0
+
+    def size(self):
+        return 1
+
 
 # Class: Plus
 # Sum of sub-expressions. The children expression are stored in a list e_list
@@ -148,9 +408,12 @@ class Ident(Expr):
 # enforce it.
 
 class Plus(Expr): 
+    __slots__ = ('e_list',)
+    _fields = ('e_list',)
 
     def __init__(self, e_list):
         self.e_list = e_list
+        self.adopt_children()
 
     def __repr__(self):
         return '('+ (' + '.join([str(ei) for ei in self.e_list])) + ')'
@@ -159,6 +422,13 @@ class Plus(Expr):
         flist = [ei.eval(env) for ei in self.e_list]
         return sum(flist)
 
+    def eval_batch(self, X):
+        return self.apply_batch([ei.eval_batch(X) for ei in self.e_list], batch_size(X))
+
+    def apply_batch(self, flist, n):
+        with np.errstate(over='ignore', invalid='ignore'):
+            return reduce(np.add, flist, np.zeros(n))
+
     def num_children(self): 
         return len(self.e_list)
 
@@ -166,12 +436,12 @@ class Plus(Expr):
         assert 0 <= idx < len(self.e_list)
         return self.e_list[idx]
 
-    def set_child(self, idx, e_new):
+    def _put_child(self, idx, e_new):
         assert 0 <= idx < len(self.e_list)
         self.e_list[idx] = e_new
 
-    def depth(self):
-        return 1 + max([ej.depth() for ej in self.e_list])
+    def make_structure_key(self):
+        return ('+',) + tuple([ej.structure_key() for ej in self.e_list])
 
     def simplify(self):
         new_list = [e.simplify() for e in self.e_list]
@@ -190,8 +460,12 @@ class Plus(Expr):
 # enforce it.
 
 class Mult(Expr):
+    __slots__ = ('e_list',)
+    _fields = ('e_list',)
+
     def __init__(self, e_list):
         self.e_list = e_list 
+        self.adopt_children()
 
     def __repr__(self):
         return '('+ (' * '.join([str(ei) for ei in self.e_list])) + ')'
@@ -199,6 +473,13 @@ class Mult(Expr):
     def eval(self, env):
         flist = [ei.eval(env) for ei in self.e_list]
         return reduce(lambda a,b:a*b, flist, 1.0 )
+
+    def eval_batch(self, X):
+        return self.apply_batch([ei.eval_batch(X) for ei in self.e_list], batch_size(X))
+
+    def apply_batch(self, flist, n):
+        with np.errstate(over='ignore', invalid='ignore'):
+            return reduce(np.multiply, flist, np.ones(n))
     
     def simplify(self):
         new_list = [e.simplify() for e in self.e_list]
@@ -215,20 +496,24 @@ class Mult(Expr):
         assert 0 <= idx < len(self.e_list)
         return self.e_list[idx]
 
-    def set_child(self, idx, e_new):
+    def _put_child(self, idx, e_new):
         assert 0 <= idx < len(self.e_list)
         self.e_list[idx] = e_new
 
-    def depth(self):
-        return 1 + max([ej.depth() for ej in self.e_list])
+    def make_structure_key(self):
+        return ('*',) + tuple([ej.structure_key() for ej in self.e_list])
 
 
 # Class: Mult
 #  Minus of two expressions e1 - e2
 
 class Minus(Expr):
+    __slots__ = ('args',)
+    _fields = ('args',)
+
     def __init__(self, e1, e2):
         self.args = (e1, e2)
+        self.adopt_children()
     def __repr__(self):
         return str(self.args[0])+' - '+str(self.args[1])
 
@@ -239,6 +524,15 @@ class Minus(Expr):
             raise EvaluationFailedException(f'division by {f2}')
         return f1 - f2
 
+    def eval_batch(self, X):
+        return self.apply_batch([self.args[0].eval_batch(X), self.args[1].eval_batch(X)], batch_size(X))
+
+    def apply_batch(self, flist, n):
+        (f1, f2) = flist
+        # Same failure condition as eval above
+        with np.errstate(over='ignore', invalid='ignore'):
+            return mark_failed(f1 - f2, np.abs(f2) <= 1E-10)
+
     def simplify(self):
         e1 = self.args[0].simplify()
         e2 = self.args[1].simplify()
@@ -254,22 +548,26 @@ class Minus(Expr):
         assert 0 <= idx < 2
         return self.args[idx]
 
-    def set_child(self, idx, e_new):
+    def _put_child(self, idx, e_new):
         assert 0 <= idx < 2
         if idx == 0:
             self.args = (e_new, self.args[1]) 
         else: 
             self.args = (self.args[0], e_new)
     
-    def depth(self):
-        return 1 + max(self.args[0].depth(), self.args[1].depth())
+    def make_structure_key(self):
+        return ('-', self.args[0].structure_key(), self.args[1].structure_key())
 
 # Class: Div
 #  Division of two expressions e1 - e2
 
 class Div(Expr):
+    __slots__ = ('args',)
+    _fields = ('args',)
+
     def __init__(self, e1, e2):
         self.args = (e1, e2)
+        self.adopt_children()
     def __repr__(self):
         return '('+ str(self.args[0])+'/'+str(self.args[1])+')'
 
@@ -280,8 +578,17 @@ class Div(Expr):
             raise EvaluationFailedException(f'division by {f2}')
         return f1/f2
 
-    def depth(self):
-        return 1 + max(self.args[0].depth(), self.args[1].depth())
+    def eval_batch(self, X):
+        return self.apply_batch([self.args[0].eval_batch(X), self.args[1].eval_batch(X)], batch_size(X))
+
+    def apply_batch(self, flist, n):
+        (f1, f2) = flist
+        bad = np.abs(f2) <= 1E-10
+        with np.errstate(over='ignore', invalid='ignore'):
+            return mark_failed(f1/np.where(bad, 1.0, f2), bad)
+
+    def make_structure_key(self):
+        return ('/', self.args[0].structure_key(), self.args[1].structure_key())
 
     def num_children(self): 
         return 2
@@ -290,7 +597,7 @@ class Div(Expr):
         assert 0 <= idx < 2
         return self.args[idx] 
 
-    def set_child(self, idx, e_new):
+    def _put_child(self, idx, e_new):
         assert 0 <= idx < 2
         if idx == 0:
             self.args = (e_new, self.args[1]) 
@@ -305,28 +612,37 @@ class Div(Expr):
             return Const(f)
         return Div(e1, e2)
     
+# Functions supported by UnaryFnApplication and their (scalar) implementations.
+# The implementations return None when the function is not defined at f.
+allowed_unary_funs = ['sin','cos','log','exp','atan','tanh','sinh','cosh','sqrt']
+unary_funs = {'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'exp': math.exp,
+    'atan': math.atan,
+    'tanh': math.tanh,
+    'log': lambda f: math.log(f) if f > 0 else None,
+    'sinh': math.sinh,
+    'cosh': math.cosh,
+    'sqrt': lambda f: math.sqrt(f) if f >= 0.0 else None
+}
+
 # Class: UnaryFnApplication
 #  Application of a unary function to a subexpression given by arg.
-#  See self.allowed_fun_list for the functions supported by our current implementation.
+#  See allowed_unary_funs for the functions supported by our current implementation.
 
 class UnaryFnApplication(Expr):
+    __slots__ = ('fn_name', 'arg')
+    _fields = ('fn_name', 'arg')
+    # Shared by all the nodes (see unary_funs)
+    allowed_fun_list = allowed_unary_funs
+    funs = unary_funs
+
     def __init__(self, fn_name, arg):
-        self.allowed_fun_list = ['sin','cos','log','exp','atan','tanh','sinh','cosh','sqrt']
-        self.funs = {'sin': lambda f: math.sin(f),
-        'cos': lambda f: math.cos(f),
-        'tan': lambda f: math.tan(f),
-        'exp': lambda f: math.exp(f),
-        'atan': lambda f: math.atan(f),
-        'tanh': lambda f: math.tanh(f),
-        'log': lambda f: math.log(f) if f > 0 else None,
-        'tanh': lambda f: math.tanh(f),
-        'sinh': lambda f: math.sinh(f),
-        'cosh': lambda f: math.cosh(f),
-        'sqrt': lambda f: math.sqrt(f) if f >= 0.0 else None        
-        }
-        self.fn_name = fn_name 
+        self.fn_name = sys.intern(fn_name)
         self.arg = arg 
-        assert (fn_name in self.allowed_fun_list)
+        self.adopt_children()
+        assert (fn_name in allowed_unary_funs)
     
     def __repr__(self):
         return f'{self.fn_name}({str(self.arg)})'
@@ -341,6 +657,15 @@ class UnaryFnApplication(Expr):
         else:
             return r 
 
+    def eval_batch(self, X):
+        return self.apply_batch([self.arg.eval_batch(X)], batch_size(X))
+
+    def apply_batch(self, flist, n):
+        f = flist[0]
+        assert self.fn_name in batch_funs
+        with np.errstate(over='ignore', invalid='ignore'):
+            return batch_funs[self.fn_name](f)
+
     def simplify(self):
         e = self.arg.simplify()
         if isinstance(e, Const):
@@ -358,11 +683,11 @@ class UnaryFnApplication(Expr):
         assert idx == 0 
         return self.arg
 
-    def set_child(self, idx, e_new):
+    def _put_child(self, idx, e_new):
         assert idx == 0
         self.arg = e_new 
 
-    def depth(self):
-        return 1 + self.arg.depth()
+    def make_structure_key(self):
+        return (self.fn_name, self.arg.structure_key())
     
 
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import math
+import os
+import random
+import tempfile
+import unittest
+from geneticAlgParams import GAParams
+from geneticSearchAlgorithms import curve_fit_using_genetic_algorithm, resume_genetic_algorithm
+
+# A run interrupted halfway and resumed from its checkpoint gives the same results as the
+# run done in one go, in every mode.
+
+n_generations = 6
+pop_size = 40
+
+modes = {'tree': {}, 'dag': {'genome_representation': 'dag'}, 'linear': {'genome_representation': 'linear'},
+         'steady_state': {'steady_state': True}, 'minibatch': {'minibatch_size': 20, 'minibatch_growth': 1.5}}
+
+
+def make_params(settings, checkpoint_path=None):
+    random.seed(2)
+    params = GAParams()
+    params.regression_training_data = [([x], 0.2 * math.exp(x / 4) - math.sin(2 * x))
+                                       for x in [-10.0 + 20.0 * random.random() for i in range(100)]]
+    params.test_points = [[-10.0 + 0.2 * j] for j in range(101)]
+    for (name, value) in settings.items():
+        setattr(params, name, value)
+    params.checkpoint_path = checkpoint_path
+    params.checkpoint_interval = n_generations // 2
+    return params
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_resume_reproduces_uninterrupted_run(self):
+        for (mode, settings) in modes.items():
+            with self.subTest(mode=mode), tempfile.TemporaryDirectory() as path, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                random.seed(7)
+                (_, best_fitness, stats) = curve_fit_using_genetic_algorithm(make_params(settings), ['x'], pop_size,
+                                                                             n_generations)
+                checkpoint_path = os.path.join(path, 'run.npz')
+                random.seed(7)
+                curve_fit_using_genetic_algorithm(make_params(settings, checkpoint_path), ['x'], pop_size,
+                                                  n_generations // 2)
+                # Anything drawn in between must not matter
+                random.seed(99)
+                (_, resumed_fitness, resumed_stats) = resume_genetic_algorithm(make_params(settings), ['x'],
+                                                                               checkpoint_path, n_generations)
+                self.assertEqual(resumed_stats, stats)
+                self.assertEqual(resumed_fitness, best_fitness)
+
+
+if __name__ == '__main__':
+    unittest.main()
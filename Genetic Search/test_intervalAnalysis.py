@@ -0,0 +1,55 @@
+import random
+import unittest
+import numpy as np
+from geneticAlgParams import GAParams
+from makeRandomExpressions import generate_random_expr
+from fitnessAndValidityFunctions import make_batch_env, checkFunctionValidity
+from intervalAnalysis import analyze, bounding_box, SAFE, INVALID
+
+# Soundness of the interval analysis over seeded random expressions: a SAFE expression is
+# viable at the test points (and its values stay inside its interval), an INVALID one is not.
+
+
+# Test point sets (identifiers x, y): wide, narrow, away from 0, around 0 and large values
+def point_sets():
+    rng = np.random.default_rng(3)
+    return [[[float(x), float(y)] for (x, y) in zip(rng.uniform(lo, hi, 30), rng.uniform(lo, hi, 30))]
+            for (lo, hi) in [(-10.0, 10.0), (0.5, 2.0), (-1E-3, 1E-3), (-3.0, -1.0), (100.0, 900.0)]]
+
+
+class IntervalAnalysisTest(unittest.TestCase):
+    def check_soundness(self, params, n_exprs):
+        ids = ['x', 'y']
+        counts = {}
+        for test_points in point_sets():
+            params.test_points = test_points
+            box = bounding_box(make_batch_env(ids, test_points))
+            for depth in [1, 2, 3, 4, 5]:
+                for j in range(n_exprs):
+                    e = generate_random_expr(depth, ids, params)
+                    ((lo, hi), status) = analyze(e, box)
+                    viable = checkFunctionValidity(e, ids, test_points)
+                    counts[status] = counts.get(status, 0) + 1
+                    if status == SAFE:
+                        self.assertTrue(viable, f'{e} is SAFE but fails on {test_points}')
+                        values = e.eval_batch(make_batch_env(ids, test_points))
+                        self.assertTrue(np.all((lo <= values) & (values <= hi)), f'{e} leaves ({lo}, {hi})')
+                    elif status == INVALID:
+                        self.assertFalse(viable, f'{e} is INVALID but passes on {test_points}')
+        # Both verdicts are exercised
+        self.assertGreater(counts.get(SAFE, 0), 0)
+        self.assertGreater(counts.get(INVALID, 0), 0)
+
+    def test_random_expressions(self):
+        random.seed(5)
+        self.check_soundness(GAParams(), 300)
+
+    def test_guided_random_expressions(self):
+        random.seed(6)
+        params = GAParams()
+        params.interval_guided_generation = True
+        self.check_soundness(params, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
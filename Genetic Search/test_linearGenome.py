@@ -0,0 +1,65 @@
+import math
+import pickle
+import random
+import unittest
+import numpy as np
+from geneticAlgParams import GAParams
+from makeRandomExpressions import generate_random_expr
+from fitnessAndValidityFunctions import make_batch_env
+from symbolicExpressions import EvaluationFailedException
+from linearGenome import LinearGenome
+
+# The linearGenome encoding (also used by checkpoints and migrations) over seeded random
+# trees: from_expr/to_expr round trips and evaluations identical to the Expr trees.
+
+
+def random_trees(n, seed):
+    random.seed(seed)
+    params = GAParams()
+    return [generate_random_expr(depth, ['x', 'y'], params) for depth in [0, 1, 2, 3, 4, 5] for j in range(n)]
+
+
+# Value of e.eval(env), None when the evaluation fails
+def scalar_value(e, env):
+    try:
+        return e.eval(env)
+    except (EvaluationFailedException, OverflowError, ValueError):
+        return None
+
+
+class LinearGenomeTest(unittest.TestCase):
+    def test_round_trip(self):
+        for e in random_trees(100, 1):
+            g = LinearGenome.from_expr(e, ['x', 'y'])
+            self.assertEqual(len(g), e.size())
+            self.assertEqual(g.depth(), e.depth())
+            self.assertEqual(g.to_expr().structure_key(), e.structure_key())
+            self.assertEqual(LinearGenome.from_expr(g.to_expr(), ['x', 'y']).structure_key(), g.structure_key())
+            copy = pickle.loads(pickle.dumps(g))
+            self.assertEqual(copy.structure_key(), g.structure_key())
+            self.assertEqual(copy.identifiers, g.identifiers)
+
+    def test_eval_batch_matches_expr(self):
+        rng = np.random.default_rng(2)
+        points = [[float(x), float(y)] for (x, y) in zip(rng.uniform(-10.0, 10.0, 50), rng.uniform(-10.0, 10.0, 50))]
+        points.append([0.0, 0.0])
+        X = make_batch_env(['x', 'y'], points)
+        for e in random_trees(100, 3):
+            g = LinearGenome.from_expr(e, ['x', 'y'])
+            # Same values bit for bit, NaN at the same (failed) points
+            np.testing.assert_array_equal(g.eval_batch(X), e.eval_batch(X), err_msg=str(e))
+
+    def test_eval_matches_expr(self):
+        envs = [{'x': 0.5, 'y': -2.0}, {'x': 0.0, 'y': 0.0}, {'x': 700.0, 'y': -3.0}]
+        for e in random_trees(50, 4):
+            g = LinearGenome.from_expr(e, ['x', 'y'])
+            for env in envs:
+                (expected, value) = (scalar_value(e, env), scalar_value(g, env))
+                if expected is None or value is None:
+                    self.assertEqual(value, expected, str(e))
+                elif not (math.isnan(expected) and math.isnan(value)):
+                    self.assertEqual(value, expected, str(e))
+
+
+if __name__ == '__main__':
+    unittest.main()
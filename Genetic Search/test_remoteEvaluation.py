@@ -0,0 +1,143 @@
+import os
+import random
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+from geneticAlgParams import GAParams
+from trainingData import ColumnarDataset
+from makeRandomExpressions import generate_random_expr
+from fitnessAndValidityFunctions import evaluate_expr
+from remoteEvaluation import LocalWorkers, RemoteEvaluator, _Problem
+
+# Localhost tests of the evaluation workers: results, streaming of the data, and the
+# failure paths (killed worker, client timeout, reset connection, error of a worker).
+
+
+def make_problem(n_rows=500, columnar=True):
+    rng = np.random.default_rng(1)
+    x = rng.uniform(-5.0, 5.0, n_rows)
+    dataset = ColumnarDataset(['x'], {'x': x}, np.sin(x) + 0.5 * x)
+    params = GAParams()
+    params.regression_training_data = dataset if columnar else list(dataset)
+    params.test_points = [[float(v)] for v in np.linspace(-5.0, 5.0, 51)]
+    return (params, ['x'])
+
+
+def random_exprs(params, ids, n):
+    random.seed(2)
+    return [generate_random_expr(4, ids, params) for j in range(n)]
+
+
+def local_results(params, ids, exprs, cutoff=None, rows=None):
+    local_params = params.worker_copy()
+    return [evaluate_expr(e, ids, local_params, cutoff, rows) for e in exprs]
+
+
+class RemoteEvaluationTest(unittest.TestCase):
+    def setUp(self):
+        self.workers = LocalWorkers(2)
+
+    def tearDown(self):
+        self.workers.close()
+
+    def test_results_match_local_evaluation(self):
+        for columnar in [True, False]:
+            (params, ids) = make_problem(columnar=columnar)
+            exprs = random_exprs(params, ids, 200)
+            # Small blocks: the data is streamed in several messages
+            with RemoteEvaluator(params, ids, self.workers.addresses, block_rows=64) as evaluator:
+                self.assertEqual(evaluator.evaluate(exprs), local_results(params, ids, exprs))
+                rows = [0, 7, 42]
+                self.assertEqual(evaluator.evaluate(exprs[:30], 5.0, rows), local_results(params, ids, exprs[:30], 5.0, rows))
+
+    def test_data_loaded_from_shared_path(self):
+        (params, ids) = make_problem()
+        with tempfile.TemporaryDirectory() as path:
+            params.regression_training_data.save(path)
+            params.regression_training_data = ColumnarDataset.load(path, ids)
+            exprs = random_exprs(params, ids, 100)
+            with LocalWorkers(2, data_dir=path) as addresses:
+                with RemoteEvaluator(params, ids, addresses) as evaluator:
+                    self.assertEqual(evaluator.evaluate(exprs), local_results(params, ids, exprs))
+            # Workers without data_dir (self.workers) get the data from the client
+            with RemoteEvaluator(params, ids, self.workers.addresses) as evaluator:
+                self.assertEqual(evaluator.evaluate(exprs), local_results(params, ids, exprs))
+
+    def test_data_path_outside_data_dir_is_ignored(self):
+        (params, ids) = make_problem()
+        with tempfile.TemporaryDirectory() as path:
+            data_path = os.path.join(path, 'data')
+            params.regression_training_data.save(data_path)
+            params.regression_training_data = ColumnarDataset.load(data_path, ids)
+            with RemoteEvaluator(params, ids, self.workers.addresses) as evaluator:
+                (header, arrays) = evaluator.setup_message(params)
+            allowed = os.path.join(path, 'allowed')
+            os.makedirs(allowed)
+            # needs_data: the worker asks the client for the data instead of loading data_path
+            self.assertTrue(_Problem(header, arrays).needs_data())
+            self.assertTrue(_Problem(header, arrays, allowed).needs_data())
+            self.assertFalse(_Problem(header, arrays, path).needs_data())
+            header['data_path'] = os.path.join(allowed, '..', 'data')
+            self.assertTrue(_Problem(header, arrays, allowed).needs_data())
+
+    def test_killed_worker_chunks_are_requeued(self):
+        (params, ids) = make_problem(n_rows=5000)
+        exprs = random_exprs(params, ids, 2000)
+        expected = local_results(params, ids, exprs)
+        with RemoteEvaluator(params, ids, self.workers.addresses, timeout=10.0) as evaluator:
+            killer = threading.Timer(0.05, self.workers.processes[0].kill)
+            killer.start()
+            self.assertEqual(evaluator.evaluate(exprs * 2), expected * 2)
+            killer.join()
+            self.assertEqual(evaluator.evaluate(exprs), expected)
+            self.assertEqual(sum([w.alive() for w in evaluator.workers]), 1)
+            self.workers.processes[1].kill()
+            self.workers.processes[1].join()
+            with self.assertRaises(ConnectionError):
+                evaluator.evaluate(exprs)
+
+    def test_worker_survives_client_timeout(self):
+        (params, ids) = make_problem(n_rows=5000)
+        exprs = random_exprs(params, ids, 2000)
+        with RemoteEvaluator(params, ids, self.workers.addresses) as evaluator:
+            evaluator.timeout = 0.001
+            with self.assertRaises(ConnectionError):
+                evaluator.evaluate(exprs)
+        # The workers dropped the abandoned connections and serve new clients
+        with RemoteEvaluator(params, ids, self.workers.addresses) as evaluator:
+            self.assertEqual(evaluator.evaluate(exprs[:200]), local_results(params, ids, exprs[:200]))
+            self.assertTrue(all([w.alive() for w in evaluator.workers]))
+        self.assertTrue(all([process.is_alive() for process in self.workers.processes]))
+
+    def test_worker_survives_reset_connection(self):
+        (params, ids) = make_problem(n_rows=5000)
+        exprs = random_exprs(params, ids, 2000)
+        evaluator = RemoteEvaluator(params, ids, self.workers.addresses)
+        # Reset the connections while the workers are scoring: their answers cannot be sent
+        for w in evaluator.workers:
+            evaluator.send_chunk(w, 0, exprs, None, None)
+            w.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            w.sock.close()
+        time.sleep(0.5)
+        self.assertTrue(all([process.is_alive() for process in self.workers.processes]))
+        with RemoteEvaluator(params, ids, self.workers.addresses) as evaluator:
+            self.assertEqual(evaluator.evaluate(exprs[:200]), local_results(params, ids, exprs[:200]))
+
+    def test_worker_error_leaves_no_stale_answers(self):
+        (params, ids) = make_problem()
+        exprs = random_exprs(params, ids, 400)
+        with RemoteEvaluator(params, ids, self.workers.addresses) as evaluator:
+            # Rows outside the data make the workers fail
+            with self.assertRaises(RuntimeError):
+                evaluator.evaluate(exprs, rows=[10 ** 9])
+            self.assertFalse(any([w.outstanding for w in evaluator.workers]))
+            self.assertTrue(all([process.is_alive() for process in self.workers.processes]))
+            self.assertEqual(evaluator.evaluate(exprs), local_results(params, ids, exprs))
+
+
+if __name__ == '__main__':
+    unittest.main()
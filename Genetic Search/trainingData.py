@@ -0,0 +1,159 @@
+import csv
+import json
+import os
+import numpy as np
+
+# Columnar training data
+#
+# GAParams.regression_training_data is normally a list of ([x1, x2, ...], y) tuples.
+# For large data sets a ColumnarDataset can be used instead: it keeps one contiguous
+# numpy array per identifier plus one for the targets, optionally memory mapped from
+# disk so that data sets larger than RAM can be used. The evaluators in
+# fitnessAndValidityFunctions read the columns directly (in chunks of
+# params.eval_chunk_size rows) instead of building one environment per row.
+#
+# On disk a data set is a directory with one .npy file per column and a small
+# dataset.json describing them (see save/load). from_csv converts a CSV file to that
+# format one block of rows at a time, so the CSV never has to fit in memory.
+
+class ColumnarDataset:
+    def __init__(self, lst_of_identifiers, columns, y):
+        self.identifiers = list(lst_of_identifiers)
+        # identifier -> 1D array of its values (one per row)
+        self.columns = columns
+        self.y = y
+        # (path, mmap) when the data was loaded from disk, see __reduce__
+        self.source = None
+        for id in self.identifiers:
+            assert len(columns[id]) == len(y), f'column {id} has {len(columns[id])} rows, expected {len(y)}'
+
+    def __len__(self):
+        return len(self.y)
+
+    # Memory mapped data sets are pickled (e.g. when sent to worker processes) as the
+    # location of their files, so that every process maps the same files instead of
+    # receiving a copy of the data.
+    def __reduce__(self):
+        if self.source is not None and self.source[1]:
+            return (ColumnarDataset.load, (self.source[0], self.identifiers, True))
+        return (ColumnarDataset, (self.identifiers, {id: np.asarray(self.columns[id]) for id in self.identifiers}, np.asarray(self.y)))
+
+    # Iterating gives the same ([x1, x2, ...], y) rows as the list representation
+    def __iter__(self):
+        for i in range(len(self.y)):
+            yield ([float(self.columns[id][i]) for id in self.identifiers], float(self.y[i]))
+
+    def __getitem__(self, i):
+        return ([float(self.columns[id][i]) for id in self.identifiers], float(self.y[i]))
+
+    # Column environment (see Expr.eval_batch) for rows start..stop
+    def columns_env(self, lst_of_identifiers, start=0, stop=None):
+        return {id: self.columns[id][start:stop] for id in lst_of_identifiers}
+
+    # (min, max) of the values of an identifier
+    def column_range(self, id):
+        col = self.columns[id]
+        return (float(np.min(col)), float(np.max(col)))
+
+    @staticmethod
+    def from_points(lst_of_identifiers, regression_training_data):
+        n = len(regression_training_data)
+        points = np.array([test_pt for (test_pt, _) in regression_training_data], dtype=float).reshape(n, -1)
+        columns = {id: np.ascontiguousarray(points[:, j]) for (j, id) in enumerate(lst_of_identifiers)}
+        y = np.array([y for (_, y) in regression_training_data], dtype=float)
+        return ColumnarDataset(lst_of_identifiers, columns, y)
+
+    # Write the data set as a directory of .npy files (one per column)
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for id in self.identifiers:
+            np.save(os.path.join(path, _column_file(id)), np.asarray(self.columns[id], dtype=float))
+        np.save(os.path.join(path, _target_file), np.asarray(self.y, dtype=float))
+        _write_description(path, self.identifiers, len(self.y))
+
+    # Load a data set written by save/from_csv, or a single 2D .npy file whose
+    # columns are the identifiers followed by the target.
+    # With mmap the arrays are memory mapped (read only) instead of read into memory.
+    @staticmethod
+    def load(path, lst_of_identifiers=None, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        if os.path.isdir(path):
+            with open(os.path.join(path, _description_file)) as f:
+                description = json.load(f)
+            identifiers = description['identifiers'] if lst_of_identifiers is None else lst_of_identifiers
+            columns = {id: np.load(os.path.join(path, _column_file(id)), mmap_mode=mmap_mode) for id in identifiers}
+            y = np.load(os.path.join(path, _target_file), mmap_mode=mmap_mode)
+            dataset = ColumnarDataset(identifiers, columns, y)
+        else:
+            table = np.load(path, mmap_mode=mmap_mode)
+            assert table.ndim == 2 and lst_of_identifiers is not None and table.shape[1] == len(lst_of_identifiers) + 1, \
+                'expected a 2D array with one column per identifier followed by the target column'
+            columns = {id: table[:, j] for (j, id) in enumerate(lst_of_identifiers)}
+            dataset = ColumnarDataset(lst_of_identifiers, columns, table[:, -1])
+        dataset.source = (path, mmap)
+        return dataset
+
+    # Read a CSV file with a header row. lst_of_identifiers are the input columns
+    # (by default all columns except target), target is the name of the output column.
+    # If out_dir is given the data is converted to a data set directory there and
+    # memory mapped, reading block_rows rows of the CSV at a time; otherwise it is
+    # read into memory.
+    @staticmethod
+    def from_csv(path, lst_of_identifiers=None, target='y', out_dir=None, block_rows=1000000):
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            header = [name.strip() for name in next(reader)]
+            n = sum(1 for row in reader if not _blank_row(row))
+        identifiers = [name for name in header if name != target] if lst_of_identifiers is None else list(lst_of_identifiers)
+        names = identifiers + [target]
+        positions = [header.index(name) for name in names]
+        if out_dir is None:
+            outputs = [np.empty(n) for name in names]
+        else:
+            os.makedirs(out_dir, exist_ok=True)
+            files = [_column_file(id) for id in identifiers] + [_target_file]
+            outputs = [np.lib.format.open_memmap(os.path.join(out_dir, file), mode='w+', dtype=float, shape=(n,))
+                       for file in files]
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            start = 0
+            block = []
+            for row in reader:
+                if _blank_row(row):
+                    continue
+                block.append([row[p] for p in positions])
+                if len(block) == block_rows:
+                    start = _store_block(outputs, start, block)
+                    block = []
+            _store_block(outputs, start, block)
+        if out_dir is None:
+            return ColumnarDataset(identifiers, dict(zip(identifiers, outputs[:-1])), outputs[-1])
+        for out in outputs:
+            out.flush()
+        del outputs
+        _write_description(out_dir, identifiers, n)
+        return ColumnarDataset.load(out_dir, identifiers)
+
+
+_description_file = 'dataset.json'
+_target_file = 'target.npy'
+
+def _column_file(id):
+    return f'column_{id}.npy'
+
+def _write_description(path, lst_of_identifiers, n):
+    with open(os.path.join(path, _description_file), 'w') as f:
+        json.dump({'identifiers': list(lst_of_identifiers), 'rows': n}, f)
+
+# Empty lines (or lines of blank fields only) are not rows
+def _blank_row(row):
+    return all([field.strip() == '' for field in row])
+
+def _store_block(outputs, start, block):
+    if len(block) == 0:
+        return start
+    values = np.array(block, dtype=float)
+    for (j, out) in enumerate(outputs):
+        out[start:start + len(block)] = values[:, j]
+    return start + len(block)